@@ -0,0 +1,170 @@
+"""
+Benchmark the expensive steps of the calibration pipeline on synthetic data.
+
+Every benchmark is run at each dataset size and reports wall time, memory
+allocated while it ran (via tracemalloc) and, for the optimizers, the number
+of reprojection-error evaluations. Results are written as JSON so that runs
+before and after a change can be compared.
+
+Example:
+    python benchmarks/benchmark_hot_paths.py --sizes 10 100 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gui"))
+import charuco_utils  # noqa: E402
+import image_sonar_utils as isc  # noqa: E402
+import synthetic_data  # noqa: E402
+
+DEFAULT_SIZES = (10, 100, 1000)
+# Extrinsic used to generate the synthetic correspondences
+TRUE_RVEC = (1.2092, 1.2092, 1.2092)
+TRUE_TVEC = (0.2, -0.16, 0.1)
+# Rendering thousands of unique images would dominate the run time, so the
+# image benchmarks cycle through a small pool of distinct frames.
+IMAGE_POOL = 8
+IMAGE_SIZE = (1280, 960)
+CAMERA_MTX = np.array([[1020.8, 0.0, 640.0],
+                       [0.0, 1022.5, 480.0],
+                       [0.0, 0.0, 1.0]])
+CAMERA_DST = np.zeros((1, 5))
+
+
+class EvaluationCounter():
+    """Count calls to isc.calc_projection_error while active."""
+
+    def __init__(self):
+        self.count = 0
+        self._original = isc.calc_projection_error
+
+    def __enter__(self):
+        def counted(*args, **kwargs):
+            self.count += 1
+            return self._original(*args, **kwargs)
+        isc.calc_projection_error = counted
+        return self
+
+    def __exit__(self, *exc):
+        isc.calc_projection_error = self._original
+
+
+def measure(fn, repeat=1):
+    """
+    Run fn once under tracemalloc to record allocations, then time it
+    `repeat` times without tracing. Returns a dict of results.
+    """
+    with EvaluationCounter() as counter:
+        tracemalloc.start()
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics("filename")
+        tracemalloc.stop()
+    evaluations = counter.count
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {"wall_s": min(times),
+            "wall_s_mean": float(np.mean(times)),
+            "alloc_peak_bytes": peak,
+            "alloc_retained_bytes": current,
+            "alloc_retained_blocks": sum(stat.count for stat in stats),
+            "function_evaluations": evaluations}
+
+
+def make_sonar(tmpdir):
+    crop_json = os.path.join(tmpdir, "sonar_cropping_params.json")
+    with open(crop_json, "w") as file:
+        json.dump(synthetic_data.make_cropping_params(), file)
+    return isc.SonarInfo(3.0, False, crop_json)
+
+
+def make_image_pools(sonar, rng):
+    _, board = charuco_utils.make_charuco_board()
+    _, _, sonar_coords = isc.init_charuco_sonar()
+    rvecs, tvecs = synthetic_data.random_board_poses(IMAGE_POOL, rng)
+    camera_images = [synthetic_data.render_charuco_image(board, CAMERA_MTX, rvecs[ii], tvecs[ii], IMAGE_SIZE)
+                     for ii in range(IMAGE_POOL)]
+
+    sonar_images = []
+    for _ in range(IMAGE_POOL):
+        angles = rng.uniform(-0.45, 0.45, len(sonar_coords)) * sonar.aper
+        ranges = rng.uniform(0.3, 0.9, len(sonar_coords)) * sonar.range
+        sonar_images.append(synthetic_data.render_sonar_image(sonar, angles, ranges, rng))
+    return board, camera_images, sonar_images
+
+
+def run_benchmarks(sizes, repeat, seed):
+    rng = np.random.default_rng(seed)
+    results = {"meta": {"python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "numpy": np.__version__,
+                        "sizes": list(sizes),
+                        "repeat": repeat,
+                        "seed": seed},
+               "benchmarks": []}
+
+    def record(name, nframes, fn, reps=repeat):
+        print("{} ({} frames)...".format(name, nframes), flush=True)
+        entry = {"name": name, "frames": nframes}
+        entry.update(measure(fn, reps))
+        results["benchmarks"].append(entry)
+        print("    {:.4f} s".format(entry["wall_s"]))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sonar = make_sonar(tmpdir)
+        board, camera_images, sonar_images = make_image_pools(sonar, rng)
+
+        # Independent of the number of frames, only depends on sonar geometry
+        record("create_transform_map", 1, lambda: isc.create_transform_map(sonar))
+        polar_transform = isc.create_transform_map(sonar)
+        cropped_images = [isc.crop_sonar_arc(image, sonar) for image in sonar_images]
+
+        for nframes in sizes:
+            frames = range(nframes)
+            record("crop_sonar_arc", nframes, lambda: [
+                isc.crop_sonar_arc(sonar_images[ii % IMAGE_POOL], sonar) for ii in frames])
+            record("polar_remap", nframes, lambda: [
+                isc.polar_sonar_image(cropped_images[ii % IMAGE_POOL], polar_transform) for ii in frames])
+            record("detect_charuco_board", nframes, lambda: [
+                charuco_utils.detect_charuco_board(board, camera_images[ii % IMAGE_POOL], CAMERA_MTX, CAMERA_DST)
+                for ii in frames])
+
+            calibration_results = synthetic_data.synthetic_correspondences(
+                sonar, TRUE_RVEC, TRUE_TVEC, nframes, rng)
+            # One single-frame solve per frame, as done by the gui on every update
+            record("calibrate_sonar", nframes, lambda: [
+                isc.calibrate_sonar(sonar_pts, camera_pts, sonar)
+                for _, sonar_pts, camera_pts in calibration_results.values()], reps=1)
+            record("multi_calibration", nframes, lambda: isc.multi_calibrate(
+                calibration_results, list(calibration_results.keys()), sonar), reps=1)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="numbers of frames to benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed repetitions of the cheaper benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repeat, args.seed)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    print("Results saved to {}".format(args.output))
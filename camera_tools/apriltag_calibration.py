@@ -1,6 +1,7 @@
 import cv2
 import glob
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # # load the input image and convert it to grayscale
 # print("[INFO] loading image...")
@@ -41,68 +42,63 @@ ARUCO_DICT = {
 	"DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
 }
 
-def get_calibration_parameters():
-    # Define the aruco dictionary, charuco board and detector
-    #board = cv2.aruco.Board((BOARD_COLS, BOARD_ROWS), SQUARE_LENGTH, MARKER_LENGTH, dictionary)
-    #cols then rows, the wrong order caused problems earlier
-    #detector = cv2.aruco.CharucoDetector(board)
-    
-    all_corners = []
-    all_ids = []
-    counter = []
+IMAGE_GLOB = 'C:/Users/corri/OneDrive/Documents/SonarExperimentData/underwater_camera/arucoboard/good/*.png'
 
-    # Load images from directory
-    images = glob.glob('C:/Users/corri/OneDrive/Documents/SonarExperimentData/underwater_camera/arucoboard/good/*.png')
-    first = True
-    # Loop over images and extraction of corners
-    for image_file in images:
-        #print(image_file)
-        image = cv2.imread(image_file)
-        image_copy = image.copy()
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        #image = cv2.resize(image, None, None, fx = .25, fy = .25)
-        imgSize = image.shape
-        
-        corners, ids, rejectedImgPoints = cv2.aruco.detectMarkers(image, dictionary)
-        if first == True:
-            all_corners = corners
-            all_ids = ids
-            first = False
-        elif corners:
-            print(corners)
-            all_corners = np.vstack((all_corners, corners))
-            all_ids = np.vstack((all_ids,ids))
-            counter.append(len(ids))
-        print('Found {} unique markers'.format(np.unique(ids)))
-        #charucoCorners, charucoIds, marker_corners, marker_ids = detector.detectBoard(image)
-        
-        # for mark in marker_corners:
-        #     x, y = mark[0][0]
-        #     cv2.circle(image_copy, (int(x), int(y)), 4, (0, 255, 0), -1)
+# Detector for the current worker process
+_detector = None
 
-        # cv2.aruco.drawDetectedMarkers(image_copy, corners, ids, borderColor=(255, 0, 0))
-        # cv2.imwrite("test_images/points.jpg", image_copy)
+def detect_markers(image_file):
+    """
+    Detect the tags in one image.
+    Returns (corners (M,1,4,2), ids (M,1), image_size); corners is None if no tags were found.
+    """
+    global _detector
+    if _detector is None:
+        _detector = cv2.aruco.ArucoDetector(dictionary)
+    image = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
+    #image = cv2.resize(image, None, None, fx = .25, fy = .25)
+    imgSize = image.shape[::-1]
+    corners, ids, rejectedImgPoints = _detector.detectMarkers(image)
+    if ids is None or len(ids) == 0:
+        return None, None, imgSize
+    return np.array(corners, dtype=np.float32), ids, imgSize
 
-        # cv2.imshow('img', image_copy)
-        # cv2.waitKey(100)
+def get_calibration_parameters(images=None, workers=None):
+    """
+    Detections are streamed in from a worker pool into lists, with the
+    number of markers of each image in counter, and concatenated once.
+    """
+    if images is None:
+        images = sorted(glob.glob(IMAGE_GLOB))
 
-        #print(charucoCorners, marker_corners)
+    all_corners = []
+    all_ids = []
+    counter = []
+    imgSize = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_file, (corners, ids, size) in zip(images, executor.map(detect_markers, images, chunksize=4)):
+            imgSize = size
+            if corners is None:
+                print('{}: no markers'.format(image_file))
+                continue
+            all_corners.append(corners)
+            all_ids.append(ids)
+            counter.append(len(ids))
+            print('{}: found markers {}'.format(image_file, np.unique(ids)))
 
-        # Calibrate camera with extracted information
-        # if charucoCorners is not None and charucoIds is not None and len(charucoCorners) > 3:
-        #     all_corners.append(charucoCorners)
-        #     all_ids.append(charucoIds)
-    counter = np.array(counter)
-    if len(all_corners) > 0:
-        #print(all_corners, "\n", all_ids, "\n", counter)
+    if counter:
+        all_corners = np.concatenate(all_corners)
+        all_ids = np.concatenate(all_ids)
+        counter = np.array(counter)
         result, mtx, dist, rvecs, tvecs = cv2.aruco.calibrateCameraAruco(all_corners, all_ids, counter, board, imgSize, None, None)
     else:
         mtx, dist = [], []
 
     return mtx, dist
 
-mtx, dist = get_calibration_parameters()
-print(mtx, dist)
+if __name__ == "__main__":
+    mtx, dist = get_calibration_parameters()
+    print(mtx, dist)
 # [[295.48016553   0.         494.4936379 ]
 #  [  0.         219.98477132 369.32578704]
-#  [  0.           0.           1.        ]] [[-0.13305307 -0.00186581  0.00769798  0.00511768  0.00152419]]
\ No newline at end of file
+#  [  0.           0.           1.        ]] [[-0.13305307 -0.00186581  0.00769798  0.00511768  0.00152419]]
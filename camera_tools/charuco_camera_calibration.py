@@ -1,59 +1,232 @@
 import cv2
 import numpy as np
 import os
+import sys
 import json
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-ARUCO_DICT_ID = cv2.aruco.DICT_4X4_250
-BOARD_ROWS = 8
-BOARD_COLS = 11
-SQUARE_LENGTH = .026       
-MARKER_LENGTH = .0195           
-MARGIN_PX = 0   
-
-
-def get_calibration_parameters(img_dir):
-    # Define the aruco dictionary, charuco board and detector
-    dictionary = cv2.aruco.getPredefinedDictionary(ARUCO_DICT_ID)
-    board = cv2.aruco.CharucoBoard((BOARD_COLS, BOARD_ROWS), SQUARE_LENGTH, MARKER_LENGTH, dictionary)
-    #cols then rows, the wrong order caused problems earlier
-    detector = cv2.aruco.CharucoDetector(board)
-    
-    all_corners = []
-    all_ids = []
+# The board geometry comes from the gui's target spec
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gui"))
+import charuco_utils
 
-    # Load images from directory
-    image_files = [os.path.join(img_dir, f) for f in os.listdir(img_dir) if f.endswith(".png")]
-    
-    # Loop over images and extraction of corners
-    for image_file in image_files:
-        #print(image_file)
-        image = cv2.imread(image_file)
-        image_copy = image.copy()
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        #image = cv2.resize(image, None, None, fx = .25, fy = .25)
-        imgSize = image.shape
-        
-        
-        charucoCorners, charucoIds, marker_corners, marker_ids = detector.detectBoard(image)
-        
-        # for mark in marker_corners:
-        #     x, y = mark[0][0]
-        #     cv2.circle(image_copy, (int(x), int(y)), 4, (0, 255, 0), -1)
+# Detections are cached in a folder given by the caller (never the image folder,
+# which the gui lists as camera data), keyed by file contents and board
+# configuration, so rerunning the calibration only detects new images
+CACHE_FILENAME = "charuco_detections.pkl"
+
+# View selection: at most MAX_VIEWS images are passed to calibrateCameraCharuco.
+# Views are chosen to cover as many cells of a GRID_COLS x GRID_ROWS grid over
+# the image, and as many (tilt, distance) bins, as possible. The board pose used
+# for binning comes from a rough calibration on ROUGH_VIEWS evenly spaced images.
+MAX_VIEWS = 40
+ROUGH_VIEWS = 15
+GRID_COLS = 8
+GRID_ROWS = 6
+TILT_BINS_DEG = (10, 20, 35, 50)
+DISTANCE_BINS = 4
+
+def make_board():
+    _, board = charuco_utils.make_charuco_board()
+    return board
+
+def board_config():
+    return charuco_utils.board_config()
+
+def file_hash(filename):
+    with open(filename, "rb") as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
 
+def detect_corners(image_file):
+    """
+    Detect the charuco board in one image.
+    Returns (charucoCorners, charucoIds, marker_corners, marker_ids, image_size).
+    """
+    image = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
+    #image = cv2.resize(image, None, None, fx = .25, fy = .25)
+    charucoCorners, charucoIds, marker_corners, marker_ids = charuco_utils.get_detector().detectBoard(image)
+    return charucoCorners, charucoIds, marker_corners, marker_ids, image.shape[::-1]
+
+def load_cache(cache_dir):
+    filename = os.path.join(cache_dir, CACHE_FILENAME)
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, "rb") as fp:
+            return pickle.load(fp)
+    except Exception as ex:
+        print("Could not read detection cache {}, detecting all images".format(filename))
+        print(ex)
+        return {}
+
+def save_cache(cache_dir, cache):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(os.path.join(cache_dir, CACHE_FILENAME), "wb") as fp:
+        pickle.dump(cache, fp)
+
+def detect_all(image_files, cache_dir=None, workers=None):
+    """
+    Detect the board in every image, in parallel, reusing the detections cached
+    in cache_dir (no caching if it is None). Entries for images that are no
+    longer present are dropped from the cache.
+    Returns a list of detections in the same order as image_files.
+    """
+    config = board_config()
+    cache = load_cache(cache_dir) if cache_dir is not None else {}
+    keys = [(file_hash(image_file), config) for image_file in image_files]
+    current = set(keys)
+    stale = [key for key in cache if key not in current]
+    for key in stale:
+        del cache[key]
+    missing = [ii for ii, key in enumerate(keys) if key not in cache]
+    print("Detecting {} images ({} cached)".format(len(missing), len(image_files) - len(missing)))
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            detections = executor.map(detect_corners, [image_files[ii] for ii in missing], chunksize=4)
+            for ii, detection in zip(missing, detections):
+                cache[keys[ii]] = detection
+    if cache_dir is not None and (missing or stale):
+        save_cache(cache_dir, cache)
+
+    return [cache[key] for key in keys]
+
+def show_detections(image_files, detections, wait_ms=500):
+    for image_file, (_, _, marker_corners, marker_ids, _) in zip(image_files, detections):
+        image_copy = cv2.imread(image_file)
         cv2.aruco.drawDetectedMarkers(image_copy, marker_corners, marker_ids, borderColor=(255, 0, 0))
         # cv2.imwrite("test_images/points.jpg", image_copy)
         cv2.imshow('img', image_copy)
-        cv2.waitKey(500)
+        cv2.waitKey(wait_ms)
+    cv2.destroyAllWindows()
+
+def view_coverage(all_corners, all_ids, board, imgSize):
+    """
+    Describe what each view contributes to a calibration.
 
-        #print(charucoCorners, marker_corners)
+    Returns, per view, the set of image grid cells containing corners and a
+    (tilt bin, tilt direction, distance bin) tuple for the board pose. Poses are
+    estimated with a rough calibration from a few evenly spaced views.
+    """
+    width, height = imgSize
+    cells = []
+    for corners in all_corners:
+        pts = corners.reshape(-1, 2)
+        col = np.clip((pts[:, 0] * GRID_COLS / width).astype(int), 0, GRID_COLS - 1)
+        row = np.clip((pts[:, 1] * GRID_ROWS / height).astype(int), 0, GRID_ROWS - 1)
+        cells.append(set(row * GRID_COLS + col))
 
+    rough = np.linspace(0, len(all_corners) - 1, min(ROUGH_VIEWS, len(all_corners))).astype(int)
+    _, mtx, dist, _, _ = cv2.aruco.calibrateCameraCharuco(
+        [all_corners[ii] for ii in rough], [all_ids[ii] for ii in rough], board, imgSize, None, None)
+
+    tilts = np.full(len(all_corners), np.nan)
+    directions = np.zeros(len(all_corners), dtype=int)
+    distances = np.full(len(all_corners), np.nan)
+    for ii, (corners, ids) in enumerate(zip(all_corners, all_ids)):
+        ok, rvec, tvec = cv2.aruco.estimatePoseCharucoBoard(corners, ids, board, mtx, dist, np.empty(1), np.empty(1))
+        if not ok:
+            continue
+        rot, _ = cv2.Rodrigues(rvec)
+        normal = rot[:, 2]
+        tilts[ii] = np.degrees(np.arccos(abs(normal[2])))
+        # Which way the board is tilted, in quadrants around the optical axis
+        directions[ii] = int(((np.arctan2(normal[1], normal[0]) + np.pi) / (np.pi / 2))) % 4
+        distances[ii] = np.linalg.norm(tvec)
+
+    tilt_bins = np.digitize(tilts, TILT_BINS_DEG)
+    directions[tilt_bins == 0] = 0
+    valid = np.isfinite(distances)
+    edges = np.quantile(distances[valid], np.linspace(0, 1, DISTANCE_BINS + 1)[1:-1]) if valid.any() else []
+    distance_bins = np.digitize(distances, edges)
+    poses = [(int(t), int(d), int(r)) if ok else None
+             for t, d, r, ok in zip(tilt_bins, directions, distance_bins, valid)]
+    return cells, poses
+
+def select_views(all_corners, all_ids, board, imgSize, max_views=MAX_VIEWS):
+    """
+    Greedily pick at most max_views views, each time taking the view that adds
+    the most uncovered grid cells and pose bins (ties go to more corners).
+    Returns the indices of the selected views.
+    """
+    if len(all_corners) <= max_views:
+        return list(range(len(all_corners)))
+
+    cells, poses = view_coverage(all_corners, all_ids, board, imgSize)
+    # A new pose bin is worth as much as a few new cells
+    pose_weight = 4
+    ncorners = [len(corners) for corners in all_corners]
+    covered_cells, covered_poses = set(), set()
+    remaining = set(range(len(all_corners)))
+    selected = []
+    while remaining and len(selected) < max_views:
+        def gain(ii):
+            new_pose = poses[ii] is not None and poses[ii] not in covered_poses
+            return (len(cells[ii] - covered_cells) + pose_weight * new_pose, ncorners[ii])
+        best = max(remaining, key=gain)
+        if gain(best)[0] == 0:
+            # Everything is covered; fill up with the views that have the most corners
+            best = max(remaining, key=lambda ii: ncorners[ii])
+        selected.append(best)
+        remaining.discard(best)
+        covered_cells |= cells[best]
+        if poses[best] is not None:
+            covered_poses.add(poses[best])
+    print("Selected {} of {} views, covering {} of {} image cells and {} pose bins".format(
+        len(selected), len(all_corners), len(covered_cells), GRID_COLS * GRID_ROWS, len(covered_poses)))
+    return sorted(selected)
+
+def calibrate_views(all_corners, all_ids, board, imgSize, refine_iterations=0, drop_fraction=0.1):
+    """
+    Calibrate, then optionally repeat: drop the views with the worst
+    reprojection error and recalibrate.
+    """
+    views = list(range(len(all_corners)))
+    for iteration in range(refine_iterations + 1):
+        (result, mtx, dist, rvecs, tvecs, _, _, per_view_errors) = cv2.aruco.calibrateCameraCharucoExtended(
+            [all_corners[ii] for ii in views], [all_ids[ii] for ii in views], board, imgSize, None, None)
+        print("Calibration with {} views: reprojection error {:.3f}".format(len(views), result))
+        ndrop = int(len(views) * drop_fraction)
+        if iteration == refine_iterations or ndrop == 0 or len(views) - ndrop < ROUGH_VIEWS:
+            break
+        order = np.argsort(np.ravel(per_view_errors))
+        views = sorted(views[ii] for ii in order[:len(views) - ndrop])
+    return mtx, dist
+
+def get_calibration_parameters(img_dir, visualize=False, workers=None, cache_dir=None,
+                               max_views=MAX_VIEWS, refine_iterations=0):
+    """
+    Set max_views=None to calibrate with every view. Detections are cached in
+    cache_dir if given; it must not be img_dir.
+    """
+    if cache_dir is not None and os.path.abspath(cache_dir) == os.path.abspath(img_dir):
+        raise Exception("The detection cache can't be written to the image folder {}".format(img_dir))
+    board = make_board()
+
+    # Load images from directory
+    image_files = sorted(os.path.join(img_dir, f) for f in os.listdir(img_dir) if f.endswith(".png"))
+    detections = detect_all(image_files, cache_dir, workers)
+    if visualize:
+        show_detections(image_files, detections)
+
+    all_corners = []
+    all_ids = []
+    imgSize = None
+    for charucoCorners, charucoIds, _, _, image_size in detections:
+        imgSize = image_size
         # Calibrate camera with extracted information
         if charucoCorners is not None and charucoIds is not None and len(charucoCorners) > 3:
             all_corners.append(charucoCorners)
             all_ids.append(charucoIds)
 
     if all_ids and all_corners:
-        result, mtx, dist, rvecs, tvecs = cv2.aruco.calibrateCameraCharuco(all_corners, all_ids, board, imgSize, None, None)
+        if max_views is not None:
+            selected = select_views(all_corners, all_ids, board, imgSize, max_views)
+            all_corners = [all_corners[ii] for ii in selected]
+            all_ids = [all_ids[ii] for ii in selected]
+        mtx, dist = calibrate_views(all_corners, all_ids, board, imgSize, refine_iterations)
     else:
         mtx, dist = [], []
 
@@ -61,12 +234,14 @@ def get_calibration_parameters(img_dir):
 
 OUTPUT_JSON = 'underwater_cam.json'
 
-mtx, dist = get_calibration_parameters(img_dir='C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-21-2025/camera')
-
-data = {"mtx": mtx.tolist(), "dist": dist.tolist()} #"sensor": SENSOR, "lens": LENS, 
+if __name__ == "__main__":
+    # Set visualize=True to step through the detections (0.5 s per image)
+    rootdir = 'C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-21-2025'
+    mtx, dist = get_calibration_parameters(img_dir=f'{rootdir}/camera', cache_dir=f'{rootdir}/output/camera_calibration')
 
-with open(OUTPUT_JSON, 'w') as json_file:
-    json.dump(data, json_file, indent=4)
+    data = {"mtx": mtx.tolist(), "dist": dist.tolist()} #"sensor": SENSOR, "lens": LENS,
 
-print(f'Data has been saved to {OUTPUT_JSON}')
+    with open(OUTPUT_JSON, 'w') as json_file:
+        json.dump(data, json_file, indent=4)
 
+    print(f'Data has been saved to {OUTPUT_JSON}')
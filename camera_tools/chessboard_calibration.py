@@ -1,49 +1,108 @@
 import numpy as np
 import cv2 as cv
 import glob
+from concurrent.futures import ProcessPoolExecutor
+
+# Inner corners of the chessboard (columns, rows)
+BOARD_SIZE = (6, 6)
+# The board is searched for in a copy of the image downscaled to at most this
+# width, then at full resolution if it wasn't found; the corners are refined
+# with cornerSubPix at full resolution
+DETECT_MAX_WIDTH = 800
+SUBPIX_WINDOW = (11, 11)
 
 # termination criteria
 criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
 # prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(6,5,0)
-objp = np.zeros((6*6,3), np.float32)
-objp[:,:2] = np.mgrid[0:6,0:6].T.reshape(-1,2)
+objp = np.zeros((BOARD_SIZE[0]*BOARD_SIZE[1],3), np.float32)
+objp[:,:2] = np.mgrid[0:BOARD_SIZE[0],0:BOARD_SIZE[1]].T.reshape(-1,2)
 
-# Arrays to store object points and image points from all the images.
-objpoints = [] # 3d point in real world space
-imgpoints = [] # 2d points in image plane.
+def detect_chessboard(fname):
+    """
+    Find the chessboard corners in one image.
+    Returns (corners, image_size); corners is None if there is no board.
+    """
+    gray = cv.imread(fname, cv.IMREAD_GRAYSCALE)
+    image_size = gray.shape[::-1]
+    scale = min(1.0, DETECT_MAX_WIDTH / gray.shape[1])
+    small = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA) if scale < 1 else gray
 
-# Fill in filename here
-images = glob.glob('C:/Users/.../*.png')
+    # FAST_CHECK rejects images without a board before the expensive search
+    flags = cv.CALIB_CB_ADAPTIVE_THRESH + cv.CALIB_CB_NORMALIZE_IMAGE + cv.CALIB_CB_FAST_CHECK
+    ret, corners = cv.findChessboardCorners(small, BOARD_SIZE, flags=flags)
+    if not ret and scale < 1:
+        # A board that is small in the frame may only be found at full resolution
+        ret, corners = cv.findChessboardCorners(gray, BOARD_SIZE, flags=flags)
+        scale = 1.0
+    if not ret:
+        return None, image_size
 
-for fname in images:
-    img = cv.imread(fname)
-    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    # Map back to full resolution (pixel centers) and refine there
+    corners = ((corners + 0.5) / scale - 0.5).astype(np.float32)
+    corners = cv.cornerSubPix(gray, corners, SUBPIX_WINDOW, (-1,-1), criteria)
+    return corners, image_size
 
-    # Find the chess board corners
-    ret, corners = cv.findChessboardCorners(gray, (6,6), None)
+def detect_all(images, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(detect_chessboard, images, chunksize=4))
 
-    # If found, add object points, image points (after refining them)
-    if ret == True:
-        objpoints.append(objp)
+def show_detections(images, imgpoints, wait_ms=50):
+    for fname, corners in zip(images, imgpoints):
+        img = cv.imread(fname)
+        cv.drawChessboardCorners(img, BOARD_SIZE, corners, True)
+        cv.imshow('img', img)
+        cv.waitKey(wait_ms)
+    cv.destroyAllWindows()
 
-        corners2 = cv.cornerSubPix(gray,corners, (11,11), (-1,-1), criteria)
-        imgpoints.append(corners2)
+def reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist):
+    """
+    RMS reprojection error (pixels) of every image.
+    All views are moved into the camera frame and projected in a single call.
+    """
+    objpoints = np.asarray(objpoints, dtype=np.float64)             # (N, P, 3)
+    imgpoints = np.asarray(imgpoints, dtype=np.float64).reshape(len(objpoints), -1, 2)
+    rotations = np.array([cv.Rodrigues(rvec)[0] for rvec in rvecs])  # (N, 3, 3)
+    translations = np.array(tvecs).reshape(-1, 1, 3)
+    camera_points = np.einsum("nij,npj->npi", rotations, objpoints) + translations
+    projected, _ = cv.projectPoints(camera_points.reshape(-1, 3), np.zeros(3), np.zeros(3), mtx, dist)
+    residuals = projected.reshape(imgpoints.shape) - imgpoints
+    return np.sqrt(np.mean(np.sum(residuals**2, axis=2), axis=1))
 
-        # Draw and display the corners
-        cv.drawChessboardCorners(img, (6,6), corners2, ret)
-        cv.imshow('img', img)
-        cv.waitKey(50)
+def calibrate(images, workers=None, visualize=False):
+    """
+    Calibrate from a list of image files.
+    Returns mtx, dist, the files that were used and their reprojection errors.
+    """
+    # Arrays to store object points and image points from all the images.
+    objpoints = [] # 3d point in real world space
+    imgpoints = [] # 2d points in image plane.
+    used = []
+    image_size = None
+    for fname, (corners, size) in zip(images, detect_all(images, workers)):
+        image_size = size
+        if corners is not None:
+            objpoints.append(objp)
+            imgpoints.append(corners)
+            used.append(fname)
+    print("Found the board in {} of {} images".format(len(used), len(images)))
+    if not used:
+        raise Exception("No chessboard found in any image")
 
-cv.destroyAllWindows()
+    if visualize:
+        show_detections(used, imgpoints)
 
-ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
-print(mtx, dist)
+    ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+    errors = reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
+    return mtx, dist, used, errors
 
-mean_error = 0
-for i in range(len(objpoints)):
-    imgpoints2, _ = cv.projectPoints(objpoints[i], rvecs[i], tvecs[i], mtx, dist)
-    error = cv.norm(imgpoints[i], imgpoints2, cv.NORM_L2)/len(imgpoints2)
-    mean_error += error
- 
-print( "total error: {}".format(mean_error/len(objpoints)) )
\ No newline at end of file
+if __name__ == "__main__":
+    # Fill in filename here
+    images = sorted(glob.glob('C:/Users/.../*.png'))
+    mtx, dist, used, errors = calibrate(images)
+    print(mtx, dist)
+    for fname, error in zip(used, errors):
+        print("{}: {:.3f}".format(fname, error))
+    print("mean per-image RMS error (px): {}".format(errors.mean()))
+    # Earlier versions printed the mean of cv.norm(L2) / n per image
+    print("total error: {}".format(np.mean(errors / np.sqrt(len(objp)))))
@@ -1,14 +1,24 @@
 import cv2
 import json
+import heapq
+import queue
+import threading
+import time
 import numpy as np
 import os
+import sys
+from collections import deque
 
-ARUCO_DICT_ID = cv2.aruco.DICT_4X4_250
-BOARD_ROWS = 8
-BOARD_COLS = 11
-SQUARE_LENGTH = .026       
-MARKER_LENGTH = .0195           
-MARGIN_PX = 0     
+# The board geometry comes from the gui's target spec
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gui"))
+import charuco_utils
+
+# Live stream settings: number of detection threads, and how many captured
+# frames may wait for a detector before the oldest is dropped
+DETECTION_WORKERS = 3
+FRAME_QUEUE_SIZE = 2
+# Window (seconds) over which frame rates and latency are averaged
+STATS_WINDOW = 2.0
 
 json_file_path = './underwater_cam.json'
 
@@ -18,27 +28,33 @@ with open(json_file_path, 'r') as file: # Read the JSON file
 mtx = np.array(json_data['mtx'])
 dst = np.array(json_data['dist'])
 
-def pos_from_image(color_image, mtx, dst):
+def make_detector():
+    """
+    The spec board and this thread's detector for it.
+    """
+    _, board = charuco_utils.make_charuco_board()
+    return board, charuco_utils.get_detector(board)
+
+def pos_from_image(color_image, mtx, dst, board=None, detector=None):
     image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
 
     h,  w = image.shape[:2]
     # newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dst, (w,h), 1, (w,h))
     # image = cv2.undistort(image, mtx, dst, None, newcameramtx)
 
-    dictionary = cv2.aruco.getPredefinedDictionary(ARUCO_DICT_ID)
-    board = cv2.aruco.CharucoBoard((BOARD_COLS, BOARD_ROWS), SQUARE_LENGTH, MARKER_LENGTH, dictionary)
-    detector = cv2.aruco.CharucoDetector(board)
+    # Callers that process many frames should build these once with make_detector
+    if board is None or detector is None:
+        board, detector = make_detector()
 
     # cv2.aruco.drawDetectedMarkers(image_copy, marker_corners, marker_ids)
     charucoCorners, charucoIds, marker_corners, marker_ids = detector.detectBoard(image)
-    
+
     if charucoCorners is not None and charucoIds is not None and len(charucoCorners) > 3:
-        print("entered conditional")
         retval, rvec, tvec = cv2.aruco.estimatePoseCharucoBoard(np.array(charucoCorners), np.array(charucoIds), board, np.array(mtx), np.array(dst), np.empty(1), np.empty(1))
         result = color_image.copy()
         #cv2.aruco.drawDetectedMarkers(result, marker_corners, marker_ids)
         cv2.drawFrameAxes(result, np.array(mtx), np.array(dst), rvec, tvec, .1)
-        #cv2.drawChessboardCorners(result, (BOARD_COLS, BOARD_ROWS), charucoCorners, retval)
+        #cv2.drawChessboardCorners(result, (charuco_utils.BOARD_COLS, charuco_utils.BOARD_ROWS), charucoCorners, retval)
 
         return tvec, rvec, result
     else:
@@ -54,30 +70,176 @@ def single_image(filepath, mtx, dst):
 mtx = np.array([[1.02082611e+03, 0.00000000e+00, 7.69307527e+02],
                 [0.00000000e+00, 1.02245381e+03, 2.90583592e+02],
                 [0.00000000e+00, 0.00000000e+00, 1.00000000e+00]])
-dst = np.array([[-3.76227154e-01,  1.94912143e-01, 
+dst = np.array([[-3.76227154e-01,  1.94912143e-01,
                              -2.04912328e-03,  7.63774994e-05, -5.57738640e-02]])
-single_image("C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025/camera/20250723_163603.png", mtx, dst)
 
 def image_folder(img_dir):
+    board, detector = make_detector()
     image_files = [os.path.join(img_dir, f) for f in os.listdir(img_dir) if f.endswith(".png")]
     for image_file in image_files:
         image = cv2.imread(image_file)
-        tvec, rvec, display = pos_from_image(image, mtx, dst)
+        tvec, rvec, display = pos_from_image(image, mtx, dst, board, detector)
         cv2.imshow('img', display)
         cv2.waitKey(1000)
-    
-def video_stream():
-    cap = cv2.VideoCapture(0)#cv2.CAP_DSHOW?
-    cap.set(cv2.CAP_PROP_FPS, 2)
 
+class DropOldestQueue():
+    """
+    Bounded queue that never blocks the producer: when full, the oldest item
+    is discarded to make room. Sequence numbers of discarded items are kept so
+    that downstream stages know not to wait for them.
+    """
+    def __init__(self, maxsize):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.dropped = set()
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, seq, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                old_seq, _ = self.items.popleft()
+                self.dropped.add(old_seq)
+            self.items.append((seq, item))
+            self.cond.notify()
+
+    def get(self):
+        """
+        Return the oldest (seq, item), or None once the queue is closed and empty.
+        """
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def was_dropped(self, seq):
+        with self.cond:
+            if seq in self.dropped:
+                self.dropped.discard(seq)
+                return True
+            return False
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class RateMeter():
+    """Events per second over the last STATS_WINDOW seconds."""
+    def __init__(self):
+        self.times = deque()
+        self.lock = threading.Lock()
+
+    def tick(self, now=None):
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            self.times.append(now)
+            while self.times and now - self.times[0] > STATS_WINDOW:
+                self.times.popleft()
+
+    def rate(self):
+        with self.lock:
+            if len(self.times) < 2:
+                return 0.0
+            return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+def capture_loop(cap, frames, stop, capture_rate):
+    seq = 0
+    while not stop.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            print("Could not read from camera")
+            break
+        capture_rate.tick()
+        frames.put(seq, (time.perf_counter(), frame))
+        seq += 1
+    frames.close()
+
+def detection_loop(frames, results, detect_rate):
+    # Each worker keeps its own detector, since they are not safe to share
+    board, detector = make_detector()
+    while True:
+        entry = frames.get()
+        if entry is None:
+            return
+        seq, (t_capture, frame) = entry
+        try:
+            tvec, rvec, display = pos_from_image(frame, mtx, dst, board, detector)
+        except Exception as ex:
+            # Still hand the frame on, or the display would wait for it forever
+            print("Detection failed on frame {}: {}".format(seq, ex))
+            tvec, rvec, display = None, None, frame
+        detect_rate.tick()
+        results.put((seq, t_capture, tvec, rvec, display))
+
+def video_stream(source=0, workers=DETECTION_WORKERS):
+    """
+    Show live board poses from a camera.
+
+    Frames are read on a capture thread into a small drop-oldest queue, so a
+    slow detector never builds up a backlog of stale frames. A pool of detection
+    threads processes them, and results are displayed in capture order along
+    with the capture/detection/display frame rates and end-to-end latency.
+    """
+    cap = cv2.VideoCapture(source)#cv2.CAP_DSHOW?
+    frames = DropOldestQueue(FRAME_QUEUE_SIZE)
+    results = queue.Queue()
+    stop = threading.Event()
+    capture_rate, detect_rate, display_rate = RateMeter(), RateMeter(), RateMeter()
+    latencies = deque(maxlen=100)
+
+    capture_thread = threading.Thread(target=capture_loop, args=(cap, frames, stop, capture_rate), daemon=True)
+    detection_threads = [threading.Thread(target=detection_loop, args=(frames, results, detect_rate), daemon=True)
+                         for _ in range(workers)]
+    capture_thread.start()
+    for thread in detection_threads:
+        thread.start()
+
+    pending = []
+    next_seq = 0
+    last_report = time.perf_counter()
     while True:
-        # show the image
-        _, frame = cap.read()
-        tv, rv, result = pos_from_image(frame)
-    
-        cv2.imshow("Output", result)
-        cv2.waitKey(3)
-                    
+        try:
+            heapq.heappush(pending, results.get(timeout=0.1))
+        except queue.Empty:
+            if not capture_thread.is_alive() and not any(t.is_alive() for t in detection_threads):
+                break
+
+        # Release results in capture order, skipping frames that were dropped
+        while pending:
+            if pending[0][0] == next_seq:
+                seq, t_capture, tvec, rvec, display = heapq.heappop(pending)
+                next_seq += 1
+            elif frames.was_dropped(next_seq):
+                next_seq += 1
+                continue
+            else:
+                break
+
+            now = time.perf_counter()
+            latencies.append(now - t_capture)
+            display_rate.tick(now)
+            stats = "capture {:.1f} fps | detect {:.1f} fps | display {:.1f} fps | latency {:.0f} ms".format(
+                capture_rate.rate(), detect_rate.rate(), display_rate.rate(), 1000 * np.mean(latencies))
+            cv2.putText(display, stats, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            cv2.imshow("Output", display)
+            if now - last_report > STATS_WINDOW:
+                print(stats, "| tvec", np.ravel(tvec))
+                last_report = now
+
         #press q to quit
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
+
+    stop.set()
+    capture_thread.join()
+    for thread in detection_threads:
+        thread.join()
+    cap.release()
+    cv2.destroyAllWindows()
+
+if __name__ == "__main__":
+    single_image("C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025/camera/20250723_163603.png", mtx, dst)
+    # video_stream()
@@ -1,59 +1,142 @@
-# This method doesn't work very well. When using the rtsp protocol, I had to use
-# multithreading to prevent the images from being very pixelated or glitchy.  
-# With continous streaming, there was the problem of extreme lag. I set it up 
-# to quit after saving one image to avoid that problem, but it doesn't quit 
-# cleanly and I end up having to kill the program manually. 
+# Save frames from an rtsp camera stream.
+# Decoding happens on its own thread, which only ever keeps the newest frame,
+# so the display never lags behind the camera and memory use stays constant.
+# Images are written on a background thread and named with the camera's
+# timestamp format (YYYYMMDD_HHMMSS.png) so they can be used by the gui directly.
+#
+# Keys: s - save the current frame, c - toggle saving one frame per second,
+#       q - quit
 
 import cv2
-import numpy as np
-from datetime import datetime, date, time, timezone
+import os
 import queue
 import threading
+from datetime import datetime
 
 rtsp = "rtsp://192.168.0.74:554/1/h264major"
-print("fps", cv2.CAP_PROP_FPS)
+destination_folder = "test_images/7-21-2025/camera"
+# Frames waiting to be written; if the disk can't keep up, saves are refused
+# rather than letting the backlog grow
+WRITER_QUEUE_SIZE = 32
 
-q=queue.Queue()
-quit = False
+class LatestFrame():
+    """
+    Single-slot buffer holding the most recently decoded frame.
+    Older frames are overwritten, never queued.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.captured = None
+        self.seq = 0
 
-def Receive():
-    print("start Reveive")
+    def put(self, frame):
+        with self.cond:
+            self.frame = frame
+            self.captured = datetime.now()
+            self.seq += 1
+            self.cond.notify_all()
+
+    def get(self, after_seq=0, timeout=None):
+        """
+        Wait for a frame newer than after_seq.
+        Returns (seq, capture time, frame), or None if none arrived in time.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            return self.seq, self.captured, self.frame
+
+class FrameWriter():
+    """
+    Writes frames to disk on a background thread.
+    """
+    def __init__(self, folder, maxsize=WRITER_QUEUE_SIZE):
+        self.folder = folder
+        self.jobs = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, frame, captured):
+        filename = os.path.join(self.folder, captured.strftime("%Y%m%d_%H%M%S") + ".png")
+        try:
+            self.jobs.put_nowait((filename, frame))
+        except queue.Full:
+            print("Writer is behind, not saving ", filename)
+            return None
+        return filename
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            filename, frame = job
+            if cv2.imwrite(filename, frame):
+                print(filename, " saved")
+            else:
+                print("Could not save ", filename)
+
+    def close(self):
+        """Finish writing queued frames, then stop the thread."""
+        self.jobs.put(None)
+        self.thread.join()
+
+def receive(latest, stop):
+    print("Start receiving")
     cap = cv2.VideoCapture(rtsp)
-    ret, frame = cap.read()
-    q.put(frame)
-    while ret:
+    while not stop.is_set():
         ret, frame = cap.read()
-        q.put(frame) 
-        time.sleep(10)
-        if quit == True:
-            cap.release()
-            return
-
-
-def Display():
-    print("Start Displaying")
-    while True:
-        if q.empty() !=True:
-            frame=q.get()
+        if not ret:
+            print("Stream ended")
+            break
+        latest.put(frame)
+    cap.release()
+    stop.set()
+
+def display(latest, writer, stop):
+    print("Start displaying")
+    seq = 0
+    frame, captured = None, None
+    continuous = False
+    last_saved = None
+    while not stop.is_set():
+        entry = latest.get(after_seq=seq, timeout=0.1)
+        if entry is not None:
+            seq, captured, frame = entry
             cv2.imshow("frame1", frame)
+            # Timestamps have one-second resolution, so save at most once per second
+            if continuous and captured.replace(microsecond=0) != last_saved:
+                writer.save(frame, captured)
+                last_saved = captured.replace(microsecond=0)
+
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord('s') and frame is not None:
+            # Same check as continuous saving, or the file from this second is overwritten
+            if captured.replace(microsecond=0) == last_saved:
+                print("A frame was already saved this second, not saving")
+            else:
+                writer.save(frame, captured)
+                last_saved = captured.replace(microsecond=0)
+        elif key == ord('c'):
+            continuous = not continuous
+            print("Continuous saving", "on" if continuous else "off")
+        elif key == ord('q'):
+            stop.set()
+    cv2.destroyAllWindows()
 
-        if cv2.waitKey(33) & 0xFF == ord('s'):
-            now = datetime.now()
-            timestamp = str(now).replace("-", "")
-            timestamp = timestamp.replace(" ", "_")
-            timestamp = timestamp.replace(":", "")
-            filename = f"test_images/7-21-2025/camera/{timestamp[:15]}.png"
-            cv2.imwrite(filename, frame)
-            print(filename, " saved")
-            return
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            cv2.destroyAllWindows()
-            quit = True
-            return
-            
 if __name__=='__main__':
-    p1 = threading.Thread(target=Receive)
-    p2 = threading.Thread(target=Display)
-    p1.start()
-    p2.start()
+    os.makedirs(destination_folder, exist_ok=True)
+    latest = LatestFrame()
+    writer = FrameWriter(destination_folder)
+    stop = threading.Event()
+
+    receiver = threading.Thread(target=receive, args=(latest, stop))
+    receiver.start()
+    try:
+        # imshow needs to run on the main thread
+        display(latest, writer, stop)
+    finally:
+        stop.set()
+        receiver.join()
+        writer.close()
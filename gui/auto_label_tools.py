@@ -0,0 +1,284 @@
+import sys
+import json
+import pickle
+import cv2
+import numpy as np
+import scipy.ndimage
+import scipy.spatial
+from concurrent.futures import ThreadPoolExecutor
+
+import charuco_utils
+import image_sonar_utils as isc
+import pose_utils
+
+# Peaks are searched for in a (PEAK_WINDOW x PEAK_WINDOW) neighborhood of the
+# polar sonar image, and must be brighter than both MIN_PEAK_INTENSITY and the
+# PEAK_PERCENTILE of the frame they were found in.
+PEAK_WINDOW = 9
+PEAK_PERCENTILE = 99.0
+MIN_PEAK_INTENSITY = 60
+# Maximum distance between a prediction and a peak, measured in sonar
+# resolution cells (the same units used by calc_projection_error)
+DEFAULT_GATE = 8.0
+CHUNK_SIZE = 64
+
+def predict_target_pixels(camera_rvecs, camera_tvecs, cs_rvec, cs_tvec, target_points, sonar):
+    """
+    Project every sonar target into the polar sonar image of every frame.
+
+    camera_rvecs, camera_tvecs -- (N, 3) camera->board poses
+    cs_rvec, cs_tvec -- camera->sonar extrinsic
+    target_points -- (3, T) target locations in the board frame
+
+    Returns an (N, T, 2) array of (x, y) pixel locations and an (N, T) mask
+    that is False for predictions that fall outside the sonar's field of view.
+    """
+    # (N, 3, T) points in the sonar frame, through sonar->board = camera->sonar @ camera->board
+    sonar_poses = pose_utils.compose(pose_utils.as_poses(cs_rvec, cs_tvec),
+                                     pose_utils.as_poses(camera_rvecs, camera_tvecs))
+    sonar_points = pose_utils.apply(sonar_poses, target_points)
+    nframes, _, ntargets = sonar_points.shape
+
+    flat = np.transpose(sonar_points, (1, 0, 2)).reshape(3, -1)
+    polar = isc.polar_from_3d(flat)
+    pixels = isc.polar_to_pixel(polar, sonar)
+    pixels = np.transpose(pixels.reshape(2, nframes, ntargets), (1, 2, 0))
+
+    in_fov = (
+        (pixels[:, :, 0] >= 0) & (pixels[:, :, 0] < sonar.theta_bins)
+        & (pixels[:, :, 1] >= 0) & (pixels[:, :, 1] < sonar.range_bins)
+    )
+    return pixels, in_fov
+
+def find_sonar_peaks(polar_images, window=PEAK_WINDOW, percentile=PEAK_PERCENTILE,
+                     min_intensity=MIN_PEAK_INTENSITY):
+    """
+    Find local intensity maxima in a (F, H, W) stack of polar sonar images.
+
+    Returns frame indices, x (column) and y (row) pixel locations and the
+    normalized strength (0-1, relative to the frame's median) of every peak.
+    """
+    stack = polar_images.astype(np.float32)
+    smoothed = scipy.ndimage.gaussian_filter(stack, sigma=(0, 1.0, 1.0))
+    local_max = scipy.ndimage.maximum_filter(smoothed, size=(1, window, window))
+
+    thresholds = np.percentile(smoothed.reshape(len(stack), -1), percentile, axis=1)
+    thresholds = np.maximum(thresholds, min_intensity)
+    is_peak = (smoothed == local_max) & (smoothed >= thresholds[:, None, None])
+
+    frames, rows, cols = np.nonzero(is_peak)
+    medians = np.median(smoothed.reshape(len(stack), -1), axis=1)
+    background = medians[frames]
+    strength = (smoothed[frames, rows, cols] - background) / np.maximum(255.0 - background, 1.0)
+    return frames, cols.astype(np.float64), rows.astype(np.float64), np.clip(strength, 0.0, 1.0)
+
+def snap_to_peaks(predictions, valid, peaks, sonar, gate=DEFAULT_GATE):
+    """
+    Snap predicted target locations to the nearest detected peak in the same frame.
+
+    predictions -- (N, T, 2) predicted pixel locations
+    valid -- (N, T) mask of predictions to consider
+    peaks -- (frames, x, y, strength) as returned by find_sonar_peaks
+
+    Distances are measured in resolution cells so that angle and range are
+    weighted the same way as in calc_projection_error. Each peak can only be
+    claimed by one target; if several targets land on the same peak, the
+    closest one wins.
+
+    Returns the (N, T, 2) snapped locations (NaN where no peak was found) and
+    an (N, T) array of confidences in [0, 1].
+    """
+    nframes, ntargets, _ = predictions.shape
+    snapped = np.full(predictions.shape, np.nan)
+    confidence = np.zeros((nframes, ntargets))
+    peak_frames, peak_x, peak_y, peak_strength = peaks
+    if len(peak_frames) == 0 or not np.any(valid):
+        return snapped, confidence
+
+    # Convert pixels to resolution cells. Frames are separated along a third
+    # axis by much more than the gate, so one tree serves the whole dataset.
+    x_scale = 0.1 / sonar.th_res
+    y_scale = (sonar.range / sonar.range_bins) / sonar.r_res
+    frame_spacing = 10.0 * gate
+    tree = scipy.spatial.cKDTree(np.column_stack(
+        [peak_frames * frame_spacing, peak_x * x_scale, peak_y * y_scale]))
+
+    frame_idx, target_idx = np.nonzero(valid)
+    query = np.column_stack([
+        frame_idx * frame_spacing,
+        predictions[frame_idx, target_idx, 0] * x_scale,
+        predictions[frame_idx, target_idx, 1] * y_scale,
+    ])
+    dist, match = tree.query(query, k=1, distance_upper_bound=gate)
+    found = np.isfinite(dist)
+    frame_idx, target_idx = frame_idx[found], target_idx[found]
+    dist, match = dist[found], match[found]
+
+    # Resolve peaks claimed by more than one target in favor of the closest
+    order = np.lexsort((dist, match))
+    _, first = np.unique(match[order], return_index=True)
+    keep = order[first]
+    frame_idx, target_idx = frame_idx[keep], target_idx[keep]
+    dist, match = dist[keep], match[keep]
+
+    snapped[frame_idx, target_idx, 0] = peak_x[match]
+    snapped[frame_idx, target_idx, 1] = peak_y[match]
+    confidence[frame_idx, target_idx] = (1.0 - dist / gate) * peak_strength[match]
+    return snapped, confidence
+
+def _detect_pose(camera_file, board, mtx, dst):
+    image = cv2.imread(camera_file)
+    if image is None:
+        return None
+    _, _, tvec, rvec = charuco_utils.detect_charuco_board(board, image, mtx, dst)
+    if rvec is None:
+        return None
+    return rvec, tvec
+
+def _load_polar_sonar(sonar_file, sonar, polar_transform):
+    sonar_im = cv2.imread(sonar_file, cv2.IMREAD_GRAYSCALE)
+    sonar_im = isc.crop_sonar_arc(sonar_im, sonar)
+    return isc.polar_sonar_image(sonar_im, polar_transform)
+
+def auto_label_session(rootdir, camera_json, cs_rvec=None, cs_tvec=None,
+                       gate=DEFAULT_GATE, chunk_size=CHUNK_SIZE, workers=4):
+    """
+    Propose sonar labels for every frame in rootdir that is not marked skip.
+
+    Board poses are taken from the saved session when available and detected
+    otherwise. The camera->sonar transform defaults to the aggregate calibration
+    of the labeled frames, falling back on the external vectors in inputparams.json.
+
+    Returns (proposed, confidence), both dicts keyed by timestamp. proposed maps
+    labels to (x, y) pixels in the same format as the gui's sonar_labels.
+    """
+    outdir = f"{rootdir}/output"
+    with open(f"{rootdir}/inputparams.json", 'r') as file:
+        input_params = json.load(file)
+    with open(camera_json, 'r') as file:
+        camera_params = json.load(file)
+    mtx = np.array(camera_params['mtx'])
+    dst = np.array(camera_params['dist'])
+
+    sonar = isc.SonarInfo(input_params["sonar_range"], input_params["sonar_wide"],
+                          f"{rootdir}/sonar_cropping_params.json")
+    polar_transform = isc.create_transform_map(sonar)
+    paired_data = isc.SensorData(rootdir, sonar)
+    _, skip_timestamps, _, calibration_results, camera_poses = isc.load_session_state(outdir)
+    _, board, _ = isc.init_charuco_sonar()
+
+    if cs_rvec is None or cs_tvec is None:
+        _, cs_rvec, cs_tvec = isc.multi_calibrate(
+            calibration_results, list(calibration_results.keys()), sonar,
+            tuple(input_params["ext_r"]), tuple(input_params["ext_t"]))
+        if cs_rvec is None:
+            cs_rvec, cs_tvec = input_params["ext_r"], input_params["ext_t"]
+            print("No labeled frames; using the external calibration vectors")
+
+    pairs = [pair for pair in paired_data.sorted_pairs if pair[0] not in skip_timestamps]
+
+    # Board poses for every frame, detecting only those that were never opened in the gui
+    missing = [pair for pair in pairs if pair[0] not in camera_poses]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        detected = executor.map(
+            lambda pair: _detect_pose(f"{paired_data.camera_folder}/{pair[2]}", board, mtx, dst),
+            missing)
+        poses = dict(camera_poses)
+        for pair, pose in zip(missing, detected):
+            if pose is not None:
+                poses[pair[0]] = pose
+    pairs = [pair for pair in pairs if pair[0] in poses]
+    print("Found board poses for {} of {} frames".format(len(pairs), paired_data.length))
+    if not pairs:
+        return {}, {}
+
+    table = isc.get_target_table()
+    labels = list(table.labels)
+    target_points = table.points.T
+    camera_rvecs = np.array([np.ravel(poses[pair[0]][0]) for pair in pairs])
+    camera_tvecs = np.array([np.ravel(poses[pair[0]][1]) for pair in pairs])
+    predictions, in_fov = predict_target_pixels(
+        camera_rvecs, camera_tvecs, cs_rvec, cs_tvec, target_points, sonar)
+
+    # Peak detection runs on chunks of frames to bound memory use
+    peak_chunks = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(pairs), chunk_size):
+            chunk = pairs[start:start + chunk_size]
+            images = list(executor.map(
+                lambda pair: _load_polar_sonar(f"{paired_data.sonar_folder}/{pair[1]}", sonar, polar_transform),
+                chunk))
+            frames, xs, ys, strength = find_sonar_peaks(np.stack(images))
+            peak_chunks.append((frames + start, xs, ys, strength))
+    peaks = tuple(np.concatenate(values) for values in zip(*peak_chunks))
+
+    snapped, scores = snap_to_peaks(predictions, in_fov, peaks, sonar, gate)
+
+    proposed = {}
+    confidence = {}
+    for ii, pair in enumerate(pairs):
+        (hits,) = np.nonzero(scores[ii] > 0)
+        if hits.size == 0:
+            continue
+        proposed[pair[0]] = {labels[jj]: (snapped[ii, jj, 0], snapped[ii, jj, 1]) for jj in hits}
+        confidence[pair[0]] = {labels[jj]: scores[ii, jj] for jj in hits}
+
+    npoints = sum(len(points) for points in proposed.values())
+    print("Proposed {} labels across {} frames".format(npoints, len(proposed)))
+    return proposed, confidence
+
+def save_proposed_labels(outdir, proposed, confidence):
+    filename = "{}/proposed_labels.pkl".format(outdir)
+    with open(filename, "wb") as fp:
+        pickle.dump({"sonar_labels": proposed, "confidence": confidence}, fp)
+    print("Proposed labels saved to {}".format(filename))
+
+def merge_proposed_labels(sonar_labels, proposed, confidence, min_confidence=0.5, overwrite=False):
+    """
+    Copy proposed labels with at least min_confidence into sonar_labels.
+    Labels that were placed by hand are kept unless overwrite is True.
+    Returns the number of labels added.
+    """
+    added = 0
+    for timestamp, points in proposed.items():
+        for label, coord in points.items():
+            if confidence[timestamp][label] < min_confidence:
+                continue
+            frame_labels = sonar_labels.setdefault(timestamp, {})
+            if label in frame_labels and not overwrite:
+                continue
+            frame_labels[label] = coord
+            added += 1
+    return added
+
+def merge_saved_labels(outdir, min_confidence=0.5):
+    """
+    Merge the proposed labels saved in outdir into the gui's saved session
+    (calibration_labels.pkl), so they show up the next time the gui is opened.
+    Don't run this while the gui is open, it would overwrite the merge on save.
+    """
+    with open("{}/proposed_labels.pkl".format(outdir), "rb") as fp:
+        saved = pickle.load(fp)
+    labels_filename = "{}/calibration_labels.pkl".format(outdir)
+    with open(labels_filename, "rb") as fp:
+        labels = pickle.load(fp)
+    added = merge_proposed_labels(labels["sonar_labels"], saved["sonar_labels"], saved["confidence"],
+                                  min_confidence)
+    with open(labels_filename, "wb") as fp:
+        pickle.dump(labels, fp)
+    print("Merged {} proposed labels into {}".format(added, labels_filename))
+    return added
+
+if __name__ == "__main__":
+    # usage: python auto_label_tools.py [--merge]
+    # Name of folder containing sonar and camera images. Proposed labels are saved
+    # to its output folder. Running again with --merge copies the saved proposals
+    # into the gui's labels, where they can be reviewed frame by frame.
+    rootdir = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025"
+    camera_json = "../underwater_cam.json"
+
+    if "--merge" in sys.argv:
+        merge_saved_labels(f"{rootdir}/output")
+    else:
+        proposed, confidence = auto_label_session(rootdir, camera_json)
+        save_proposed_labels(f"{rootdir}/output", proposed, confidence)
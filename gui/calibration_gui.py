@@ -31,31 +31,32 @@ import cv2
 import sys
 import os
 import json
+import threading
 import cycler
 import pickle
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5 import QtGui, QtWidgets, QtCore
 
 import matplotlib
 import matplotlib.figure
 from matplotlib.backends.backend_qt5agg import FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT
 
 import charuco_utils
 import image_sonar_utils as isc
 import data_analysis_tools as dtools
-
-class NavigationToolbar(NavigationToolbar2QT):
-    """
-    Only display relevant buttons.
-    Solution copied from:
-    https://stackoverflow.com/questions/12695678/how-to-modify-the-navigation-toolbar-easily-in-a-matplotlib-figure-window
-    """
-    toolitems = [
-        t
-        for t in NavigationToolbar2QT.toolitems
-        if t[0] in ("Home", "Pan", "Zoom", "Save")
-    ]
+import pose_utils
+import timing_utils
+from image_pyramid import ImagePyramid
+from raster_view import RasterView
+from calibration_worker import CalibrationWorker, solve_frames
+from thumbnail_index import ThumbnailIndex
+from frame_quality import FrameQuality
+import frame_quality
+import frame_dedup
+from filmstrip import Filmstrip
+import navigation_index as nav
+import residual_audit
 
 class Camera():
     def __init__(self, mtx, dst):
@@ -142,10 +143,50 @@ class AnnotatedCanvas(QtWidgets.QWidget):
         self.setLayout(layout)
 
 class SensorWindow(QtWidgets.QMainWindow):
+    # Marking a frame good records which source files it came from. Set this to
+    # also copy the images into the output folder (written in the background).
+    COPY_GOOD_IMAGES = False
+    # 0-9; higher is smaller but slower to write
+    PNG_COMPRESSION = 1
+
+    # Emitted from the I/O thread when a background write finishes
+    io_finished = QtCore.pyqtSignal(str)
+
+    # Label edits made within this long of each other share one recalibration
+    RECALIBRATION_DELAY_MS = 400
+    # Worker processes for generating thumbnails (None uses every core)
+    THUMBNAIL_WORKERS = None
+
+    # Emitted from the thumbnail thread with (done, total)
+    thumbnails_progress = QtCore.pyqtSignal(int, int)
+    quality_progress = QtCore.pyqtSignal(int, int)
+    # Emitted with (cluster_ids, representative) when deduplication finishes
+    dedup_finished = QtCore.pyqtSignal(object)
+
     def __init__(self, rootdir):
         super(SensorWindow, self).__init__()
         self.rootdir = rootdir
         self.outdir = f"{rootdir}/output"
+        self.io_executor = ThreadPoolExecutor(max_workers=1)
+        self.io_finished.connect(self.handle_io_finished)
+        # Calibration runs in the background; results for frames or labels
+        # that have since changed are dropped
+        self.calibration_worker = CalibrationWorker(self)
+        self.calibration_worker.finished.connect(self.handle_calibration_finished)
+        self.calibration_pending = False
+        self.agg_err, self.agg_rvec, self.agg_tvec = -1, None, None
+        self.current_sonar_matrix = None
+        self.current_camera_pose = None
+        # Frames whose labels changed since they were last solved, mapped to
+        # an edit counter so edits made during a solve aren't lost
+        self.dirty_frames = {}
+        self.edit_count = 0
+        self.submitted_edits = {}
+        self.pending_recalibrate = False
+        self.recalibration_timer = QtCore.QTimer(self)
+        self.recalibration_timer.setSingleShot(True)
+        self.recalibration_timer.setInterval(self.RECALIBRATION_DELAY_MS)
+        self.recalibration_timer.timeout.connect(self.run_scheduled_recalibration)
 
         try:
             if not os.path.exists(self.outdir):
@@ -160,6 +201,7 @@ class SensorWindow(QtWidgets.QMainWindow):
         print("GUI setup complete")
         self.setup_data()
         self.initialize_camera()
+        self.setup_filmstrip()
 
         (self.aruco_dict, self.charuco_board, self.sonar_coords) = isc.init_charuco_sonar() 
 
@@ -201,6 +243,8 @@ class SensorWindow(QtWidgets.QMainWindow):
 
         self.paired_data = isc.SensorData(self.rootdir, self.sonar_params)
         (self.good_timestamps, self.skip_timestamps, self.sonar_labels, self.calibration_results, self.camera_poses) = self.load_state()
+        # good_sources maps good timestamps to the (sonar, camera) files they came from
+        self.good_sources = isc.load_good_sources(self.outdir)
         # good_timestamps and skip_timestamps are sets of timestamps
         # sonar_labels is a dictionary mapping labels to user-selected sonar points
 
@@ -209,7 +253,127 @@ class SensorWindow(QtWidgets.QMainWindow):
 
         # camera_poses is a dict mapping timestamp to the charuco board's location in the
         # camera frame, where location is given as a (rvec, tvec) tuple.
+
+        # navigation has the status of every frame for the next/prev buttons;
+        # it is updated alongside the sets and dicts above
+        self.navigation = nav.NavigationIndex.from_state(
+            self.paired_data.timestamps, self.good_timestamps, self.skip_timestamps,
+            self.sonar_labels.keys(), self.camera_poses.keys())
+        self.current_timestamp = None
         
+    def setup_filmstrip(self):
+        """
+        Thumbnail scrubber along the bottom of the window. Thumbnails that
+        aren't cached yet are generated in the background.
+        """
+        self.thumbnails = ThumbnailIndex(self.paired_data, self.polar_transform, self.outdir)
+        self.filmstrip = Filmstrip(self.thumbnails, self.paired_data.timestamps, self.frame_status)
+        self.filmstrip.seek_requested.connect(self.seek_to_index)
+        self.layout.addWidget(self.filmstrip, stretch=0)
+
+        self.quality = FrameQuality(self.paired_data, self.polar_transform,
+                                    self.camera_info.K, self.camera_info.D, self.outdir)
+        self.apply_quality()
+
+        # Thumbnails, then quality scores, are computed in the background
+        self.thumbnails_progress.connect(self.handle_thumbnails_progress)
+        self.quality_progress.connect(self.handle_quality_progress)
+        self.thumbnail_stop = threading.Event()
+        self.thumbnail_executor = ThreadPoolExecutor(max_workers=1)
+        if len(self.thumbnails.missing()) > 0:
+            self.thumbnail_executor.submit(
+                self.thumbnails.build, self.THUMBNAIL_WORKERS,
+                self.thumbnails_progress.emit, self.thumbnail_stop)
+        if len(self.quality.missing()) > 0:
+            self.thumbnail_executor.submit(
+                self.quality.build, self.THUMBNAIL_WORKERS,
+                self.quality_progress.emit, self.thumbnail_stop)
+        self.dedup_finished.connect(self.handle_dedup_finished)
+        # Copies of the marks as of startup, since the sets change on this thread
+        good = np.isin(self.paired_data.timestamps, np.array(list(self.good_timestamps), dtype="datetime64[s]"))
+        labeled = np.isin(self.paired_data.timestamps, np.array(list(self.sonar_labels), dtype="datetime64[s]"))
+        self.thumbnail_executor.submit(self.find_duplicates, good, labeled)
+
+    def find_duplicates(self, good, labeled):
+        """
+        Runs on the thumbnail thread, after the thumbnails and scores are done.
+        Within each group of near-duplicates, labeled frames are kept first,
+        then good frames, then the best scoring.
+        """
+        if self.thumbnail_stop.is_set():
+            return
+        priority = frame_quality.combined_score(self.quality.records) + 2.0 * good + 4.0 * labeled
+        self.dedup_finished.emit(frame_dedup.deduplicate(self.thumbnails, priority))
+
+    def handle_dedup_finished(self, result):
+        cluster_ids, representative = result
+        self.paired_data.set_clusters(cluster_ids, representative)
+        duplicates = self.paired_data.duplicate_timestamps()
+        self.navigation.assign(nav.DUPLICATE, duplicates)
+        message = "{} of {} frames are near-duplicates".format(len(duplicates), self.paired_data.length)
+        print(message)
+        self.statusBar().showMessage(message, 3000)
+        self.filmstrip.view.update()
+
+    def handle_thumbnails_progress(self, done, total):
+        if done == total or done % 50 == 0:
+            self.statusBar().showMessage("Thumbnails: {} / {}".format(done, total), 3000)
+        self.filmstrip.view.update()
+
+    def handle_quality_progress(self, done, total):
+        if done == total or done % 50 == 0:
+            self.statusBar().showMessage("Quality scores: {} / {}".format(done, total), 3000)
+        if done == total:
+            self.apply_quality()
+
+    def apply_quality(self):
+        """
+        Copy the low quality flags into the navigation index and show the
+        current frame's scores.
+        """
+        low = self.quality.low_quality()
+        self.navigation.assign(nav.LOW_QUALITY, self.paired_data.timestamps[low])
+        self.update_quality_label()
+        self.filmstrip.view.update()
+
+    def update_quality_label(self):
+        idx = None
+        if self.current_timestamp is not None:
+            idx = self.paired_data.index_of(self.current_timestamp)
+        if idx is None:
+            self.quality_label.setText("Quality: unknown")
+            return
+        text = self.quality.describe_pair(idx)
+        if self.navigation.has(self.current_timestamp, nav.LOW_QUALITY):
+            text += " (low)"
+        self.quality_label.setText(text)
+
+    def handle_best_button(self):
+        exclude = set(self.navigation.members[nav.SKIP]) | set(self.navigation.members[nav.LABELED])
+        exclude = [self.paired_data.index_of(ts) for ts in self.navigation.timestamps[sorted(exclude)]]
+        ranked = self.quality.ranked(exclude=[idx for idx in exclude if idx is not None])
+        if len(ranked) == 0:
+            print("No scored, unlabeled frames left")
+            return
+        self.seek_to_index(int(ranked[0]))
+
+    def frame_status(self, idx):
+        """
+        Filmstrip border color for pair idx.
+        """
+        timestamp = self.paired_data.timestamps[idx]
+        if self.navigation.has(timestamp, nav.SKIP):
+            return "gray"
+        if self.navigation.has(timestamp, nav.GOOD):
+            return "green"
+        if self.navigation.has(timestamp, nav.LABELED):
+            return "orange"
+        if self.navigation.has(timestamp, nav.LOW_QUALITY):
+            return "darkred"
+        if self.navigation.has(timestamp, nav.DUPLICATE):
+            return "steelblue"
+        return None
+
     def initialize_camera(self, json_file_path = None):
         if json_file_path is not None:
             with open(json_file_path, 'r') as file: # Read the JSON file
@@ -236,11 +400,14 @@ class SensorWindow(QtWidgets.QMainWindow):
         self.timestamp_label = QtWidgets.QLabel("Timestamp: None")
         self.good_label = QtWidgets.QLabel("Label: unknown")
         self.good_label.setAutoFillBackground(True)
+        self.quality_label = QtWidgets.QLabel("Quality: not scored yet")
 
         self.header_row.addStretch(5)
         self.header_row.addWidget(self.timestamp_label)
         self.header_row.addStretch(1)
         self.header_row.addWidget(self.good_label)
+        self.header_row.addStretch(1)
+        self.header_row.addWidget(self.quality_label)
         self.header_row.addStretch(5)
 
         ###################
@@ -260,16 +427,15 @@ class SensorWindow(QtWidgets.QMainWindow):
         )
         target_widget = AnnotatedCanvas("Target", target_help, self.target_canvas)
 
-        # Figure showing the raw camera image
-        self.raw_camera_fig = matplotlib.figure.Figure(figsize=(5, 3))
-        self.raw_camera_ax = self.raw_camera_fig.add_axes([0, 0, 1, 1])
-        self.raw_camera_ax.axis("off")
-        self.raw_camera_artist = None
-        self.raw_camera_canvas = FigureCanvas(self.raw_camera_fig)
+        # View showing the raw camera image. Scroll to zoom, drag to pan.
+        self.raw_camera_view = RasterView()
+        # Pyramid of the current camera frame, and the image artist on each camera axes
+        self.camera_pyramid = None
+        self.camera_image_artists = {}
 
-        raw_camera_help = "Raw camera image from bagfile"
+        raw_camera_help = "Raw camera image from bagfile\nScroll to zoom, drag to pan"
         raw_camera_widget = AnnotatedCanvas(
-            "Raw Camera Image", raw_camera_help, self.raw_camera_canvas
+            "Raw Camera Image", raw_camera_help, self.raw_camera_view
         )
 
         # Figure showing aruco/charuco detections on the camera image
@@ -386,6 +552,17 @@ class SensorWindow(QtWidgets.QMainWindow):
         self.next_button.clicked.connect(self.handle_next_button)
         self.next10_button = QtWidgets.QPushButton("Next10")
         self.next10_button.setStyleSheet("padding: 3px;")
+        self.next10_button.clicked.connect(self.handle_next10_button)
+
+        # Frame quality scores (frame_quality.py): jump to the best unlabeled
+        # frame, and optionally have Next pass over low quality frames
+        self.best_button = QtWidgets.QPushButton("Best Unlabeled")
+        self.best_button.setStyleSheet("padding: 3px;")
+        self.best_button.clicked.connect(self.handle_best_button)
+        self.skip_low_quality_box = QtWidgets.QCheckBox("Hide low quality")
+        # Near-duplicate frames (frame_dedup.py): Next can pass over them, and
+        # the aggregate calibration only uses one labeled frame per group
+        self.skip_duplicates_box = QtWidgets.QCheckBox("Hide duplicates")
 
         # Mark this image as "good" (saves to disk)
         self.good_button = QtWidgets.QPushButton("Mark Good")
@@ -420,6 +597,10 @@ class SensorWindow(QtWidgets.QMainWindow):
         self.recalibrate_button = QtWidgets.QPushButton("Recalibrate")
         self.recalibrate_button.setStyleSheet("padding: 3px;")
         self.recalibrate_button.clicked.connect(self.handle_recalibrate_button)
+        # Check every label against the aggregate calibration (residual_audit.py)
+        self.audit_button = QtWidgets.QPushButton("Audit Labels")
+        self.audit_button.setStyleSheet("padding: 3px;")
+        self.audit_button.clicked.connect(self.handle_audit_button)
 
         self.button_row.addWidget(self.skip_button)
         self.button_row.addWidget(self.prev_good_button)
@@ -427,23 +608,22 @@ class SensorWindow(QtWidgets.QMainWindow):
         self.button_row.addWidget(self.ungood_button)
         self.button_row.addWidget(self.next_good_button)
         self.button_row.addWidget(self.next_button)
+        self.button_row.addWidget(self.next10_button)
+        self.button_row.addWidget(self.best_button)
+        self.button_row.addWidget(self.skip_low_quality_box)
+        self.button_row.addWidget(self.skip_duplicates_box)
         self.button_row.addWidget(self.remove_label_button)
         self.button_row.addWidget(self.recalibrate_button)
+        self.button_row.addWidget(self.audit_button)
 
         ###################
         # Matplotlib figures for displaying the sonar views
 
-        # Main figure for labeling the sonar image
-        self.sonar_image_fig = matplotlib.figure.Figure(figsize=(5, 3))
-        self.sonar_image_ax = self.sonar_image_fig.add_axes([0.025, 0.025, 0.95, 0.95])
-        self.sonar_image_artist = None
-        self.sonar_image_canvas = FigureCanvas(self.sonar_image_fig)
-        self.sonar_image_canvas.mpl_connect(
-            "button_press_event", self.handle_sonar_click
-        )
-        self.sonar_image_canvas.mpl_connect(
-            "button_release_event", self.handle_sonar_release
-        )
+        # Main view for labeling the sonar image. This is redrawn on every
+        # label, so it uses a raster view rather than a matplotlib figure.
+        self.sonar_image_view = RasterView()
+        self.sonar_image_view.pressed.connect(self.handle_sonar_click)
+        self.sonar_image_view.released.connect(self.handle_sonar_release)
 
         # Create the central column used for labeling the sonar targets.
         # Nothing within this layout needs resizing, so just use a layout
@@ -455,20 +635,28 @@ class SensorWindow(QtWidgets.QMainWindow):
             "* Left-click to select a pixel, and enter corresponding "
             "label from the Target image. (e.g. A1)\n"
             "* Use Next/Prev buttons to step through the bagfile (10 will skip ahead by 10 images) \n"
+            "* Drag the scrubber below to browse thumbnails, and release or click a thumbnail to load it\n"
+            "* Best Unlabeled jumps to the highest scoring frame without labels; check Hide low quality "
+            "to have Next pass over blurry frames, frames with few corners and frames with weak sonar returns\n"
+            "* Check Hide duplicates to have Next pass over frames nearly identical to one already kept\n"
             "* Click Skip to indicate that this image should never be shown again\n"
-            "* Click Remove Label and then enter the ID (e.g. D5) to remove an annotation"
+            "* Click Remove Label and then enter the ID (e.g. D5) to remove an annotation\n"
+            "* Audit Labels checks every label against the aggregate calibration and shows the worst one\n"
+            "* Scroll to zoom, drag to pan, and click Reset View to see the whole image"
         )
         raw_sonar_help_button.setToolTip(help_text)
 
         raw_sonar_col = QtWidgets.QVBoxLayout()
         raw_sonar_col_header = QtWidgets.QHBoxLayout()
         raw_sonar_col_label = QtWidgets.QLabel("Polar Sonar Image")
-        self.raw_sonar_col_toolbar = NavigationToolbar(self.sonar_image_canvas, self)
+        self.reset_sonar_view_button = QtWidgets.QPushButton("Reset View")
+        self.reset_sonar_view_button.clicked.connect(self.sonar_image_view.reset_view)
         raw_sonar_col_header.addWidget(raw_sonar_col_label)
-        raw_sonar_col_header.addWidget(self.raw_sonar_col_toolbar)
+        raw_sonar_col_header.addStretch(1)
+        raw_sonar_col_header.addWidget(self.reset_sonar_view_button)
         raw_sonar_col_header.addWidget(raw_sonar_help_button)
         raw_sonar_col.addLayout(raw_sonar_col_header, stretch=0)
-        raw_sonar_col.addWidget(self.sonar_image_canvas, stretch=1)
+        raw_sonar_col.addWidget(self.sonar_image_view, stretch=1)
         raw_sonar_col.addLayout(self.button_row)
 
         # Create the left-most column.
@@ -547,20 +735,45 @@ class SensorWindow(QtWidgets.QMainWindow):
                 verticalalignment="center",
             )
     
-    def plot_raw_camera_data(self, camera_data):
+    def show_camera_image(self, ax, keep_limits=False):
         """
-        Update the figure that shows the bare camera image.
-
-        Since it was easy in this case, save the artist to help make
-        updates faster.
+        Show the level of the camera pyramid that matches the axes' size on screen.
+        The image always spans full-resolution pixel coordinates, so overlays
+        are drawn in those, and handle_camera_zoom swaps in a finer level when
+        the axes are zoomed in.
         """
-        if self.raw_camera_artist is None:
-            self.raw_camera_artist = self.raw_camera_ax.imshow(camera_data, cmap="gray")
+        pyramid = self.camera_pyramid
+        artist = self.camera_image_artists.get(ax)
+        if keep_limits and artist is not None and artist.axes is ax:
+            artist.set_data(pyramid.image_for_axes(ax))
+            artist.set_extent(pyramid.extent)
         else:
-            self.raw_camera_artist.set_data(camera_data)
-        self.raw_camera_canvas.draw()
+            artist = ax.imshow(pyramid.image_for_axes(ax, use_limits=False), cmap="gray", extent=pyramid.extent)
+            self.camera_image_artists[ax] = artist
+            # Clearing the axes also removes these callbacks
+            ax.callbacks.connect("xlim_changed", self.handle_camera_zoom)
+            ax.callbacks.connect("ylim_changed", self.handle_camera_zoom)
+        return artist
+
+    def handle_camera_zoom(self, ax):
+        artist = self.camera_image_artists.get(ax)
+        if artist is None or artist.axes is not ax or self.camera_pyramid is None:
+            return
+        image = self.camera_pyramid.image_for_axes(ax)
+        if image.shape != artist.get_array().shape:
+            artist.set_data(image)
+            ax.figure.canvas.draw_idle()
+
+    def plot_raw_camera_data(self):
+        """
+        Update the view that shows the bare camera image.
+
+        The raster view shows the full resolution frame without copying it,
+        and keeps the zoom when stepping between frames.
+        """
+        self.raw_camera_view.set_image(self.camera_pyramid.levels[0], cmap="gray", keep_view=True)
     
-    def plot_charuco_detections(self, camera_data, charuco_corners, charuco_ids):
+    def plot_charuco_detections(self, charuco_corners, charuco_ids):
         """
         Update the figure that shows detected aruco markers and charuco
         corners on top of the camera data.
@@ -572,7 +785,7 @@ class SensorWindow(QtWidgets.QMainWindow):
         """
         self.charuco_annotated_camera_ax.cla()
         self.charuco_annotated_camera_ax.axis("off")
-        self.charuco_annotated_camera_ax.imshow(camera_data, cmap="gray")
+        self.show_camera_image(self.charuco_annotated_camera_ax)
 
         # if len(aruco_corners) > 0:
         #     for corner, _corner_id in zip(aruco_corners, aruco_ids):
@@ -593,65 +806,64 @@ class SensorWindow(QtWidgets.QMainWindow):
 
         self.charuco_annotated_camera_canvas.draw()
 
-    def plot_camera_targets_from_sonar(self, camera_data, camera_info, cs_rot, cs_trans):
+    def plot_camera_targets_from_sonar(self, camera_info, cs_rvec, cs_tvec):
         """
         Plot name: sonar-derived locations
         Update the figure that shows the position of the labeled sonar
         targets superimposed on the camera data, using the calculated
         camera/sonar transformation.
 
-        * cs_rot -- rotation matrix from sonar to camera frames
-        * cs_trans -- translation vector from sonar to camera frames
+        * cs_rvec, cs_tvec -- transformation from camera to sonar frames
         """
         self.camera_annotated_sonar_ax.cla()
         self.camera_annotated_sonar_ax.axis("off")
-        self.camera_annotated_sonar_ax.imshow(camera_data, cmap="gray")
+        self.show_camera_image(self.camera_annotated_sonar_ax)
+        nrows, ncols = self.camera_pyramid.height, self.camera_pyramid.width
 
         color_cycler = cycler.cycler(color=matplotlib.cm.plasma(np.linspace(0, 1, 10)))
         my_cycler = color_cycler()
 
-        if self.current_timestamp in self.sonar_labels:
+        if cs_rvec is not None and self.current_timestamp in self.sonar_labels:
             points = self.sonar_labels[self.current_timestamp]
+            # cs_{rvec, tvec} give transformation from camera to sonar frame
+            # We need the opposite here ...
+            sonar_to_camera = pose_utils.invert(pose_utils.as_poses(cs_rvec, cs_tvec))
             for label, coord in points.items():
                 azi_deg, rr = isc.pixel_to_polar(coord, self.sonar_params) 
                 azi_rad = np.radians(azi_deg)
                 elev_rads = np.arange(np.radians(-10.0), np.radians(10.0), np.radians(0.25)) 
                 label_color = next(my_cycler)["color"]
 
-                for elev_rad in elev_rads:
-                    #Changed coordinate system to match camera
-                    yy = -rr * np.sin(elev_rad)
-                    zz = rr * np.cos(elev_rad) * np.cos(azi_rad)
-                    xx = rr * np.cos(elev_rad) * np.sin(azi_rad)
-                    sonar_point = np.reshape([xx, yy, zz], (3, 1))
-                    
-                    # cs_{trans, rot} give transformation from camera to sonar frame
-                    # We need the opposite here ...
-                    camera_coord = np.transpose(cs_rot) @ (sonar_point - cs_trans)
-
-                    image_coord, _ = cv2.projectPoints(
-                        camera_coord,
-                        0 * cs_trans,
-                        0 * cs_trans,
-                        camera_info.K,
-                        camera_info.D,
-                        )
-                    
-                    ix, iy = image_coord[0][0]
-                    ix, iy = int(ix), int(iy)
-                    # don't plot points outside the FOV
-                    nrows, ncols = camera_data.shape[:2]
-                    if ix >= 0 and ix < ncols and iy >= 0 and iy < nrows:
-                        self.camera_annotated_sonar_ax.plot(
-                            ix, iy, marker=".", ms=1, color=label_color
-                        )
+                #Changed coordinate system to match camera
+                yy = -rr * np.sin(elev_rads)
+                zz = rr * np.cos(elev_rads) * np.cos(azi_rad)
+                xx = rr * np.cos(elev_rads) * np.sin(azi_rad)
+                sonar_points = np.array([xx, yy, zz])
+
+                camera_coords = pose_utils.apply(sonar_to_camera, sonar_points)[0]
+
+                image_coords, _ = cv2.projectPoints(
+                    camera_coords.T,
+                    np.zeros(3),
+                    np.zeros(3),
+                    camera_info.K,
+                    camera_info.D,
+                    )
+                ix, iy = image_coords.reshape(-1, 2).astype(int).T
+                # don't plot points outside the FOV
+                in_fov = (ix >= 0) & (ix < ncols) & (iy >= 0) & (iy < nrows)
+                if not np.any(in_fov):
+                    continue
+                self.camera_annotated_sonar_ax.plot(
+                    ix[in_fov], iy[in_fov], ".", ms=1, color=label_color, scalex=False, scaley=False
+                )
 
                 # Intentionally plot the label for the last point drawn
-                self.camera_annotated_sonar_ax.text(ix, iy, label, color=label_color)
+                self.camera_annotated_sonar_ax.text(ix[in_fov][-1], iy[in_fov][-1], label, color=label_color)
 
         self.camera_annotated_sonar_canvas.draw()
 
-    def plot_camera_targets_from_camera(self, camera_data, rvec, tvec):
+    def plot_camera_targets_from_camera(self, rvec, tvec):
         """
         Plot name: Charuco-derived locations
         Update the figure that shows the inferred position of the sonar
@@ -665,10 +877,18 @@ class SensorWindow(QtWidgets.QMainWindow):
 
         if rvec is not None and tvec is not None:
 
-            cv2.drawFrameAxes(camera_data, self.camera_info.K, self.camera_info.D, rvec, tvec, .1, 3)
-            self.camera_annotated_camera_ax.imshow(camera_data, cmap="gray")
+            self.show_camera_image(self.camera_annotated_camera_ax)
+            # Board axes (x red, y green, z blue, 10 cm long), drawn as lines
+            # rather than into the image so every pyramid level shows them
+            axis_points = np.array([[0, 0, 0], [.1, 0, 0], [0, .1, 0], [0, 0, .1]], dtype=np.float64)
+            axis_pixels, _ = cv2.projectPoints(axis_points, rvec, tvec, self.camera_info.K, self.camera_info.D)
+            axis_pixels = axis_pixels.reshape(-1, 2)
+            for end, color in zip(axis_pixels[1:], ("r", "g", "b")):
+                self.camera_annotated_camera_ax.plot(
+                    [axis_pixels[0][0], end[0]], [axis_pixels[0][1], end[1]], color=color, linewidth=2,
+                    scalex=False, scaley=False
+                )
             
-            rot, _ = cv2.Rodrigues(rvec)
             pose_text = (
                 "Camera -> Target: \n"
                 "rvec = [{:.2f}, {:.2f}, {:.2f}] \n"
@@ -686,28 +906,28 @@ class SensorWindow(QtWidgets.QMainWindow):
                 )
             )
             self.charuco_pose_label.setText(pose_text)
-            for _label, (cx, cy) in self.sonar_coords.items():
-                target_point = np.reshape([cx, cy, 0], (3, 1))
+            if self.sonar_coords:
+                target_points = np.array([[cx, cy, 0] for cx, cy in self.sonar_coords.values()],
+                                         dtype=np.float64).T
                 # Option 1: object points relative to the board, using
                 # rvec/tvec from estimatePose to transform into camera frame
                 # image_coord, _  = cv2.projectPoints(object_points, rvec, tvec,
                 #                                    camera_matrix, camera_info.D)
-                # xx, yy = image_coord[0][0]
                 # Option 2: use rvec tvec to transform points into camera frame,
                 # project only corrects for distortion
-                world_coord = tvec + rot @ target_point
-                image_coord, _ = cv2.projectPoints(
-                    world_coord, 0 * rvec, 0 * tvec, self.camera_info.K, self.camera_info.D
+                world_coords = pose_utils.apply(pose_utils.as_poses(rvec, tvec), target_points)[0]
+                image_coords, _ = cv2.projectPoints(
+                    world_coords.T, np.zeros(3), np.zeros(3), self.camera_info.K, self.camera_info.D
                 )
-                xx, yy = image_coord[0][0]
-                
+                xx, yy = image_coords.reshape(-1, 2).T
+
                 # don't plot points outside the FOV
-                nrows, ncols = camera_data.shape
-                if xx >= 0 and xx < ncols and yy >= 0 and yy < nrows:
-                    y = nrows - yy
-                    self.camera_annotated_camera_ax.plot(int(xx), int(yy), "r.")
-                    # Removed because too noisy in GUI -- only useful on saved images.
-                    # self.camera_annotated_camera_ax.text(xx, yy, label, color='black')
+                nrows, ncols = self.camera_pyramid.height, self.camera_pyramid.width
+                in_fov = (xx >= 0) & (xx < ncols) & (yy >= 0) & (yy < nrows)
+                if np.any(in_fov):
+                    self.camera_annotated_camera_ax.plot(
+                        xx[in_fov].astype(int), yy[in_fov].astype(int), "r.", scalex=False, scaley=False)
+                    # Labels removed because too noisy in GUI -- only useful on saved images.
         else:
             self.charuco_pose_label.setText("Camera -> Target: None")
 
@@ -719,32 +939,17 @@ class SensorWindow(QtWidgets.QMainWindow):
         Plot sonar image in rectangular plot.
         This is the axis that will be used for human annotations.
         """
-        xlim = self.sonar_image_ax.get_xlim()
-        ylim = self.sonar_image_ax.get_ylim()
-        self.sonar_image_ax.cla()
-
-        self.sonar_image_ax.imshow(
-            data,
-            cmap="inferno",
-            aspect="auto",
-            interpolation="none",
-            origin="lower",
-        )
+        self.sonar_image_view.set_image(data, cmap="inferno", origin="lower", aspect="auto", keep_view=keep_limits)
+        self.sonar_image_view.clear_overlays()
 
         # Plot the human-provided labels
         if self.current_timestamp in self.sonar_labels:
             points = self.sonar_labels[self.current_timestamp]
-            for label, coord in points.items():
-                theta_deg, rr = coord
-                self.sonar_image_ax.plot(
-                    theta_deg, rr, scalex=False, marker="o", ms=8, c="white", fillstyle="none"
-                )
-                self.sonar_image_ax.text(theta_deg+1, rr+2, label, c="white", fontsize=8)
-
-        if keep_limits:
-            self.sonar_image_ax.set_xlim(xlim)
-            self.sonar_image_ax.set_ylim(ylim)
-        self.sonar_image_canvas.draw()
+            if points:
+                labels = list(points.keys())
+                theta_deg, rr = np.array(list(points.values()), dtype=np.float64).T
+                self.sonar_image_view.add_markers(theta_deg, rr, "white", marker="o", size=8, labels=labels)
+        self.sonar_image_view.update()
 
     def plot_cartesian_sonar_image(self, data):
         """
@@ -770,13 +975,9 @@ class SensorWindow(QtWidgets.QMainWindow):
             origin="lower",
         )
 
-        target_data = np.transpose(
-            np.array([[coord[0], coord[1], 0, label] for label, coord in self.sonar_coords.items()]))
-        
-        target_points = target_data[0:3, :].astype(np.float32)
+        target_points = isc.get_target_table().points.T
         
         if rvec is not None:
-            rot, _ = cv2.Rodrigues(rvec)
             label_text = (
                 "Sonar -> Target: \n"
                 "rvec = [{:.2f}, {:.2f}, {:.2f}]\n"
@@ -794,7 +995,7 @@ class SensorWindow(QtWidgets.QMainWindow):
                 )
             )
             self.sonar_pose_label.setText(label_text)
-            sonar_points = tvec + rot @ target_points
+            sonar_points = pose_utils.apply(pose_utils.as_poses(rvec, tvec), target_points)[0]
             sonar_coords = isc.polar_from_3d(sonar_points)
             plottable = isc.polar_to_pixel(sonar_coords, self.sonar_params)
             self.sonar_annotated_camera_ax.plot(
@@ -803,8 +1004,7 @@ class SensorWindow(QtWidgets.QMainWindow):
             # self.sonar_annotated_camera_ax.text(
             #     plottable[0, :], plottable[1, :], target_labels[:], color="r")
         if agg_rvec is not None:
-            agg_rot, _ = cv2.Rodrigues(agg_rvec) 
-            sonar_points = agg_tvec + agg_rot @ target_points
+            sonar_points = pose_utils.apply(pose_utils.as_poses(agg_rvec, agg_tvec), target_points)[0]
             sonar_coords = isc.polar_from_3d(sonar_points)
             plottable = isc.polar_to_pixel(sonar_coords, self.sonar_params)
             self.sonar_annotated_camera_ax.plot(
@@ -816,43 +1016,132 @@ class SensorWindow(QtWidgets.QMainWindow):
         self.sonar_err_label.setText("Reprojection error: {:.2f}\nAggregate reprojection error: {:.2f}".format(err, agg_err))
         self.sonar_annotated_camera_canvas.draw()
 
-    def handle_next_button(self, skip=False, reverse=False):
+    def handle_next_button(self, reverse=False):
+        """
+        Move to the next (or previous) frame that hasn't been skipped. Frames
+        without a board detection are marked skipped and passed over.
+        """
+        start = self.navigation.index_of(self.current_timestamp)
+        if start is None:
+            start = self.navigation.length if reverse else -1
+        exclude = nav.SKIP
+        if self.skip_low_quality_box.isChecked():
+            exclude |= nav.LOW_QUALITY
+        if self.skip_duplicates_box.isChecked():
+            exclude |= nav.DUPLICATE
+        while True:
+            idx = self.navigation.find(start, require=nav.PAIRED, exclude=exclude, reverse=reverse)
+            if idx is None and not reverse and self.navigation.has(self.current_timestamp, nav.SKIP):
+                # At the end, with the current frame just skipped
+                print("Returning to previous timestamp")
+                reverse = True
+                idx = self.navigation.find(start, require=nav.PAIRED, exclude=exclude, reverse=True)
+            if idx is None:
+                print("You've reached the end of the image data")
+                return
+            if self.show_pair(self.paired_data.index_of(self.navigation.timestamps[idx])):
+                return
+            start = idx
+
+    def handle_next10_button(self):
+        start = self.navigation.index_of(self.current_timestamp)
+        start = -1 if start is None else min(start + 9, self.navigation.length - 1)
+        idx = self.navigation.find(start, require=nav.PAIRED, exclude=nav.SKIP)
+        if idx is None:
+            print("You've reached the end of the image data")
+            return
+        self.seek_to_index(self.paired_data.index_of(self.navigation.timestamps[idx]))
+
+    def seek_to_index(self, idx):
+        """
+        Load pair idx from the data folders, whether or not it was skipped.
+        """
+        if not self.show_pair(idx):
+            self.handle_next_button()
+
+    def show_pair(self, idx):
+        """
+        Load and display pair idx. Returns False if it couldn't be shown
+        (no board, in which case it is marked skipped, or unreadable files).
+        """
         try:
-            self.current_timestamp, self.sonar_image, self.camera_data = self.paired_data.next(reverse=reverse)
-            if self.current_timestamp in self.skip_timestamps:
-                print("Skipping timestamp: {}".format(self.current_timestamp))
-                self.handle_next_button(skip=True, reverse=reverse)
+            self.current_timestamp, self.sonar_image, self.camera_data = self.paired_data.seek(idx)
         except Exception as ex:
-            # We expect to hit this at the end of the pairs
             print(ex)
-            if skip:
-                print("Returning to previous timestamp")
-                self.handle_next_button(skip=True, reverse=True)
-
-        self.update_plots(keep_limits=False, recalibrate=True)
+            return False
+        return self.update_plots(keep_limits=False, recalibrate=True)
 
     def handle_good_button(self):
         self.good_timestamps.add(self.current_timestamp)
-        time_str = isc.timestamp_tostr(self.current_timestamp)
-        # Using the camera's timestamp for both
-        camera_filename = "{}/{}_camera.png".format(self.outdir, time_str)
-        sonar_filename = "{}/{}_sonar.jpg".format(self.outdir, time_str)
-        print("Trying to save data to {}".format(camera_filename))
-        if not os.path.exists(camera_filename):
-            cv2.imwrite(camera_filename, self.camera_data)
-        if not os.path.exists(sonar_filename):
-            cv2.imwrite(sonar_filename, self.sonar_image)
+        self.navigation.set(self.current_timestamp, nav.GOOD)
+        idx = self.paired_data.index_of(self.current_timestamp)
+        if idx is not None:
+            self.good_sources[self.current_timestamp] = self.paired_data.get_filenames(idx)
+            isc.save_good_sources(self.outdir, self.good_sources)
+
+        if self.COPY_GOOD_IMAGES or idx is None:
+            time_str = isc.timestamp_tostr(self.current_timestamp)
+            # Using the camera's timestamp for both
+            camera_filename = "{}/{}_camera.png".format(self.outdir, time_str)
+            sonar_filename = "{}/{}_sonar.jpg".format(self.outdir, time_str)
+            # The arrays are replaced (never modified) when moving to another
+            # frame, so the writer can use them without a copy.
+            future = self.io_executor.submit(
+                self.write_good_images, camera_filename, self.camera_data,
+                sonar_filename, self.sonar_image)
+            future.add_done_callback(
+                lambda fut, name=camera_filename: self.io_finished.emit(
+                    "Saved {}".format(name) if fut.exception() is None
+                    else "Could not save {}: {}".format(name, fut.exception())))
 
         self.save_state()
         self.update_good_label()
-        print("Saved successfully")
+
+    def write_good_images(self, camera_filename, camera_data, sonar_filename, sonar_image):
+        """
+        Runs on the I/O thread.
+        """
+        if not os.path.exists(camera_filename):
+            cv2.imwrite(camera_filename, camera_data,
+                        [cv2.IMWRITE_PNG_COMPRESSION, self.PNG_COMPRESSION])
+        if not os.path.exists(sonar_filename):
+            cv2.imwrite(sonar_filename, sonar_image)
+
+    def handle_io_finished(self, message):
+        print(message)
+        self.statusBar().showMessage(message, 3000)
+
+    def closeEvent(self, event):
+        # Label edits are saved when the recalibration timer fires, so save
+        # any that are still waiting on it
+        if self.recalibration_scheduled():
+            self.recalibration_timer.stop()
+            self.save_state()
+        # Let queued image writes finish before exiting
+        self.calibration_worker.shutdown()
+        self.thumbnail_stop.set()
+        self.thumbnail_executor.shutdown(wait=True)
+        self.io_executor.shutdown(wait=True)
+        super(SensorWindow, self).closeEvent(event)
 
     def handle_unmark_good_button(self):
         self.good_timestamps.discard(self.current_timestamp)
+        self.navigation.clear(self.current_timestamp, nav.GOOD)
         self.save_state()
         self.update_good_label()
 
+    @timing_utils.timed("load_from_timestamp")
     def load_from_timestamp(self, timestamp):
+        if timestamp in self.good_sources:
+            sonarfile, camerafile = self.good_sources[timestamp]
+            try:
+                self.sonar_image, self.camera_data = self.paired_data.load_files(sonarfile, camerafile)
+                return
+            except Exception as ex:
+                print("Could not load source files for timestamp: {}".format(timestamp))
+                print(ex)
+
+        # Frames marked good before source files were recorded were copied to the output folder
         time_str = isc.timestamp_tostr(timestamp)
         camera_filename = "{}/{}_camera.png".format(self.outdir, time_str)
         sonar_filename = "{}/{}_sonar.jpg".format(self.outdir, time_str)
@@ -880,31 +1169,40 @@ class SensorWindow(QtWidgets.QMainWindow):
             return
 
     def handle_next_good_button(self):
-        ts_array = np.array(list(self.good_timestamps))
-        (future_idxs,) = np.where(ts_array > self.current_timestamp)
-        if future_idxs.size == 0:
-            print("No future data has been labeled good")
-            return
-        next_timestamp = np.min(ts_array[future_idxs])
-        self.current_timestamp = next_timestamp
-        
-        self.load_from_timestamp(next_timestamp)
-        self.update_plots(keep_limits=False, recalibrate=True)
+        self.show_good(reverse=False)
 
     def handle_prev_good_button(self):
-        ts_array = np.array(list(self.good_timestamps))
-        (past_idxs,) = np.where(ts_array < self.current_timestamp)
-        if past_idxs.size == 0:
-            print("No previous data has been labeled good")
+        self.show_good(reverse=True)
+
+    def show_good(self, reverse):
+        start = self.navigation.index_of(self.current_timestamp)
+        idx = self.navigation.find(start, require=nav.GOOD, reverse=reverse)
+        if idx is None:
+            print("No {} data has been labeled good".format("previous" if reverse else "future"))
             return
-        prev_timestamp = np.max(ts_array[past_idxs])
-        self.load_from_timestamp(prev_timestamp)
-        self.update_plots(keep_limits=False, recalibrate=True)
+        if not self.show_timestamp(self.navigation.timestamps[idx]):
+            self.handle_next_button()
+
+    def show_timestamp(self, timestamp):
+        """
+        Display the frame at timestamp, from the data folders if it is one of
+        the pairs and from the saved good images otherwise. Returns as show_pair.
+        """
+        pair_idx = self.paired_data.index_of(timestamp)
+        if pair_idx is not None:
+            return self.show_pair(pair_idx)
+        self.current_timestamp = timestamp
+        self.load_from_timestamp(timestamp)
+        return self.update_plots(keep_limits=False, recalibrate=True)
 
     def handle_skip_button(self):
+        self.mark_skipped()
+        self.handle_next_button()
+
+    def mark_skipped(self):
         self.skip_timestamps.add(self.current_timestamp)
+        self.navigation.set(self.current_timestamp, nav.SKIP)
         self.save_state()
-        self.handle_next_button()
 
     def handle_remove_label_button(self):
         dialog = EnterPointDialog(self.remove_point, True)
@@ -914,7 +1212,21 @@ class SensorWindow(QtWidgets.QMainWindow):
         dialog.exec_()
 
     def handle_recalibrate_button(self):
-        self.update_plots(keep_limits=False, recalibrate=True)
+        if not self.update_plots(keep_limits=False, recalibrate=True):
+            self.handle_next_button()
+
+    def handle_audit_button(self):
+        """
+        Residuals of every label against the aggregate calibration, saved to
+        output/residuals; then show the frame with the worst label.
+        """
+        if self.agg_rvec is None:
+            print("No aggregate calibration yet, press Recalibrate first")
+            return
+        _, _, ranked, _ = residual_audit.audit(self.sonar_labels, self.camera_poses, self.agg_rvec,
+                                               self.agg_tvec, self.sonar_params, f"{self.outdir}/residuals")
+        if ranked and ranked[0][0] != self.current_timestamp:
+            self.show_timestamp(ranked[0][0])
 
     def remove_point(self, text, remove_all):
         if self.current_timestamp in self.sonar_labels:
@@ -927,8 +1239,7 @@ class SensorWindow(QtWidgets.QMainWindow):
                     if len(self.sonar_labels[self.current_timestamp]) == 0:
                         del self.sonar_labels[self.current_timestamp]
       
-            self.save_state()
-            self.update_plots(recalibrate=True) 
+            self.labels_changed(recalibrate=True)
     
     def add_point(self, event, text, remove_all):
         """
@@ -943,10 +1254,31 @@ class SensorWindow(QtWidgets.QMainWindow):
             self.sonar_labels[self.current_timestamp] = {}
 
         self.sonar_labels[self.current_timestamp][label] = (event.xdata, event.ydata)
-        self.save_state()
-        self.update_plots()
+        self.labels_changed()
         print("point added", event.xdata, ", ", event.ydata)
 
+    def labels_changed(self, recalibrate=False):
+        """
+        Redraw the labels right away, and (re)start the timer for a single
+        recalibration covering every edit made in quick succession. Only the
+        stages that depend on the labels are rerun: the board detection and
+        the sonar image from the last update_plots are reused.
+        """
+        self.navigation.set(self.current_timestamp, nav.LABELED,
+                            self.current_timestamp in self.sonar_labels)
+        self.edit_count += 1
+        self.dirty_frames[self.current_timestamp] = self.edit_count
+        self.pending_recalibrate = self.pending_recalibrate or recalibrate
+        self.plot_sonar_image(self.current_sonar_matrix, keep_limits=True)
+        self.recalibration_timer.start()
+
+    def recalibration_scheduled(self):
+        return self.recalibration_timer.isActive()
+
+    def run_scheduled_recalibration(self):
+        self.save_state()
+        self.start_calibration()
+
     def handle_sonar_click(self, event):
         """
         Store the location of the previous click in order to determine
@@ -964,6 +1296,9 @@ class SensorWindow(QtWidgets.QMainWindow):
             or abs(self.click_event.y - event.y) > 2
         ):
             return
+        if event.xdata is None or event.ydata is None:
+            # Released outside the image
+            return
         dialog = EnterPointDialog(lambda x, delete, event=event: self.add_point(event, x, False))
         dialog.exec_()
         
@@ -977,131 +1312,55 @@ class SensorWindow(QtWidgets.QMainWindow):
             self.good_label.setText("label: Unknown")
         self.good_label.setPalette(palette)
 
-    def calibrate_sonar(self, camera_rvec, camera_tvec):
-        """
-        I've found that its more stable to direcly solve for the camera->sonar
-        transformation than to try to solve for the sonar->board transform
-        and then chain them. I think this is because we can start the former
-        optimization with a much better prior, so it's likely to land in the
-        correct local minimum.
-
-        I've also found it more stable if we first solve for the translation,
-        holding rotation constant, and then solve for the full pose.
-
-        * sonar_points: locations of the detected points in the sonar frame
-        * cs_rvec: rotation to align
-        * cs_tvec: vector from camera frame to sonar frame
-        """
-        have_labels = self.current_timestamp in self.sonar_labels
-        if not have_labels or camera_rvec is None:
-            return None, None, None, None, None
-        
-        labeled_points = self.sonar_labels[self.current_timestamp]
-        sonar_points, target_points = isc.get_sonar_target_correspondences(labeled_points, self.sonar_params)
-        
-        # Transform from target's coordinate frame to camera coordinate frame
-        camera_rot, _ = cv2.Rodrigues(camera_rvec)
-        camera_points = camera_tvec + camera_rot @ target_points
-        
-        #print("init err ", isc.calc_projection_error(camera_points, sonar_points, self.ext_rvec, self.ext_tvec, self.sonar_params, True))
-
-        cs_err, cs_rvec, cs_tvec = isc.calibrate_sonar(
-            sonar_points,
-            camera_points,
-            self.sonar_params,
-            self.ext_rvec,
-            self.ext_tvec,
-        )
-
-        cs_rot, _ = cv2.Rodrigues(cs_rvec)
-        dx, dy, dz = cs_tvec[0][0], cs_tvec[1][0], cs_tvec[2][0]
-        yaw, pitch, roll = cs_rvec[0][0], cs_rvec[1][0], cs_rvec[2][0]
-        
-        pose_text = ("Final cs_tvec: {:03f} {:03f} {:03f} \n"
-        "Final cs_rvec: {:03f} {:03f} {:03f}".format(dx, dy, dz, yaw, pitch, roll))
-        self.final_pose_label.setText(pose_text)
-
-        # Calculate sonar-> target from camera->sonar and camera->target
-        camera_rot, _ = cv2.Rodrigues(camera_rvec)
-        sonar_tvec = cs_tvec + cs_rot @ camera_tvec
-        sonar_rot = cs_rot @ camera_rot
-        sonar_rvec, _ = cv2.Rodrigues(sonar_rot)
-
-        vectors = (cs_err, cs_rvec, cs_tvec, sonar_rvec, sonar_tvec)
-        self.calibration_results[self.current_timestamp] = (vectors, sonar_points, camera_points)
-        self.save_state()
-
-        return cs_rvec, cs_tvec, sonar_rvec, sonar_tvec, cs_err
-
     def multi_calibration(self, timestamps, current_time = None):
-        if not self.calibration_results:
-            return -1, None, None
-        
-        all_sonar_points = []
-        all_camera_points = []
-        current_son_pts, current_cam_pts = None, None
-        for timestamp in timestamps:
-            try:
-                results, sonar_pts, camera_pts = self.calibration_results[timestamp]
-                if timestamp == current_time:
-                    current_son_pts = sonar_pts
-                    current_cam_pts = camera_pts
-                # sonar_pts is 2xN numpy array
-                # camera_pts is a 3xN numpy array
-                all_sonar_points.append(sonar_pts)
-                all_camera_points.append(camera_pts)
-            except IndexError("One or more timestamps do not exist. Cancelling operation"):
-                return
-            
-        concat_sonar = np.concat(all_sonar_points, axis=1)
-        concat_camera = np.concat(all_camera_points, axis=1)
-
-        agg_cs_err, agg_cs_rvec, agg_cs_tvec = isc.calibrate_sonar(
-            concat_sonar,
-            concat_camera,
+        return isc.multi_calibrate(
+            self.calibration_results,
+            timestamps,
             self.sonar_params,
             self.ext_rvec,
             self.ext_tvec,
+            current_time=current_time,
         )
 
-        if current_cam_pts is not None and current_son_pts is not None:
-            current_err = isc.calc_projection_error(current_cam_pts, current_son_pts, agg_cs_rvec, agg_cs_tvec, self.sonar_params)
-            current_err/=(current_son_pts.shape[1])
-            return current_err, agg_cs_rvec, agg_cs_tvec
-        else:
-            return agg_cs_err, agg_cs_rvec, agg_cs_tvec
-
     
+    @timing_utils.timed("update_plots")
     def update_plots(self, keep_limits=True, recalibrate=False):
         self.timestamp_label.setText(f"Sonar timestamp: {self.current_timestamp}")
         self.update_good_label()
+        self.filmstrip.set_current(self.paired_data.index_of(self.current_timestamp))
+        self.update_quality_label()
 
-        charucoCorners, charucoIds, camera_tvec, camera_rvec = charuco_utils.detect_charuco_board(
-                        self.charuco_board, self.camera_data, self.camera_info.K, self.camera_info.D
-                        )
+        with timing_utils.span("update_plots.detect_charuco"):
+            charucoCorners, charucoIds, camera_tvec, camera_rvec = charuco_utils.detect_charuco_board(
+                            self.charuco_board, self.camera_data, self.camera_info.K, self.camera_info.D
+                            )
         
         if camera_rvec is not None:
             self.camera_poses[self.current_timestamp] = (camera_rvec, camera_tvec)
+            self.navigation.set(self.current_timestamp, nav.BOARD)
         else:
             print("No charuco detections. Automatically skipping")
-            self.handle_skip_button()
+            self.mark_skipped()
+            return False
 
         ######################
         # Update the figures
-        camera_gray = cv2.cvtColor(self.camera_data.copy(), cv2.COLOR_RGB2GRAY)
-        self.plot_raw_camera_data(camera_gray) #TODO: display color image with true colors
-        self.plot_charuco_detections(camera_gray, charucoCorners, charucoIds)
-        self.plot_camera_targets_from_camera(camera_gray, camera_rvec, camera_tvec)
+        with timing_utils.span("update_plots.draw_camera"):
+            camera_gray = cv2.cvtColor(self.camera_data, cv2.COLOR_RGB2GRAY)
+            self.camera_pyramid = ImagePyramid(camera_gray)
+            self.plot_raw_camera_data() #TODO: display color image with true colors
+            self.plot_charuco_detections(charucoCorners, charucoIds)
+            self.plot_camera_targets_from_camera(camera_rvec, camera_tvec)
+
+        with timing_utils.span("update_plots.remap"):
+            sonar_matrix = isc.polar_sonar_image(self.sonar_image, self.polar_transform)
+        self.current_sonar_matrix = sonar_matrix
+        self.current_camera_pose = (camera_rvec, camera_tvec)
+
+        with timing_utils.span("update_plots.draw_sonar"):
+            self.plot_sonar_image(sonar_matrix, keep_limits=keep_limits)
+            self.plot_cartesian_sonar_image(sonar_matrix)
 
-        sonar_matrix = cv2.remap(self.sonar_image, *self.polar_transform, cv2.INTER_LINEAR)
-        sonar_matrix = cv2.flip(sonar_matrix, 0)
-        
-        cc = self.calibrate_sonar(camera_rvec, camera_tvec)
-        cs_rvec, cs_tvec, sonar_rvec, sonar_tvec, cs_err = cc
-        if recalibrate:
-            self.agg_err, self.agg_rvec, self.agg_tvec = self.multi_calibration(
-                self.calibration_results.keys(), current_time=self.current_timestamp) #all timestamps
-                
         # Code for saving data to plot number of images vs calibration accuracy:
         # combos = dtools.generate_calibration_groups(list(self.calibration_results.keys()))
         # my_data = []
@@ -1115,62 +1374,126 @@ class SensorWindow(QtWidgets.QMainWindow):
         # np.savetxt("data5.csv", my_data, 
         #         delimiter = ",")    
         # print("data5 saved")
-        
-        if self.agg_rvec is None:
-            agg_cs_rot, agg_son_tvec, agg_son_rot, agg_son_rvec = None, None, None, None
-        else:
-            agg_cs_rot, _ = cv2.Rodrigues(self.agg_rvec)
-            camera_rot, _ = cv2.Rodrigues(camera_rvec)
-            agg_son_tvec = self.agg_tvec + agg_cs_rot @ camera_tvec
-            agg_son_rot = agg_cs_rot @ camera_rot
-            agg_son_rvec, _ = cv2.Rodrigues(agg_son_rot)
-        print("overall calibration value\nRvec: ", self.agg_rvec, "Tvec: \n", self.agg_tvec)
 
-        self.plot_sonar_image(sonar_matrix, keep_limits=keep_limits)
-        self.plot_cartesian_sonar_image(sonar_matrix)
+        self.start_calibration(recalibrate)
+        self.save_state()
+        return True
 
-        if sonar_rvec is None:
-            cs_err = -1.0
+    def start_calibration(self, recalibrate=False):
+        """
+        Solve for the current frame (and everything, if recalibrate) in the
+        background. The overlays show a pending state until the result arrives
+        in handle_calibration_finished.
 
-        if cs_rvec is None:
-            cs_rotation = None
+        I've found that its more stable to direcly solve for the camera->sonar
+        transformation than to try to solve for the sonar->board transform
+        and then chain them; see isc.calibrate_frame.
+        """
+        # Anything scheduled by label edits is included in this solve
+        self.recalibration_timer.stop()
+        recalibrate = recalibrate or self.pending_recalibrate
+        self.pending_recalibrate = recalibrate
+
+        frames = {}
+        for timestamp in set(self.dirty_frames) | {self.current_timestamp}:
+            if timestamp == self.current_timestamp:
+                pose = self.current_camera_pose
+            else:
+                pose = self.camera_poses.get(timestamp)
+            frames[timestamp] = (dict(self.sonar_labels.get(timestamp, {})), pose)
+
+        if len(frames) == 1 and not frames[self.current_timestamp][0] and not recalibrate:
+            # Nothing to solve, but a solve for the previous frame may still be running
+            self.calibration_worker.invalidate()
+            self.calibration_pending = False
+            self.calibration_results.pop(self.current_timestamp, None)
+            self.dirty_frames.pop(self.current_timestamp, None)
+            self.draw_calibration(None)
+            return
+
+        self.calibration_pending = True
+        self.submitted_edits = {timestamp: self.dirty_frames.get(timestamp) for timestamp in frames}
+        self.calibration_worker.submit(
+            self.current_timestamp, solve_frames,
+            frames, dict(self.calibration_results), self.sonar_params,
+            self.ext_rvec, self.ext_tvec, current_time=self.current_timestamp, aggregate=recalibrate,
+            clusters=self.paired_data.cluster_map(set(self.calibration_results) | set(frames)))
+        self.final_pose_label.setText("Camera -> Sonar: calibrating...")
+        self.draw_calibration(None, pending=True)
+
+    def handle_calibration_finished(self, job):
+        if not self.calibration_worker.is_current(job) or job.timestamp != self.current_timestamp:
+            # Superseded by another frame or another label edit
+            return
+        self.calibration_pending = False
+        if job.error is not None:
+            print("Calibration failed: {}".format(job.error))
+            self.final_pose_label.setText("Camera -> Sonar: calibration failed")
+            return
+
+        frame_results, aggregate_result = job.result
+        for timestamp, frame_result in frame_results.items():
+            if frame_result is not None:
+                self.calibration_results[timestamp] = frame_result
+            else:
+                self.calibration_results.pop(timestamp, None)
+            # Keep frames that were edited again while this was solving
+            if self.dirty_frames.get(timestamp) == self.submitted_edits.get(timestamp):
+                self.dirty_frames.pop(timestamp, None)
+        if aggregate_result is not None:
+            self.agg_err, self.agg_rvec, self.agg_tvec = aggregate_result
+            self.pending_recalibrate = False
+        self.draw_calibration(frame_results[job.timestamp])
+        self.save_state()
+
+    @timing_utils.timed("update_plots.draw_overlays")
+    def draw_calibration(self, frame_result, pending=False):
+        """
+        Draw the calibration-dependent overlays for the current frame.
+        frame_result is the frame's calibration_results entry, or None.
+        """
+        camera_rvec, camera_tvec = self.current_camera_pose
+        if frame_result is None:
+            cs_rvec, cs_tvec, sonar_rvec, sonar_tvec, cs_err = None, None, None, None, -1.0
+        else:
+            (cs_err, cs_rvec, cs_tvec, sonar_rvec, sonar_tvec), _, _ = frame_result
+            dx, dy, dz = cs_tvec[0][0], cs_tvec[1][0], cs_tvec[2][0]
+            yaw, pitch, roll = cs_rvec[0][0], cs_rvec[1][0], cs_rvec[2][0]
+            pose_text = ("Final cs_tvec: {:03f} {:03f} {:03f} \n"
+            "Final cs_rvec: {:03f} {:03f} {:03f}".format(dx, dy, dz, yaw, pitch, roll))
+            self.final_pose_label.setText(pose_text)
+
+        if self.agg_rvec is None or pending:
+            agg_son_tvec, agg_son_rvec = None, None
         else:
-            cs_rotation, _ = cv2.Rodrigues(cs_rvec)
+            # sonar->target = camera->sonar composed with camera->target
+            agg_son_pose = pose_utils.compose(pose_utils.as_poses(self.agg_rvec, self.agg_tvec),
+                                              pose_utils.as_poses(camera_rvec, camera_tvec))
+            agg_son_rvec, agg_son_tvec = pose_utils.as_columns(agg_son_pose)
+        if not pending:
+            print("overall calibration value\nRvec: ", self.agg_rvec, "Tvec: \n", self.agg_tvec)
 
         #agg_err = isc.calc_projection_error(camera_points, sonar_points, agg_cs_rvec, agg_cs_tvec, self.sonar_params)
-        self.plot_camera_targets_from_sonar(camera_gray, self.camera_info, cs_rotation, cs_tvec)
-
+        self.plot_camera_targets_from_sonar(self.camera_info, cs_rvec, cs_tvec)
         self.plot_sonar_targets_from_camera(
-            sonar_matrix, sonar_rvec, sonar_tvec, 
+            self.current_sonar_matrix, sonar_rvec, sonar_tvec, 
             agg_son_rvec, agg_son_tvec, 
             camera_rvec, camera_tvec, cs_err, self.agg_err
         )
-        self.save_state()
+        if pending:
+            self.sonar_err_label.setText("Reprojection error: pending\nAggregate reprojection error: pending")
 
     def load_state(self):
-        labels_filename = "{}/calibration_labels.pkl".format(self.outdir)
-        calibration_filename = "{}/calibration_data.pkl".format(self.outdir)
-        poses_filename = "{}/camera_poses.pkl".format(self.outdir)
-        if os.path.exists(labels_filename):
-            try:
-                with open(labels_filename, "rb") as fp:
-                    labels = pickle.load(fp)
-                with open(calibration_filename, "rb") as fp:
-                    points = pickle.load(fp)
-                with open(poses_filename, "rb") as fp:
-                    poses = pickle.load(fp)    
-                
-                return labels["good_timestamps"], labels["skip_timestamps"], labels["sonar_labels"], points, poses
-
-            except Exception as ex:
-                print("Could not load labels from: {}".format(labels_filename))
-                # Intentionally not trying to recover, since we don't wan't
-                # to accidentally overwrite a file that the human has
-                # already started!
-                raise (ex)
-        else:
-            return set(), set(), {}, {}, {}
+        try:
+            return isc.load_session_state(self.outdir)
+        except Exception as ex:
+            print("Could not load labels from: {}".format(self.outdir))
+            # Intentionally not trying to recover, since we don't wan't
+            # to accidentally overwrite a file that the human has
+            # already started!
+            raise (ex)
 
+    @timing_utils.timed("save_state")
     def save_state(self):
         """
         Save all of the human-generated metadata.
@@ -1205,7 +1528,15 @@ if __name__ == "__main__":
     # Name of folder containing sonar and camera images. Data will be saved here
     rootdir = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025"
 
+    # Pass --timing (or set SONAR_CALIB_TIMING=1) to record how long each stage
+    # takes; the trace and summary are saved to the output folder on exit.
+    if "--timing" in sys.argv:
+        timing_utils.enable()
+
     app = QtWidgets.QApplication(sys.argv)
     window = SensorWindow(rootdir)
+    if timing_utils.timer.enabled:
+        app.aboutToQuit.connect(lambda: timing_utils.timer.export(window.outdir))
+        app.aboutToQuit.connect(timing_utils.timer.print_summary)
     window.showMaximized()         
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+
+import image_sonar_utils as isc
+import frame_dedup
+
+class CalibrationJob():
+    """
+    Outcome of a background solve.
+
+    generation -- value of CalibrationWorker.generation when it was submitted
+    timestamp -- frame the solve was for
+    result -- return value of the solve function (None if it raised)
+    error -- exception raised by the solve function, if any
+    """
+    def __init__(self, generation, timestamp, result=None, error=None):
+        self.generation = generation
+        self.timestamp = timestamp
+        self.result = result
+        self.error = error
+
+class CalibrationWorker(QtCore.QObject):
+    """
+    Runs calibration solves on a background thread, one at a time, so the
+    window stays responsive.
+
+    Every submit starts a new generation and cancels the solve that was running
+    (the optimizer checks its cancel event on every evaluation). Finished jobs
+    are delivered on the gui thread through the finished signal; jobs from an
+    older generation should be ignored, which is_current checks.
+    """
+    finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(CalibrationWorker, self).__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.generation = 0
+        self.cancel_event = threading.Event()
+
+    def submit(self, timestamp, fn, *args, **kwargs):
+        """
+        Run fn(*args, cancel=event, **kwargs) in the background.
+        Returns the generation of the new job.
+        """
+        self.invalidate()
+        self.executor.submit(self._run, self.generation, self.cancel_event, timestamp, fn, args, kwargs)
+        return self.generation
+
+    def invalidate(self):
+        """
+        Cancel the running solve and make any result still on its way stale.
+        """
+        self.cancel_event.set()
+        self.cancel_event = threading.Event()
+        self.generation += 1
+
+    def is_current(self, job):
+        return job.generation == self.generation
+
+    def shutdown(self):
+        self.invalidate()
+        self.executor.shutdown(wait=True)
+
+    def _run(self, generation, cancel, timestamp, fn, args, kwargs):
+        # Skip jobs that were superseded while waiting for the thread
+        if cancel.is_set():
+            return
+        try:
+            result = fn(*args, cancel=cancel, **kwargs)
+        except isc.CalibrationCancelled:
+            return
+        except Exception as ex:
+            self.finished.emit(CalibrationJob(generation, timestamp, error=ex))
+            return
+        self.finished.emit(CalibrationJob(generation, timestamp, result))
+
+def solve_frames(frames, calibration_results, sonar, init_rvec=None, init_tvec=None,
+                 current_time=None, aggregate=False, clusters=None, cancel=None):
+    """
+    Calibrate each frame in frames and, if aggregate, redo the calibration over
+    every frame.
+
+    frames maps timestamp to (labeled_points, camera_pose), where camera_pose is
+    (rvec, tvec) or None if the board wasn't found. frames and
+    calibration_results should be copies that the gui won't modify while this runs.
+    Returns (frame_results, aggregate_result): frame_results maps each timestamp
+    in frames to its calibration_results entry (None without labels or a board
+    pose), and aggregate_result is (err, rvec, tvec) from multi_calibrate
+    (None unless aggregate).
+
+    If clusters (timestamp -> near-duplicate cluster id) is given, the
+    aggregate uses one frame per cluster: the one with the most labels.
+    The aggregate error is for the current_time frame whether or not it was
+    one of the frames used.
+    """
+    results = dict(calibration_results)
+    frame_results = {}
+    for timestamp, (labeled_points, camera_pose) in frames.items():
+        frame_result = None
+        if labeled_points and camera_pose is not None:
+            frame_result = isc.calibrate_frame(
+                labeled_points, camera_pose[0], camera_pose[1], sonar, init_rvec, init_tvec, cancel)
+            results[timestamp] = frame_result
+        else:
+            results.pop(timestamp, None)
+        frame_results[timestamp] = frame_result
+
+    aggregate_result = None
+    if aggregate:
+        timestamps = list(results.keys())
+        if clusters:
+            weights = {timestamp: results[timestamp][1].shape[1] for timestamp in timestamps}
+            # Ties go to the frame on screen
+            if current_time in weights:
+                weights[current_time] += 0.5
+            timestamps = frame_dedup.one_per_cluster(timestamps, clusters, weights)
+        agg_err, agg_rvec, agg_tvec = isc.multi_calibrate(
+            results, timestamps, sonar, init_rvec, init_tvec,
+            current_time=current_time, cancel=cancel)
+        # multi_calibrate only reports the current frame's error if it was
+        # used; a near-duplicate of a frame with more labels is left out
+        if agg_rvec is not None and current_time in results and current_time not in timestamps:
+            _, sonar_points, camera_points = results[current_time]
+            agg_err = isc.calc_projection_error(camera_points, sonar_points, agg_rvec, agg_tvec, sonar)
+            agg_err /= sonar_points.shape[1]
+        aggregate_result = (agg_err, agg_rvec, agg_tvec)
+    return frame_results, aggregate_result
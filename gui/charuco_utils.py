@@ -1,38 +1,79 @@
 import cv2
 import cv2.aruco
 import numpy as np
-
-ARUCO_DICT_ID = cv2.aruco.DICT_4X4_250
-BOARD_ROWS = 8
-BOARD_COLS = 11
-SQUARE_LENGTH = .026   
-MARKER_LENGTH = .0195   
+import os
+import json
+import functools
+import threading
+
+# Board size, aruco dictionary, square/marker lengths (meters) and the sonar
+# targets (bolts). Each target is given by the index of the black square it is
+# bolted through, counting black squares in row-major order from the top left.
+TARGET_SPEC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "target_spec.json")
+
+def load_target_spec(filename=TARGET_SPEC_FILE):
+    with open(filename, 'r') as file:
+        spec = json.load(file)
+    spec["dictionary_id"] = getattr(cv2.aruco, spec["dictionary"])
+    return spec
+
+TARGET_SPEC = load_target_spec()
+ARUCO_DICT_ID = TARGET_SPEC["dictionary_id"]
+BOARD_ROWS = TARGET_SPEC["board_rows"]
+BOARD_COLS = TARGET_SPEC["board_cols"]
+SQUARE_LENGTH = TARGET_SPEC["square_length"]
+MARKER_LENGTH = TARGET_SPEC["marker_length"]
 MARGIN_PX = 0   
 
+# Detectors aren't safe to share between threads, so each thread gets its own
+_local = threading.local()
+
 def generate_charuco_board_image(pixel_dims, filename):
     """
     Save an image of the charuco target
     pixel_dims: tuple of width, height in pixels ex. (3300, 2400)
     filename: name that the image will be saved as (include image type extension)
     """
-    dictionary = cv2.aruco.getPredefinedDictionary(ARUCO_DICT_ID)
-    board = cv2.aruco.CharucoBoard((BOARD_COLS, BOARD_ROWS), SQUARE_LENGTH, MARKER_LENGTH, dictionary) 
+    _, board = make_charuco_board()
     image = board.generateImage(pixel_dims, None, 0, 1)
     cv2.imwrite(filename, image)
 
 
+@functools.lru_cache(maxsize=None)
 def make_charuco_board():
-    # type: string -> Tuple[cv2.aruco_Dictionary, cv2.aruco_CharucoBoard]
+    # type: () -> Tuple[cv2.aruco_Dictionary, cv2.aruco_CharucoBoard]
     """
-    Given the name of a board/plinth, return the dictionary used and the board.
+    Return the dictionary used and the board described by the target spec.
+    Both are built once per process and shared, so don't modify them.
 
     The dictionary isn't used by most callers, but is handy to have for plotting
     the individual markers for debugging.
     """
     dictionary = cv2.aruco.getPredefinedDictionary(ARUCO_DICT_ID)
+    #cols then rows, the wrong order caused problems earlier
     board = cv2.aruco.CharucoBoard((BOARD_COLS, BOARD_ROWS), SQUARE_LENGTH, MARKER_LENGTH, dictionary) 
     return dictionary, board
 
+def board_config():
+    """
+    Tuple identifying the board geometry, e.g. for keying cached detections.
+    """
+    return (ARUCO_DICT_ID, BOARD_ROWS, BOARD_COLS, SQUARE_LENGTH, MARKER_LENGTH)
+
+def get_detector(board=None):
+    """
+    Charuco detector for the spec board (or the given board), reused within a thread.
+    """
+    if board is None:
+        _, board = make_charuco_board()
+    detectors = getattr(_local, "detectors", None)
+    if detectors is None:
+        detectors = _local.detectors = {}
+    key = id(board)
+    if key not in detectors:
+        detectors[key] = (board, cv2.aruco.CharucoDetector(board))
+    return detectors[key][1]
+
 def get_board_center(board):
     """
     Return coordinates (in meters) of the center of the board.
@@ -46,7 +87,7 @@ def detect_charuco_board(board, image, mtx, dst):
     Find charuco corners in the image and use them to estimate board position
     """
     #image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-    detector = cv2.aruco.CharucoDetector(board)
+    detector = get_detector(board)
     charucoCorners, charucoIds, marker_corners, marker_ids = detector.detectBoard(image)
 
     if charucoCorners is not None and charucoIds is not None and len(charucoCorners) > 3:
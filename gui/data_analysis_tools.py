@@ -1,6 +1,48 @@
+import os
+import sys
+import json
+import itertools
 import numpy as np
-import pickle
-import calibration_gui as gui
+import matplotlib
+import matplotlib.figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+
+import image_sonar_utils as isc
+import pose_utils
+
+# Groups of each size calibrated by calibrate_groups; sizes with more possible
+# groups than this are sampled, since there are 2^N groups of N frames
+MAX_GROUPS_PER_SIZE = 50
+# Length (m) of the board normal drawn on the pose coverage plot
+SKEW_LENGTH = 0.1
+# The pose coverage bubbles are sized by how much closer than this the board is
+BUBBLE_DEPTH = 2.0
+# Columns of the calibration table, as saved in data5.csv
+TABLE_COLUMNS = ["Pairs", "Error", "Rx", "Ry", "Rz", "Tx", "Ty", "Tz"]
+# Columns of the leave-one-frame-out table; the errors are per point on the
+# held out frame, and the changes are from the solution with every frame
+CV_COLUMNS = ["Held out error", "In-sample error", "Rotation change (deg)", "Translation change (cm)",
+              "Rx", "Ry", "Rz", "Tx", "Ty", "Tz"]
+
+class Session():
+    """
+    Results of one labeling session, read directly from the gui's output folder.
+
+    ext_rvec, ext_tvec -- reference calibration from inputparams.json
+    calibration_results -- timestamp -> (vectors, sonar_points, camera_points)
+    camera_poses -- timestamp -> (rvec, tvec) of the board in the camera frame
+    """
+    def __init__(self, rootdir):
+        self.rootdir = rootdir
+        with open(f"{rootdir}/inputparams.json", "r") as fp:
+            params = json.load(fp)
+        self.ext_rvec = np.array(params["ext_r"], dtype=np.float64)
+        self.ext_tvec = np.array(params["ext_t"], dtype=np.float64)
+        self.sonar = isc.SonarInfo(params["sonar_range"], params["sonar_wide"],
+                                   f"{rootdir}/sonar_cropping_params.json")
+        (self.good_timestamps, self.skip_timestamps, self.sonar_labels,
+         self.calibration_results, self.camera_poses) = isc.load_session_state(f"{rootdir}/output")
 
 def generate_calibration_groups(good):
     """
@@ -14,35 +56,293 @@ def generate_calibration_groups(good):
         others = generate_calibration_groups(good[1:])
         combos = [first+other for other in others]
         return [first]+others+combos
-        
-def save_csv_data(timestamp_groups):
-    #combos = self.generate_calibration_groups(list(self.calibration_results.keys()))
-    my_data = []
-    for group in timestamp_groups:
-        err, r, t = gui.multi_calibration(group)
-        rlin = [r[0][0], r[1][0], r[2][0]]
-        tlin = [t[0][0], t[1][0], t[2][0]]
-        my_data.append([len(group), err, *rlin, *tlin])
-    #print(my_data)
-    my_data = np.array(my_data)
-    np.savetxt("data5.csv", my_data, 
-            delimiter = ",")    
-        
-
-        
-# poses_file = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-21-2025/output/camera_poses.pkl"
-# with open(poses_file, "rb") as fp:
-#     poses = pickle.load(fp)
-#     flattened = []
-#     for vec in poses.values():
-#         rvec, tvec = vec[0], vec[1]
-#         rvec = np.reshape(rvec, (1, 3))
-#         tvec = np.reshape(tvec, (1, 3))
-#         line = np.concat([rvec, tvec], axis=1)
-#         flattened.append(line)
-#     print(flattened)
-#     poses = np.array(flattened)
-#     poses = np.vstack(poses)
-#     print("poses", poses.shape, poses)
-
-# np.savetxt("posesdata2.csv", poses, delimiter = ",")
\ No newline at end of file
+
+def sample_calibration_groups(timestamps, max_per_size=MAX_GROUPS_PER_SIZE, seed=0):
+    """
+    Groups of timestamps of every size from 1 to N: all of them for sizes with
+    at most max_per_size groups, and a random sample of max_per_size otherwise.
+    """
+    timestamps = sorted(timestamps)
+    rng = np.random.default_rng(seed)
+    groups = []
+    for size in range(1, len(timestamps) + 1):
+        count = 1
+        for ii in range(size):
+            count = count * (len(timestamps) - ii) // (ii + 1)
+        if count <= max_per_size:
+            groups.extend(itertools.combinations(timestamps, size))
+            continue
+        chosen = set()
+        while len(chosen) < max_per_size:
+            chosen.add(tuple(sorted(rng.choice(len(timestamps), size, replace=False))))
+        groups.extend(tuple(timestamps[ii] for ii in group) for group in sorted(chosen))
+    return groups
+
+# Set once in each worker process by _init_worker
+_worker_data = None
+
+def _init_worker(calibration_results, sonar, init_rvec, init_tvec):
+    global _worker_data
+    _worker_data = (calibration_results, sonar, init_rvec, init_tvec)
+
+def _calibrate_group(group):
+    calibration_results, sonar, init_rvec, init_tvec = _worker_data
+    err, rvec, tvec = isc.multi_calibrate(calibration_results, group, sonar, init_rvec, init_tvec)
+    return [len(group), err, *np.ravel(rvec), *np.ravel(tvec)]
+
+def _leave_one_out(held_out):
+    calibration_results, sonar, init_rvec, init_tvec = _worker_data
+    others = sorted(ts for ts in calibration_results if ts != held_out)
+    _, rvec, tvec = isc.multi_calibrate(calibration_results, others, sonar, init_rvec, init_tvec)
+    _, sonar_points, camera_points = calibration_results[held_out]
+    err = isc.calc_projection_error(camera_points, sonar_points, rvec, tvec, sonar) / sonar_points.shape[1]
+    return [err, *np.ravel(rvec), *np.ravel(tvec)]
+
+def calibrate_groups(session, groups, workers=None):
+    """
+    Aggregate calibration of each group of timestamps, in a pool of worker processes.
+    Returns an (N, 8) table with columns TABLE_COLUMNS.
+    """
+    initargs = (session.calibration_results, session.sonar, session.ext_rvec, session.ext_tvec)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        rows = list(executor.map(_calibrate_group, groups, chunksize=8))
+    return np.array(rows, dtype=np.float64).reshape(-1, len(TABLE_COLUMNS))
+
+def cross_validate(session, workers=None):
+    """
+    Leave-one-frame-out check of the aggregate calibration. Each labeled frame
+    is dropped in turn and the others are solved (warm-started from the
+    solution with every frame, in a pool of worker processes).
+    Returns (timestamps, (N, 10) table with columns CV_COLUMNS, full solution
+    as (err, rvec, tvec)).
+    """
+    timestamps = sorted(session.calibration_results)
+    if len(timestamps) < 2:
+        raise Exception("Cross-validation needs at least 2 labeled frames, found {}".format(len(timestamps)))
+    full = isc.multi_calibrate(session.calibration_results, timestamps, session.sonar,
+                               session.ext_rvec, session.ext_tvec)
+    _, full_rvec, full_tvec = full
+
+    initargs = (session.calibration_results, session.sonar, np.ravel(full_rvec), np.ravel(full_tvec))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        rows = np.array(list(executor.map(_leave_one_out, timestamps)), dtype=np.float64)
+
+    in_sample = []
+    for timestamp in timestamps:
+        _, sonar_points, camera_points = session.calibration_results[timestamp]
+        err = isc.calc_projection_error(camera_points, sonar_points, full_rvec, full_tvec, session.sonar)
+        in_sample.append(err / sonar_points.shape[1])
+
+    # How far each fold's extrinsic moved from the full solution
+    full_pose = pose_utils.as_poses(full_rvec, full_tvec)
+    change = pose_utils.relative(full_pose, pose_utils.as_poses(rows[:, 1:4], rows[:, 4:7]))
+    rotation_change = np.degrees(np.linalg.norm(change[:, :3], axis=1))
+    translation_change = 100 * np.linalg.norm(rows[:, 4:7] - np.ravel(full_tvec), axis=1)
+
+    table = np.column_stack([rows[:, 0], in_sample, rotation_change, translation_change, rows[:, 1:]])
+    return timestamps, table, full
+
+def jackknife_std(values):
+    """
+    Jackknife standard error of a parameter from its N leave-one-out estimates
+    (N,) or (N, K): sqrt((N - 1) / N * sum((x_i - mean)^2)).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    return np.sqrt((count - 1) / count * np.sum((values - values.mean(axis=0))**2, axis=0))
+
+def calibration_errors(table, ext_rvec, ext_tvec):
+    """
+    Per-row errors against the reference calibration.
+    Returns r_errs (N,3) in rad, t_errs (N,3) in cm, and their norms r_sum, t_sum.
+    """
+    r_errs = table[:, 2:5] - np.ravel(ext_rvec)
+    t_errs = 100 * (table[:, 5:8] - np.ravel(ext_tvec))
+    return r_errs, t_errs, np.linalg.norm(r_errs, axis=1), np.linalg.norm(t_errs, axis=1)
+
+def group_means(keys, values):
+    """
+    Mean of values (N,) or (N,K) for each distinct key, like MATLAB's
+    splitapply(@mean, values, keys). Returns (sorted keys, means).
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.bincount(inverse, minlength=len(unique_keys))
+    sums = np.zeros((len(unique_keys),) + values.shape[1:])
+    np.add.at(sums, inverse, values)
+    return unique_keys, sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+
+def pose_table(camera_poses):
+    """
+    (N,6) array of [rx, ry, rz, tx, ty, tz] board poses, in timestamp order.
+    """
+    if not camera_poses:
+        return np.zeros((0, 6))
+    rows = [np.concatenate([np.ravel(camera_poses[ts][0]), np.ravel(camera_poses[ts][1])])
+            for ts in sorted(camera_poses)]
+    return np.array(rows, dtype=np.float64)
+
+def pose_skew(rvecs, length=SKEW_LENGTH):
+    """
+    Board normal (its z axis, scaled to length) in the camera frame for each
+    pose, as an (N,3) array.
+    """
+    return pose_utils.exp_so3(rvecs)[:, :, 2] * length
+
+def new_figure(figsize=(8, 6)):
+    """
+    Figure drawn with the Agg backend, so plots can be made without a display.
+    """
+    fig = matplotlib.figure.Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+def plot_total_error(sizes, totals, title):
+    fig = new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+    keys, means = group_means(sizes, totals)
+    ax.plot(sizes, totals, "k.")
+    ax.plot(keys, means, "r.-", markersize=12)
+    ax.set_title(title)
+    ax.set_xlabel("Number of images used in calibration")
+    return fig
+
+def plot_axis_errors(sizes, errs, title, ylabel, axis_titles):
+    fig = new_figure(figsize=(8, 9))
+    axes = fig.subplots(3, 1, sharex=True)
+    keys, means = group_means(sizes, errs)
+    for ii, (ax, color) in enumerate(zip(axes, "rgb")):
+        ax.plot(sizes, errs[:, ii], color + ".", markersize=8)
+        ax.plot(keys, means[:, ii], "k.", markersize=12)
+        ax.grid(True)
+        ax.set_title(axis_titles[ii])
+    fig.suptitle(title)
+    fig.supxlabel("Number of images used in calibration")
+    fig.supylabel(ylabel)
+    return fig
+
+def plot_pose_coverage(pose_sets, colors=("blue", "green", "orange", "purple")):
+    """
+    Board positions in the camera's x/y plane, one color per session.
+    Bubbles are larger for closer boards, and the black lines show the
+    x/y part of each board's normal.
+    """
+    fig = new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+    for poses, color in zip(pose_sets, itertools.cycle(colors)):
+        if len(poses) == 0:
+            continue
+        tx, ty, tz = poses[:, 3], poses[:, 4], poses[:, 5]
+        depth = BUBBLE_DEPTH - tz
+        span = np.ptp(depth) if len(depth) > 1 and np.ptp(depth) > 0 else 1.0
+        sizes = 18**2 + (28**2 - 18**2) * (depth - depth.min()) / span
+        ax.scatter(tx, ty, s=sizes, color=color, alpha=0.4)
+        skew = pose_skew(poses[:, :3])
+        ax.plot(np.stack([tx, tx + skew[:, 0]]), np.stack([ty, ty + skew[:, 1]]), "k-", linewidth=2)
+        ax.plot(tx, ty, "k.", markersize=10)
+    # The camera's y axis points down
+    ax.invert_yaxis()
+    ax.set_xlabel("camera X (m)")
+    ax.set_ylabel("camera Y (m)")
+    return fig
+
+def plot_cross_validation(timestamps, table):
+    """
+    Held out vs. in-sample error, and how much the extrinsic moves without
+    each frame. Frames that are far worse held out, or that move the
+    solution a lot, are the ones distorting the calibration.
+    """
+    fig = new_figure(figsize=(10, 8))
+    axes = fig.subplots(2, 1, sharex=True)
+    xs = np.arange(len(timestamps))
+    axes[0].bar(xs - 0.2, table[:, 0], 0.4, color="r", label="held out")
+    axes[0].bar(xs + 0.2, table[:, 1], 0.4, color="k", label="in-sample")
+    axes[0].set_ylabel("Error per point")
+    axes[0].legend()
+    axes[1].bar(xs - 0.2, table[:, 2], 0.4, color="b", label="rotation (deg)")
+    axes[1].bar(xs + 0.2, table[:, 3], 0.4, color="g", label="translation (cm)")
+    axes[1].set_ylabel("Change without frame")
+    axes[1].legend()
+    axes[1].set_xticks(xs)
+    axes[1].set_xticklabels([str(ts)[11:] for ts in timestamps], rotation=90)
+    fig.suptitle("Leave-one-frame-out cross-validation")
+    fig.tight_layout()
+    return fig
+
+def run_cross_validation(rootdir, outdir, workers=None):
+    """
+    cross_validate the session in rootdir, print the frames ranked by
+    influence and save cross_validation.csv / .png to outdir.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    session = Session(rootdir)
+    timestamps, table, (full_err, full_rvec, full_tvec) = cross_validate(session, workers)
+    print("All {} frames: error {:.3f}, rvec {}, tvec {}".format(
+        len(timestamps), full_err, np.ravel(full_rvec), np.ravel(full_tvec)))
+    stability = jackknife_std(table[:, 4:])
+    print("Jackknife std: rvec {} (rad), tvec {} (cm)".format(stability[:3], 100 * stability[3:]))
+    print("Mean held out error {:.3f}, in-sample {:.3f}".format(table[:, 0].mean(), table[:, 1].mean()))
+    print("timestamp            held out  in-sample  rot (deg)  trans (cm)")
+    for ii in np.argsort(-table[:, 3], kind="stable"):
+        print("{}  {:8.3f}  {:9.3f}  {:9.3f}  {:10.3f}".format(timestamps[ii], *table[ii, :4]))
+
+    with open(f"{outdir}/cross_validation.csv", "w") as fp:
+        fp.write(",".join(["Timestamp"] + CV_COLUMNS) + "\n")
+        for timestamp, row in zip(timestamps, table):
+            fp.write(",".join([str(timestamp)] + ["{:.6g}".format(value) for value in row]) + "\n")
+    plot_cross_validation(timestamps, table).savefig(f"{outdir}/cross_validation.png")
+    print("Saved cross-validation to {}".format(outdir))
+    return timestamps, table
+
+def save_csv(table, filename):
+    """
+    Save a calibration table in the data5.csv layout.
+    """
+    np.savetxt(filename, table, delimiter=",")
+
+def run_analysis(rootdirs, outdir, max_per_size=MAX_GROUPS_PER_SIZE, workers=None):
+    """
+    Calibration error vs. number of pairs for the first session, and pose
+    coverage for all of them. Figures (and the calibration table, as
+    calibration_groups.csv) are saved in outdir. Returns the table.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    sessions = [Session(rootdir) for rootdir in rootdirs]
+    session = sessions[0]
+
+    groups = sample_calibration_groups(list(session.calibration_results.keys()), max_per_size)
+    print("Calibrating {} groups of pairs".format(len(groups)))
+    table = calibrate_groups(session, groups, workers)
+    save_csv(table, f"{outdir}/calibration_groups.csv")
+
+    sizes = table[:, 0]
+    r_errs, t_errs, r_sum, t_sum = calibration_errors(table, session.ext_rvec, session.ext_tvec)
+    figures = {
+        "tot_translation_error.png": plot_total_error(sizes, t_sum, "Total Translation Error (cm)"),
+        "tot_rotation_error.png": plot_total_error(sizes, r_sum, "Total Rotation Error (rad)"),
+        "translation_xyz.png": plot_axis_errors(sizes, t_errs, "Translation Errors", "Error (cm)",
+                                                ("x-axis", "y-axis", "z-axis")),
+        "rotation_xyz.png": plot_axis_errors(sizes, r_errs, "Rotation Errors", "Error (rad)",
+                                             ("about x-axis", "about y-axis", "about z-axis")),
+        "target_positions_all.png": plot_pose_coverage([pose_table(s.camera_poses) for s in sessions]),
+    }
+    for name, fig in figures.items():
+        fig.savefig(f"{outdir}/{name}")
+    print("Saved analysis to {}".format(outdir))
+    return table
+
+if __name__ == "__main__":
+    # usage: python data_analysis_tools.py [--cross-validate] [data folder ...]
+    # Error plots use the first folder; pose coverage includes all of them.
+    # With --cross-validate, only the leave-one-frame-out check of the first folder is run.
+    rootdirs = ["C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025",
+                "C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-21-2025"]
+    args = [arg for arg in sys.argv[1:] if arg != "--cross-validate"]
+    if args:
+        rootdirs = args
+    if "--cross-validate" in sys.argv:
+        run_cross_validation(rootdirs[0], f"{rootdirs[0]}/output/analysis")
+    else:
+        run_analysis(rootdirs, f"{rootdirs[0]}/output/analysis")
@@ -0,0 +1,179 @@
+import numpy as np
+from PyQt5 import QtGui, QtWidgets, QtCore
+
+# Number of thumbnails shown around the scrubber position
+VISIBLE_THUMBS = 9
+# Keyboard / page steps on the scrubber seek after this long without another step
+SEEK_DELAY_MS = 150
+CELL_SPACING = 4
+BORDER = 2
+
+class FilmstripView(QtWidgets.QWidget):
+    """
+    Row of thumbnails (camera above polar sonar) centered on one index.
+    Thumbnails that aren't generated yet are drawn as placeholders.
+    """
+    clicked = QtCore.pyqtSignal(int)
+
+    def __init__(self, thumbnails, status=None, parent=None):
+        super(FilmstripView, self).__init__(parent)
+        self.thumbnails = thumbnails
+        self.status = status
+        self.center = 0
+        self.current = None
+        cam_h, cam_w = thumbnails.camera.shape[1:3]
+        sonar_h, sonar_w = thumbnails.sonar.shape[1:3]
+        self.cell_size = (max(cam_w, sonar_w) + 2 * BORDER, cam_h + sonar_h + 2 * BORDER)
+        self.setMinimumHeight(self.cell_size[1] + 2 * CELL_SPACING)
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Fixed)
+
+    def sizeHint(self):
+        return QtCore.QSize(VISIBLE_THUMBS * (self.cell_size[0] + CELL_SPACING), self.minimumHeight())
+
+    def visible_indices(self):
+        """
+        (index, left x) of each cell that fits in the widget.
+        """
+        cell_w = self.cell_size[0] + CELL_SPACING
+        count = max(1, min(VISIBLE_THUMBS, self.width() // cell_w))
+        first = min(max(0, self.center - count // 2), max(0, self.thumbnails.length - count))
+        left = (self.width() - count * cell_w) // 2
+        return [(idx, left + ii * cell_w) for ii, idx in
+                enumerate(range(first, min(first + count, self.thumbnails.length)))]
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.black)
+        cell_w, cell_h = self.cell_size
+        top = CELL_SPACING
+        for idx, left in self.visible_indices():
+            color = self.status(idx) if self.status is not None else None
+            if idx == self.current:
+                color = "white"
+            if color is not None:
+                painter.fillRect(left, top, cell_w, cell_h, QtGui.QColor(color))
+            inner = QtCore.QRect(left + BORDER, top + BORDER, cell_w - 2 * BORDER, cell_h - 2 * BORDER)
+            if not self.thumbnails.is_ready(idx):
+                painter.fillRect(inner, QtGui.QColor(40, 40, 40))
+                painter.setPen(QtGui.QColor("lightgray"))
+                painter.drawText(inner, QtCore.Qt.AlignCenter, str(idx))
+                continue
+            camera = self.thumbnails.camera[idx]
+            sonar = self.thumbnails.sonar[idx]
+            # QImages wrap the memory-mapped rows; they only live until drawn
+            camera_image = QtGui.QImage(camera.data, camera.shape[1], camera.shape[0],
+                                        camera.strides[0], QtGui.QImage.Format_BGR888)
+            sonar_image = QtGui.QImage(sonar.data, sonar.shape[1], sonar.shape[0],
+                                       sonar.strides[0], QtGui.QImage.Format_Grayscale8)
+            painter.drawImage(inner.left(), inner.top(), camera_image)
+            painter.drawImage(inner.left(), inner.top() + camera.shape[0], sonar_image)
+            painter.setPen(QtGui.QColor("yellow"))
+            painter.drawText(inner.left() + 3, inner.top() + 12, str(idx))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        cell_w = self.cell_size[0]
+        for idx, left in self.visible_indices():
+            if left <= event.pos().x() < left + cell_w:
+                self.clicked.emit(idx)
+                return
+
+class Filmstrip(QtWidgets.QWidget):
+    """
+    Scrubber for moving through a dataset by its thumbnails.
+
+    Dragging the slider only moves the thumbnails; the frame is loaded
+    (seek_requested emitted) when the slider is released, a thumbnail is
+    clicked, or an index / timestamp is entered in the Go box.
+    status(idx), if given, returns a border color for a pair (or None).
+    """
+    seek_requested = QtCore.pyqtSignal(int)
+
+    def __init__(self, thumbnails, timestamps, status=None, parent=None):
+        super(Filmstrip, self).__init__(parent)
+        self.timestamps = timestamps
+        self.view = FilmstripView(thumbnails, status)
+        self.view.clicked.connect(self.seek_requested.emit)
+
+        self.slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.slider.setRange(0, max(0, thumbnails.length - 1))
+        self.slider.setPageStep(10)
+        self.slider.valueChanged.connect(self.handle_slider_moved)
+        self.slider.sliderReleased.connect(lambda: self.seek_requested.emit(self.slider.value()))
+        self.seek_timer = QtCore.QTimer(self)
+        self.seek_timer.setSingleShot(True)
+        self.seek_timer.setInterval(SEEK_DELAY_MS)
+        self.seek_timer.timeout.connect(lambda: self.seek_requested.emit(self.slider.value()))
+
+        self.position_label = QtWidgets.QLabel()
+        self.goto_edit = QtWidgets.QLineEdit()
+        self.goto_edit.setPlaceholderText("index or YYYY-MM-DDTHH:MM:SS")
+        self.goto_edit.returnPressed.connect(self.handle_goto)
+        goto_button = QtWidgets.QPushButton("Go")
+        goto_button.clicked.connect(self.handle_goto)
+
+        control_row = QtWidgets.QHBoxLayout()
+        control_row.addWidget(self.slider, stretch=1)
+        control_row.addWidget(self.position_label)
+        control_row.addWidget(self.goto_edit)
+        control_row.addWidget(goto_button)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.view)
+        layout.addLayout(control_row)
+        self.update_position_label()
+
+    def set_current(self, idx):
+        """
+        Show idx as the current pair without requesting a seek.
+        """
+        self.view.current = idx
+        if idx is not None:
+            self.slider.blockSignals(True)
+            self.slider.setValue(idx)
+            self.slider.blockSignals(False)
+            self.view.center = idx
+        self.update_position_label()
+        self.view.update()
+
+    def handle_slider_moved(self, value):
+        self.view.center = value
+        self.update_position_label()
+        self.view.update()
+        if not self.slider.isSliderDown():
+            self.seek_timer.start()
+
+    def update_position_label(self):
+        value = self.slider.value()
+        if len(self.timestamps) == 0:
+            self.position_label.setText("No data")
+            return
+        self.position_label.setText("{} / {}  {}".format(value, len(self.timestamps) - 1, self.timestamps[value]))
+
+    def lookup(self, text):
+        """
+        Index for text: either an index, or a timestamp (the nearest pair is used).
+        Returns None if text is neither.
+        """
+        text = text.strip()
+        if len(self.timestamps) == 0 or not text:
+            return None
+        if text.isdigit():
+            return min(int(text), len(self.timestamps) - 1)
+        try:
+            timestamp = np.datetime64(text).astype(self.timestamps.dtype)
+        except ValueError:
+            return None
+        idx = int(np.searchsorted(self.timestamps, timestamp))
+        if idx == len(self.timestamps):
+            return idx - 1
+        if idx > 0 and timestamp - self.timestamps[idx - 1] < self.timestamps[idx] - timestamp:
+            return idx - 1
+        return idx
+
+    def handle_goto(self):
+        idx = self.lookup(self.goto_edit.text())
+        if idx is None:
+            print("Could not find a pair for: {}".format(self.goto_edit.text()))
+            return
+        self.seek_requested.emit(idx)
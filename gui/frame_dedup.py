@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# dHash grid: HASH_SIZE x HASH_SIZE horizontal gradient signs = 64 bits
+HASH_SIZE = 8
+# Pairs are near-duplicates if both hashes are within these Hamming distances
+CAMERA_MAX_DISTANCE = 4
+SONAR_MAX_DISTANCE = 8
+# Thumbnails hashed per task
+CHUNK = 256
+
+# Set bits in each byte value, for counting bits in the hashes
+_POPCOUNT = np.array([bin(ii).count("1") for ii in range(256)], dtype=np.uint8)
+
+def dhash(image):
+    """
+    64-bit difference hash: whether each pixel of a 9x8 downscaled gray
+    image is brighter than its right-hand neighbour.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return np.packbits(bits).view(">u8")[0]
+
+def hamming(a, b):
+    """
+    Bitwise distance between uint64 hashes (arrays broadcast).
+    """
+    diff = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return _POPCOUNT[diff[..., None].view(np.uint8)].sum(axis=-1)
+
+def hash_thumbnails(thumbnails, workers=None):
+    """
+    (camera hashes, sonar hashes) for every pair of a ThumbnailIndex, computed
+    in a thread pool. Pairs whose thumbnails aren't ready hash to 0 and are
+    never grouped (see find_clusters).
+    """
+    camera_hashes = np.zeros(thumbnails.length, dtype=np.uint64)
+    sonar_hashes = np.zeros(thumbnails.length, dtype=np.uint64)
+
+    def hash_chunk(start):
+        for idx in range(start, min(start + CHUNK, thumbnails.length)):
+            if thumbnails.is_ready(idx):
+                camera_hashes[idx] = dhash(thumbnails.camera[idx])
+                sonar_hashes[idx] = dhash(thumbnails.sonar[idx])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(hash_chunk, range(0, thumbnails.length, CHUNK)))
+    return camera_hashes, sonar_hashes
+
+def candidate_groups(hashes, max_distance):
+    """
+    Groups of indices that might be within max_distance of each other.
+
+    The 64 bits are split into max_distance + 1 bands; two hashes that differ in
+    at most max_distance bits must match exactly on at least one band, so only
+    hashes sharing a band value need to be compared.
+    """
+    bands = max_distance + 1
+    edges = np.linspace(0, 64, bands + 1).astype(int)
+    for low, high in zip(edges[:-1], edges[1:]):
+        mask = np.uint64((1 << int(high - low)) - 1)
+        keys = (hashes >> np.uint64(low)) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # Runs of equal band values
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            if end - start > 1:
+                yield np.sort(order[start:end])
+
+def find_clusters(camera_hashes, sonar_hashes, ready=None):
+    """
+    Cluster id (the smallest member index) for every pair. Pairs are taken in
+    order, and each one that isn't in a cluster yet starts a new one that takes
+    in every unclustered pair whose camera and sonar hashes are both
+    near-duplicates of its own. Every member is then close to the cluster's
+    first pair, so a slow sweep is split into several clusters rather than
+    chained into one.
+    """
+    length = len(camera_hashes)
+    if ready is None:
+        ready = np.ones(length, dtype=bool)
+    neighbours = [set() for _ in range(length)]
+    for members in candidate_groups(camera_hashes, CAMERA_MAX_DISTANCE):
+        members = members[ready[members]]
+        for pos in range(len(members) - 1):
+            ii = members[pos]
+            others = members[pos + 1:]
+            close = others[(hamming(camera_hashes[ii], camera_hashes[others]) <= CAMERA_MAX_DISTANCE)
+                           & (hamming(sonar_hashes[ii], sonar_hashes[others]) <= SONAR_MAX_DISTANCE)]
+            for jj in close.tolist():
+                neighbours[ii].add(jj)
+                neighbours[jj].add(ii)
+
+    cluster_ids = np.full(length, -1)
+    for ii in range(length):
+        if cluster_ids[ii] >= 0:
+            continue
+        cluster_ids[ii] = ii
+        # Only pairs after ii can still be unclustered
+        free = [jj for jj in neighbours[ii] if cluster_ids[jj] < 0]
+        cluster_ids[free] = ii
+    return cluster_ids
+
+def choose_representatives(cluster_ids, priority=None):
+    """
+    Boolean mask with one pair per cluster: the one with the highest priority,
+    or the middle of the cluster when priorities tie (or none are given).
+    """
+    length = len(cluster_ids)
+    if priority is None:
+        priority = np.zeros(length)
+    representative = np.zeros(length, dtype=bool)
+    order = np.argsort(cluster_ids, kind="stable")
+    starts = np.flatnonzero(np.r_[True, cluster_ids[order][1:] != cluster_ids[order][:-1]])
+    for start, end in zip(starts, np.r_[starts[1:], length]):
+        members = order[start:end]
+        middle = members[len(members) // 2]
+        best = members[np.argmax(priority[members])]
+        representative[best if priority[best] > priority[middle] else middle] = True
+    return representative
+
+def one_per_cluster(timestamps, clusters, weights):
+    """
+    Keep the timestamp with the highest weight from each cluster.
+    clusters maps timestamp to cluster id (timestamps without one are their own cluster).
+    """
+    best = {}
+    for timestamp in timestamps:
+        key = clusters.get(timestamp, timestamp)
+        if key not in best or weights[timestamp] > weights[best[key]]:
+            best[key] = timestamp
+    return sorted(best.values())
+
+def deduplicate(thumbnails, priority=None, workers=None):
+    """
+    (cluster_ids, representative) for every pair of a ThumbnailIndex.
+    """
+    camera_hashes, sonar_hashes = hash_thumbnails(thumbnails, workers)
+    ready = np.asarray(thumbnails.ready, dtype=bool)
+    cluster_ids = find_clusters(camera_hashes, sonar_hashes, ready)
+    return cluster_ids, choose_representatives(cluster_ids, priority)
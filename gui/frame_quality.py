@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import charuco_utils
+import image_sonar_utils as isc
+import pose_utils
+
+# Bump this when a metric changes, so old scores are recomputed
+QUALITY_VERSION = 1
+CHUNKSIZE = 4
+
+# Per-pair metrics; NaN where a metric couldn't be computed (e.g. no board)
+QUALITY_DTYPE = np.dtype([
+    ("scored", np.uint8),
+    ("corners", np.int32),         # charuco corners detected
+    ("reproj_err", np.float32),    # RMS reprojection error of the board pose (pixels)
+    ("sharpness", np.float32),     # variance of the Laplacian over the board (or whole image)
+    ("distance", np.float32),      # camera to board (meters)
+    ("tilt", np.float32),          # angle between the board normal and the optical axis (degrees)
+    ("sonar_snr", np.float32),     # bright returns vs. background in the polar image (dB)
+])
+
+# Pairs failing any of these are flagged low quality
+MIN_CORNERS = 6
+MAX_REPROJ_ERR = 2.0
+MIN_SHARPNESS = 30.0
+MIN_SONAR_SNR = 10.0
+# Percentile of the polar sonar image used as the signal level for sonar_snr
+SIGNAL_PERCENTILE = 99.9
+
+def camera_metrics(image, board, mtx, dst):
+    """
+    (corners, reproj_err, sharpness, distance, tilt) for one camera image.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    corners, ids, tvec, rvec = charuco_utils.detect_charuco_board(board, gray, mtx, dst)
+    count = 0 if ids is None else len(ids)
+
+    region = gray
+    if count > 0:
+        # Sharpness where it matters: the board, not the background
+        x, y, w, h = cv2.boundingRect(corners.reshape(-1, 2).astype(np.float32))
+        if w > 2 and h > 2:
+            region = gray[y:y + h, x:x + w]
+    sharpness = cv2.Laplacian(region, cv2.CV_64F).var()
+
+    reproj_err = distance = tilt = np.nan
+    if rvec is not None:
+        object_points = board.getChessboardCorners()[ids.ravel()]
+        projected, _ = cv2.projectPoints(object_points, rvec, tvec, np.asarray(mtx), np.asarray(dst))
+        residuals = projected.reshape(-1, 2) - corners.reshape(-1, 2)
+        reproj_err = np.sqrt(np.mean(np.sum(residuals**2, axis=1)))
+        distance = np.linalg.norm(tvec)
+        rot = pose_utils.exp_so3(rvec)[0]
+        tilt = np.degrees(np.arccos(min(1.0, abs(rot[2, 2]))))
+    return count, reproj_err, sharpness, distance, tilt
+
+def sonar_snr(polar_image):
+    """
+    Ratio (dB) of the brightest returns to the median background of the polar
+    sonar image. Frames without any strong return score close to 0.
+    """
+    signal = np.percentile(polar_image, SIGNAL_PERCENTILE)
+    background = np.median(polar_image)
+    return 20 * np.log10((signal + 1.0) / (background + 1.0))
+
+# Set once in each worker process by _init_worker
+_worker_data = None
+
+def _init_worker(sonar_folder, camera_folder, sonar_params, polar_transform, mtx, dst):
+    global _worker_data
+    _worker_data = (sonar_folder, camera_folder, sonar_params, polar_transform, mtx, dst)
+
+def score_pair(job):
+    """
+    Metrics for one pair, as a tuple in QUALITY_DTYPE order. Runs in a worker process.
+    """
+    idx, sonarfile, camerafile = job
+    sonar_folder, camera_folder, sonar_params, polar_transform, mtx, dst = _worker_data
+    _, board = charuco_utils.make_charuco_board()
+
+    camera = (0, np.nan, np.nan, np.nan, np.nan)
+    image = cv2.imread(f"{camera_folder}/{camerafile}", cv2.IMREAD_GRAYSCALE)
+    if image is not None:
+        camera = camera_metrics(image, board, mtx, dst)
+
+    snr = np.nan
+    sonar = cv2.imread(f"{sonar_folder}/{sonarfile}", cv2.IMREAD_GRAYSCALE)
+    if sonar is not None:
+        snr = sonar_snr(isc.polar_sonar_image(isc.crop_sonar_arc(sonar, sonar_params), polar_transform))
+    return idx, (1,) + tuple(camera) + (snr,)
+
+def low_quality(records):
+    """
+    Boolean mask of scored pairs failing the MIN_* / MAX_* thresholds.
+    """
+    with np.errstate(invalid="ignore"):
+        bad = ((records["corners"] < MIN_CORNERS)
+               | ~(records["reproj_err"] <= MAX_REPROJ_ERR)
+               | (records["sharpness"] < MIN_SHARPNESS)
+               | ~(records["sonar_snr"] >= MIN_SONAR_SNR))
+    return bad & (records["scored"] == 1)
+
+def combined_score(records):
+    """
+    Heuristic 0-1 score for ranking pairs: more corners, sharper images,
+    stronger sonar returns and lower reprojection error rank higher.
+    Unscored pairs and pairs without a board pose score 0.
+    """
+    total_corners = (charuco_utils.BOARD_COLS - 1) * (charuco_utils.BOARD_ROWS - 1)
+    with np.errstate(invalid="ignore"):
+        score = (np.clip(records["corners"] / total_corners, 0, 1)
+                 * np.clip(records["sharpness"] / (2 * MIN_SHARPNESS), 0, 1)
+                 * np.clip(records["sonar_snr"] / (2 * MIN_SONAR_SNR), 0, 1)
+                 / (1 + records["reproj_err"]))
+    return np.where((records["scored"] == 1) & np.isfinite(score), score, 0.0)
+
+class FrameQuality():
+    """
+    Quality metrics for every pair in a SensorData, cached next to the other
+    per-pair data in <outdir>/thumbnails as a memory-mapped structured array
+    (quality.npy) and a description of what it was computed from (quality.json).
+    As with the thumbnails, an interrupted scoring pass resumes where it stopped.
+    """
+    def __init__(self, paired_data, polar_transform, mtx, dst, outdir):
+        self.paired_data = paired_data
+        self.polar_transform = polar_transform
+        self.mtx = np.asarray(mtx)
+        self.dst = np.asarray(dst)
+        self.folder = f"{outdir}/thumbnails"
+        self.data_file = f"{self.folder}/quality.npy"
+        self.index_file = f"{self.folder}/quality.json"
+        self.length = paired_data.length
+        self.open()
+
+    def describe(self):
+        return {
+            "version": QUALITY_VERSION,
+            "board": charuco_utils.board_config(),
+            "mtx": self.mtx.tolist(),
+            "dist": self.dst.tolist(),
+            "crop_params": self.paired_data.sonar_params.crop_params,
+            "pairs": self.paired_data.file_list(),
+        }
+
+    def open(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        description = json.loads(json.dumps(self.describe()))
+        cached = None
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, "r") as fp:
+                    cached = json.load(fp)
+            except Exception as ex:
+                print("Could not read quality index {}: {}".format(self.index_file, ex))
+
+        if cached == description and os.path.exists(self.data_file):
+            try:
+                self.records = np.load(self.data_file, mmap_mode="r+")
+                if self.records.dtype == QUALITY_DTYPE and self.records.shape == (self.length,):
+                    return
+            except Exception as ex:
+                print("Could not open quality cache: {}".format(ex))
+
+        self.records = np.lib.format.open_memmap(
+            self.data_file, mode="w+", dtype=QUALITY_DTYPE, shape=(self.length,))
+        with open(self.index_file, "w") as fp:
+            json.dump(description, fp)
+
+    def missing(self):
+        return np.flatnonzero(self.records["scored"] == 0)
+
+    def build(self, workers=None, progress=None, stop=None):
+        """
+        Score the pairs that aren't cached yet in a pool of worker processes.
+        progress(done, total) is called as results come in; if stop (a threading.Event)
+        is set, the remaining work is abandoned. Returns the number of pairs scored.
+        """
+        missing = self.missing()
+        total = len(missing)
+        if total == 0:
+            return 0
+        jobs = [(int(idx),) + self.paired_data.get_filenames(idx) for idx in missing]
+        initargs = (self.paired_data.sonar_folder, self.paired_data.camera_folder,
+                    self.paired_data.sonar_params, self.polar_transform, self.mtx, self.dst)
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            for idx, record in executor.map(score_pair, jobs, chunksize=CHUNKSIZE):
+                if stop is not None and stop.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                self.records[idx] = record
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+        self.records.flush()
+        return done
+
+    def low_quality(self):
+        return low_quality(self.records)
+
+    def ranked(self, exclude=None):
+        """
+        Scored pair indices from best to worst combined_score, leaving out
+        low quality pairs and any index in exclude.
+        """
+        score = combined_score(self.records)
+        keep = (self.records["scored"] == 1) & ~self.low_quality()
+        if exclude is not None:
+            keep[list(exclude)] = False
+        idxs = np.flatnonzero(keep)
+        return idxs[np.argsort(-score[idxs], kind="stable")]
+
+    def describe_pair(self, idx):
+        record = self.records[idx]
+        if not record["scored"]:
+            return "Quality: not scored yet"
+        return ("Quality: {} corners, reproj {:.2f} px, sharpness {:.0f}, "
+                "distance {:.2f} m, tilt {:.0f} deg, sonar SNR {:.1f} dB").format(
+                    record["corners"], record["reproj_err"], record["sharpness"],
+                    record["distance"], record["tilt"], record["sonar_snr"])
+
+if __name__ == "__main__":
+    # Score a dataset folder and print the pairs from best to worst.
+    # usage: python frame_quality.py [rootdir] [camera json with mtx and dist]
+    rootdir = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025"
+    camera_json = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/camera_calibration.json"
+    if len(sys.argv) > 1:
+        rootdir = sys.argv[1]
+    if len(sys.argv) > 2:
+        camera_json = sys.argv[2]
+
+    with open(f"{rootdir}/inputparams.json", "r") as fp:
+        params = json.load(fp)
+    with open(camera_json, "r") as fp:
+        camera = json.load(fp)
+    sonar = isc.SonarInfo(params["sonar_range"], params["sonar_wide"], f"{rootdir}/sonar_cropping_params.json")
+    paired_data = isc.SensorData(rootdir, sonar)
+    quality = FrameQuality(paired_data, isc.create_transform_map(sonar),
+                           camera["mtx"], camera["dist"], f"{rootdir}/output")
+    quality.build(progress=lambda done, total: print("\rScored {} / {}".format(done, total), end=""))
+    print()
+
+    records = quality.records
+    bad = quality.low_quality()
+    print("{} of {} pairs are low quality".format(int(np.count_nonzero(bad)), len(records)))
+    print("index  timestamp            corners  reproj  sharpness  dist   tilt  snr")
+    for idx in quality.ranked():
+        record = records[idx]
+        print("{:5d}  {}  {:7d}  {:6.2f}  {:9.0f}  {:4.2f}  {:5.0f}  {:4.1f}".format(
+            idx, paired_data.timestamps[idx], record["corners"], record["reproj_err"],
+            record["sharpness"], record["distance"], record["tilt"], record["sonar_snr"]))
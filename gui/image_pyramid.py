@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+
+# Levels are halved until the longer side is at most this many pixels
+MIN_LEVEL_SIZE = 256
+
+class ImagePyramid():
+    """
+    Camera frame at successively halved resolutions, built once per frame.
+
+    Level 0 is the input image itself (not copied). Every level is meant to be
+    displayed with the same extent, so plots keep using full-resolution pixel
+    coordinates whichever level is on screen.
+    """
+    def __init__(self, image, min_size=MIN_LEVEL_SIZE):
+        self.height, self.width = image.shape[:2]
+        self.levels = [image]
+        while max(self.levels[-1].shape[:2]) > 2 * min_size:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        # (left, right, bottom, top), as imshow uses for a full-resolution image
+        self.extent = (-0.5, self.width - 0.5, self.height - 0.5, -0.5)
+
+    def level_for(self, screen_width, screen_height, xlim=None, ylim=None):
+        """
+        Index of the coarsest level that still has at least one image pixel per
+        screen pixel over the visible region (given in full-resolution pixels).
+        """
+        visible_width = abs(xlim[1] - xlim[0]) if xlim is not None else self.width
+        visible_height = abs(ylim[1] - ylim[0]) if ylim is not None else self.height
+        ratio = min(visible_width / max(screen_width, 1), visible_height / max(screen_height, 1))
+        if ratio <= 1:
+            return 0
+        return min(int(np.log2(ratio)), len(self.levels) - 1)
+
+    def image_for_axes(self, ax, use_limits=True):
+        """
+        The level to show on a matplotlib axes, based on its size on screen and,
+        if use_limits, how far it is zoomed in.
+        """
+        bbox = ax.get_window_extent()
+        if use_limits:
+            level = self.level_for(bbox.width, bbox.height, ax.get_xlim(), ax.get_ylim())
+        else:
+            level = self.level_for(bbox.width, bbox.height)
+        return self.levels[level]
@@ -4,7 +4,12 @@ import scipy
 import scipy.optimize
 import os
 import json
+import pickle
+import functools
+import types
 import charuco_utils
+import pose_utils
+import timing_utils
 
 class SensorData():
     def __init__(self, main_folder, sonar):
@@ -28,15 +33,95 @@ class SensorData():
             self.sorted_pairs.append((timestamp, sname, cname))
         
         self.length = len(self.sorted_pairs)
+        self.timestamps = np.array([pair[0] for pair in self.sorted_pairs], dtype="datetime64[s]")
+        # Near-duplicate clusters from frame_dedup; until set_clusters is
+        # called every pair is its own cluster
+        self.cluster_ids = np.arange(self.length)
+        self.representative = np.ones(self.length, dtype=bool)
         print("Image pairs created successfully")
+
+    def index_of(self, timestamp):
+        """
+        Index of the pair with this timestamp, or None if there isn't one.
+        """
+        idx = int(np.searchsorted(self.timestamps, timestamp))
+        if idx < self.length and self.timestamps[idx] == timestamp:
+            return idx
+        return None
+
+    def set_clusters(self, cluster_ids, representative):
+        """
+        cluster_ids gives each pair's cluster, and representative marks the one
+        pair kept from each cluster.
+        """
+        self.cluster_ids = np.asarray(cluster_ids)
+        self.representative = np.asarray(representative, dtype=bool)
+
+    def duplicate_timestamps(self):
+        """
+        Timestamps of the pairs that aren't their cluster's representative.
+        """
+        return self.timestamps[~self.representative]
+
+    def cluster_map(self, timestamps):
+        """
+        Dict mapping each timestamp that has a pair to its cluster id.
+        """
+        clusters = {}
+        for timestamp in timestamps:
+            idx = self.index_of(timestamp)
+            if idx is not None:
+                clusters[timestamp] = int(self.cluster_ids[idx])
+        return clusters
+
+    def get_filenames(self, idx):
+        """
+        Sonar and camera file names (relative to their folders) for a pair.
+        """
+        _, sonarfile, camerafile = self.sorted_pairs[idx]
+        return sonarfile, camerafile
  
+    def file_list(self):
+        """
+        [timestamp, sonarfile, camerafile, sonar mtime, camera mtime] for every
+        pair, as plain values so caches of per-pair data can store it and tell
+        whether the data folders have changed.
+        """
+        pairs = []
+        for timestamp, sonarfile, camerafile in self.sorted_pairs:
+            pairs.append([str(timestamp), sonarfile, camerafile,
+                          os.path.getmtime(f"{self.sonar_folder}/{sonarfile}"),
+                          os.path.getmtime(f"{self.camera_folder}/{camerafile}")])
+        return pairs
+
     def get_pair(self, idx):
         timestamp, sonarfile, camerafile = self.sorted_pairs[idx]
-        sonar = cv2.imread(f"{self.sonar_folder}/{sonarfile}", cv2.IMREAD_GRAYSCALE)
-        sonar = crop_sonar_arc(sonar, self.sonar_params)
-        image = cv2.imread(f"{self.camera_folder}/{camerafile}")
+        sonar, image = self.load_files(sonarfile, camerafile)
         return timestamp, sonar, image
 
+    def load_files(self, sonarfile, camerafile):
+        """
+        Read and crop a sonar image and read a camera image from the data folders.
+        """
+        with timing_utils.span("get_pair.decode_sonar"):
+            sonar = cv2.imread(f"{self.sonar_folder}/{sonarfile}", cv2.IMREAD_GRAYSCALE)
+        if sonar is None:
+            raise Exception("Could not read sonar image {}".format(sonarfile))
+        with timing_utils.span("get_pair.crop_sonar"):
+            sonar = crop_sonar_arc(sonar, self.sonar_params)
+        with timing_utils.span("get_pair.decode_camera"):
+            image = cv2.imread(f"{self.camera_folder}/{camerafile}")
+        return sonar, image
+
+    def seek(self, idx):
+        """
+        Jump to pair idx; later calls to next continue from there.
+        """
+        if not 0 <= idx < self.length:
+            raise Exception("No image pair at index {}".format(idx))
+        self.current_index = idx
+        return self.get_pair(idx)
+
     def next(self, reverse=False):
         if self.length > 0:
             if self.current_index is None:
@@ -122,25 +207,32 @@ def create_transform_map(sonar):
 
     return x_map, y_map
 
+def polar_sonar_image(sonar_im, polar_transform):
+    """
+    Map a cropped cartesian sonar image into the polar matrix used for labeling.
+    Rows are range bins (row 0 at the sonar) and columns are 0.1 degree theta bins.
+    """
+    sonar_matrix = cv2.remap(sonar_im, *polar_transform, cv2.INTER_LINEAR)
+    return cv2.flip(sonar_matrix, 0)
+
 
 def pixel_to_polar(coord, sonar):
     """
     Given pixel coordinates, find the polar theta (deg) and r (m)
+    coord is an (x, y) pair or a 2xN array; the input is not modified.
     """
-    xpix, ypix = coord
-    theta_deg = (xpix*0.1 - sonar.aper/2)
+    xpix, ypix = np.asarray(coord, dtype=np.float64)
+    theta_deg = xpix*0.1 - sonar.aper/2
     r_meters = ypix * sonar.range / sonar.range_bins
     return theta_deg, r_meters
 
 def polar_to_pixel(coords, sonar):
     """
-    theta is in degrees, coords is a 2xN array
+    theta is in degrees, coords is a 2xN array; the input is not modified.
     """
-    r = coords[1,:]
-    th = coords[0,:]
+    th, r = np.asarray(coords, dtype=np.float64)
     ypix = r * sonar.range_bins/sonar.range
-    th += .5*sonar.aper
-    xpix = th/0.1
+    xpix = (th + .5*sonar.aper)/0.1
     return np.array([xpix, ypix])
 
 def polar_from_3d(points):
@@ -188,25 +280,102 @@ def get_black_squares(board):
 
     return centers
 
+@functools.lru_cache(maxsize=None)
 def init_charuco_sonar():
+    """
+    Return the aruco dictionary, the charuco board and a read-only mapping
+    from sonar target label to (x, y) board coordinates, as given by the
+    target spec file. Built once per process.
+    """
     aruco_dict, charuco_board = charuco_utils.make_charuco_board()
-    # If the charuco board is of a different shape, then our assumptions about
-    # where the targets are will be wrong.
-    ncols, nrows = charuco_board.getChessboardSize()
-    assert 11 == ncols
-    assert 8 == nrows
 
     # The black squares are numbered 0-N, in row-major order starting from
     # the top left corner of the charuco board. Each sonar target is a bolt
     # in the center of a square.
     black_squares = get_black_squares(charuco_board)
-    sonar_targets = {'A1': 0, 'A2': 1, 'A3': 6, 'A4': 11, 'A5': 12,
-                     'B1': 4, 'B2': 5, 'B3': 10, 'B4': 15, 'B5': 16, 
-                     'C1': 28, 'C2': 33, 'C3': 34, 'C4': 39, 'C5': 40,
-                     'D1': 32, 'D2': 37, 'D3': 38, 'D4': 42, 'D5': 43}
+    sonar_targets = charuco_utils.TARGET_SPEC["targets"]
+    for label, ss in sonar_targets.items():
+        if ss not in black_squares:
+            raise Exception("Target {} is on black square {}, but the board only has {} black squares".format(
+                label, ss, len(black_squares)))
     sonar_coords = {label: black_squares[ss] for label, ss in sonar_targets.items()}
     
-    return aruco_dict, charuco_board, sonar_coords
+    return aruco_dict, charuco_board, types.MappingProxyType(sonar_coords)
+
+class TargetTable():
+    """
+    Read-only lookup of the sonar targets on the board.
+
+    labels -- tuple of target labels, in a fixed order
+    index -- dict mapping label to its row in points
+    points -- (T, 3) read-only array of target coordinates in the board frame (meters)
+    """
+    def __init__(self, sonar_coords):
+        self.labels = tuple(sonar_coords.keys())
+        self.index = {label: ii for ii, label in enumerate(self.labels)}
+        points = np.array([[xx, yy, 0.0] for xx, yy in sonar_coords.values()], dtype=np.float64)
+        points.flags.writeable = False
+        self.points = points
+
+    def __len__(self):
+        return len(self.labels)
+
+    def indices(self, labels):
+        return np.fromiter((self.index[label] for label in labels), dtype=np.intp, count=len(labels))
+
+    def gather(self, labels):
+        """
+        3xN board-frame coordinates of the given labels.
+        """
+        return self.points[self.indices(labels)].T
+
+@functools.lru_cache(maxsize=None)
+def get_target_table():
+    """
+    The target table for the board, built once per process.
+    """
+    _, _, sonar_coords = init_charuco_sonar()
+    return TargetTable(sonar_coords)
+
+def load_session_state(outdir):
+    """
+    Load the pickled labeling session saved by the calibration gui.
+
+    Returns good_timestamps, skip_timestamps, sonar_labels, calibration_results
+    and camera_poses. Empty containers are returned if no session exists yet.
+    """
+    labels_filename = "{}/calibration_labels.pkl".format(outdir)
+    calibration_filename = "{}/calibration_data.pkl".format(outdir)
+    poses_filename = "{}/camera_poses.pkl".format(outdir)
+    if not os.path.exists(labels_filename):
+        return set(), set(), {}, {}, {}
+
+    with open(labels_filename, "rb") as fp:
+        labels = pickle.load(fp)
+    with open(calibration_filename, "rb") as fp:
+        points = pickle.load(fp)
+    with open(poses_filename, "rb") as fp:
+        poses = pickle.load(fp)
+    return labels["good_timestamps"], labels["skip_timestamps"], labels["sonar_labels"], points, poses
+
+def load_good_sources(outdir):
+    """
+    Load the mapping from "good" timestamps to the (sonar, camera) file names
+    they were marked from. Returns an empty dict if there is none.
+    """
+    filename = "{}/good_sources.json".format(outdir)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as fp:
+        sources = json.load(fp)
+    return {np.datetime64(ts): (files["sonar"], files["camera"]) for ts, files in sources.items()}
+
+def save_good_sources(outdir, good_sources):
+    filename = "{}/good_sources.json".format(outdir)
+    sources = {str(ts): {"sonar": sonarfile, "camera": camerafile}
+               for ts, (sonarfile, camerafile) in good_sources.items()}
+    with open(filename, "w") as fp:
+        json.dump(sources, fp, indent=4)
 
 def get_sonar_target_correspondences(labeled_points, sonar):
     """
@@ -220,28 +389,30 @@ def get_sonar_target_correspondences(labeled_points, sonar):
     * sonar_points: locations of labeled points in the sonar frame
     * target_points: locations of labeled points in the target's frame.
     """
-    _, _, sonar_coords = init_charuco_sonar()
-
-    angles = []
-    ranges = []
-    target_points = []
-    for label, (x_pixel, y_pixel) in labeled_points.items():
-        angle_deg, pt_range = pixel_to_polar((x_pixel, y_pixel), sonar)
-        angles.append(angle_deg)
-        ranges.append(pt_range)
-        coord = sonar_coords[label]
-        target_points.append([coord[0], coord[1], 0])
-
-    sonar_points = np.array([angles, ranges])
-    target_points = np.transpose(np.array(target_points))
+    table = get_target_table()
+    labels = list(labeled_points.keys())
+    pixels = np.array(list(labeled_points.values()), dtype=np.float64).reshape(-1, 2).T
+    sonar_points = np.array(pixel_to_polar(pixels, sonar))
+    target_points = table.gather(labels)
     return sonar_points, target_points
 
-def estimate_target_translation(camera_points, sonar_points, sonar, rvec, initial_tvec, verbose=False):
+class CalibrationCancelled(Exception):
+    """
+    Raised from inside a solve when its cancel event has been set.
+    """
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise CalibrationCancelled()
+
+def estimate_target_translation(camera_points, sonar_points, sonar, rvec, initial_tvec, verbose=False, cancel=None):
     err0 = calc_projection_error(camera_points, sonar_points, rvec, initial_tvec, sonar)
     if verbose:
         print("Initial error: {}".format(err0))
 
-    fn = lambda x: calc_projection_error(camera_points, sonar_points, rvec, x, sonar)
+    def fn(x):
+        check_cancelled(cancel)
+        return calc_projection_error(camera_points, sonar_points, rvec, x, sonar)
     opt = {"maxiter": 3000}
     res = scipy.optimize.minimize(fn, initial_tvec, method="Nelder-Mead", options=opt)
     if res.status != 0 or res.fun > 100:
@@ -265,6 +436,7 @@ def estimate_target_pose(
     sonar,
     initial,
     verbose=False,
+    cancel=None,
 ):
     # Initialize the rotation s.t. the target's frame is aligned
     # with the sonar's frame; this helps avoid falling into a local
@@ -283,9 +455,9 @@ def estimate_target_pose(
         print("Initial error: {}".format(err0))
         print("(Using rvec = {}, tvec = {}".format(rvec, tvec))
 
-    fn = lambda x: calc_projection_error(  # noqa: E731
-        camera_points, sonar_points, x[0:3], x[3:6], sonar
-    )
+    def fn(x):
+        check_cancelled(cancel)
+        return calc_projection_error(camera_points, sonar_points, x[0:3], x[3:6], sonar)
     opt = {"maxiter": 3000}
     res = scipy.optimize.minimize(fn, initial, method="Nelder-Mead", options=opt)
     if res.status != 0 or res.fun > 100:
@@ -345,6 +517,7 @@ def calc_projection_error(camera_points, sonar_points, rvec, tvec, sonar, verbos
     err = np.sum(np.sqrt(d_angle * d_angle + d_range * d_range))
     return err
 
+@timing_utils.timed("calibrate_sonar")
 def calibrate_sonar(
     sonar_points,
     camera_points,
@@ -352,7 +525,12 @@ def calibrate_sonar(
     init_rvec=None,
     init_tvec=None,
     verbose=False,
+    cancel=None,
 ):
+    """
+    cancel is an optional threading.Event; once it is set the solve stops by
+    raising CalibrationCancelled.
+    """
     # Initialize the sonar to be aligned with camera axis.
     # There's a rotation here because the camera has
     # X-right, but sonar is X-fwd. rvec is the Rodrigues representation
@@ -367,14 +545,16 @@ def calibrate_sonar(
     if verbose:
         print("Translation minimization:")
         
-    cs_err, cs_tvec = estimate_target_translation(
-        camera_points,
-        sonar_points,
-        sonar,
-        init_rvec,
-        init_tvec,
-        verbose,
-    )
+    with timing_utils.span("calibrate_sonar.translation"):
+        cs_err, cs_tvec = estimate_target_translation(
+            camera_points,
+            sonar_points,
+            sonar,
+            init_rvec,
+            init_tvec,
+            verbose,
+            cancel,
+        )
     # print("translation-only minimization: T = {}".format(cs_tvec))
 
     initial = [
@@ -388,14 +568,95 @@ def calibrate_sonar(
      
     if verbose:
         print("Full minimization:")
-    cs_err, cs_rvec, cs_tvec = estimate_target_pose(
-        camera_points,
-        sonar_points,
-        sonar,
-        initial,
-        verbose,
-    )
+    with timing_utils.span("calibrate_sonar.full_pose"):
+        cs_err, cs_rvec, cs_tvec = estimate_target_pose(
+            camera_points,
+            sonar_points,
+            sonar,
+            initial,
+            verbose,
+            cancel,
+        )
     # print("Full minimization: R = {}, T = {}".format(cs_rvec, cs_tvec))
     # cs_err is average error per point
     cs_err = cs_err/(sonar_points.shape[1])
     return cs_err, cs_rvec, cs_tvec
+
+def calibrate_frame(labeled_points, camera_rvec, camera_tvec, sonar, init_rvec=None, init_tvec=None, cancel=None):
+    """
+    Solve for the camera->sonar transform from the labels of a single frame.
+
+    labeled_points maps label to (pixel_x, pixel_y) in the polar sonar image and
+    camera_rvec, camera_tvec is the board's pose in the camera frame.
+    Returns (vectors, sonar_points, camera_points), the entry the gui keeps in
+    calibration_results, where vectors is (cs_err, cs_rvec, cs_tvec, sonar_rvec, sonar_tvec).
+    """
+    sonar_points, target_points = get_sonar_target_correspondences(labeled_points, sonar)
+
+    # Transform from target's coordinate frame to camera coordinate frame
+    camera_pose = pose_utils.as_poses(camera_rvec, camera_tvec)
+    camera_points = pose_utils.apply(camera_pose, target_points)[0]
+
+    cs_err, cs_rvec, cs_tvec = calibrate_sonar(
+        sonar_points, camera_points, sonar, init_rvec, init_tvec, cancel=cancel)
+
+    # Calculate sonar-> target from camera->sonar and camera->target
+    sonar_pose = pose_utils.compose(pose_utils.as_poses(cs_rvec, cs_tvec), camera_pose)
+    sonar_rvec, sonar_tvec = pose_utils.as_columns(sonar_pose)
+
+    vectors = (cs_err, cs_rvec, cs_tvec, sonar_rvec, sonar_tvec)
+    return vectors, sonar_points, camera_points
+
+@timing_utils.timed("multi_calibration")
+def multi_calibrate(calibration_results, timestamps, sonar, init_rvec=None, init_tvec=None, current_time=None,
+                    cancel=None):
+    """
+    Solve for a single camera->sonar transform using the points saved for
+    every timestamp in timestamps.
+
+    calibration_results maps timestamp to (vectors, sonar_points, camera_points).
+    If current_time is one of the timestamps, the returned error is the aggregate
+    calibration's error on that frame alone; otherwise it is the average error
+    over all points.
+    """
+    if not calibration_results:
+        return -1, None, None
+
+    all_sonar_points = []
+    all_camera_points = []
+    current_son_pts, current_cam_pts = None, None
+    for timestamp in timestamps:
+        try:
+            results, sonar_pts, camera_pts = calibration_results[timestamp]
+        except KeyError:
+            print("One or more timestamps do not exist. Cancelling operation")
+            return -1, None, None
+        if timestamp == current_time:
+            current_son_pts = sonar_pts
+            current_cam_pts = camera_pts
+        # sonar_pts is 2xN numpy array
+        # camera_pts is a 3xN numpy array
+        all_sonar_points.append(sonar_pts)
+        all_camera_points.append(camera_pts)
+
+    if not all_sonar_points:
+        return -1, None, None
+
+    concat_sonar = np.concatenate(all_sonar_points, axis=1)
+    concat_camera = np.concatenate(all_camera_points, axis=1)
+
+    agg_cs_err, agg_cs_rvec, agg_cs_tvec = calibrate_sonar(
+        concat_sonar,
+        concat_camera,
+        sonar,
+        init_rvec,
+        init_tvec,
+        cancel=cancel,
+    )
+
+    if current_cam_pts is not None and current_son_pts is not None:
+        current_err = calc_projection_error(current_cam_pts, current_son_pts, agg_cs_rvec, agg_cs_tvec, sonar)
+        current_err /= current_son_pts.shape[1]
+        return current_err, agg_cs_rvec, agg_cs_tvec
+    else:
+        return agg_cs_err, agg_cs_rvec, agg_cs_tvec
@@ -0,0 +1,145 @@
+import bisect
+import numpy as np
+
+# Status flags; a frame can have any combination
+PAIRED = 1      # has a sonar/camera pair in the data folders
+GOOD = 2
+SKIP = 4
+LABELED = 8
+BOARD = 16      # the charuco board was detected
+LOW_QUALITY = 32  # failed the frame_quality thresholds
+DUPLICATE = 64  # near-duplicate of another frame that is kept (frame_dedup)
+FLAGS = (PAIRED, GOOD, SKIP, LABELED, BOARD, LOW_QUALITY, DUPLICATE)
+# Frames checked per numpy step of a find
+SCAN_CHUNK = 4096
+
+class NavigationIndex():
+    """
+    Sorted timestamps with a status bitmask per frame, for finding the next or
+    previous frame matching a filter without scanning the label sets.
+
+    Each flag also keeps a sorted list of the frames that have it, so queries
+    requiring a flag (e.g. next good frame) bisect straight into that list.
+    Marks are updated one frame at a time with set / clear as they change.
+    """
+    def __init__(self, timestamps):
+        self.timestamps = np.unique(np.asarray(timestamps, dtype="datetime64[s]"))
+        self.length = len(self.timestamps)
+        self.flags = np.zeros(self.length, dtype=np.uint8)
+        self.members = {flag: [] for flag in FLAGS}
+
+    @classmethod
+    def from_state(cls, paired_timestamps, good, skip, labeled, board):
+        """
+        Index over the paired frames plus any marked frame that has no pair
+        (e.g. good frames that were copied to the output folder).
+        """
+        marked = [ts for group in (good, labeled) for ts in group]
+        index = cls(np.concatenate([np.asarray(paired_timestamps, dtype="datetime64[s]"),
+                                    np.array(marked, dtype="datetime64[s]")]))
+        for flag, group in ((PAIRED, paired_timestamps), (GOOD, good), (SKIP, skip),
+                            (LABELED, labeled), (BOARD, board)):
+            index.assign(flag, group)
+        return index
+
+    def assign(self, flag, timestamps):
+        """
+        Set flag on exactly these timestamps (ones not in the index are ignored).
+        """
+        idxs = self.indices_of(timestamps)
+        idxs = idxs[idxs >= 0]
+        self.flags &= ~np.uint8(flag)
+        self.flags[idxs] |= flag
+        self.members[flag] = sorted(set(idxs.tolist()))
+
+    def indices_of(self, timestamps):
+        """
+        Index of each timestamp, or -1 for ones that aren't in the index.
+        """
+        timestamps = np.array(list(timestamps), dtype="datetime64[s]")
+        if self.length == 0 or len(timestamps) == 0:
+            return np.full(len(timestamps), -1, dtype=np.int64)
+        idxs = np.minimum(np.searchsorted(self.timestamps, timestamps), self.length - 1)
+        return np.where(self.timestamps[idxs] == timestamps, idxs, -1)
+
+    def index_of(self, timestamp):
+        if timestamp is None:
+            return None
+        idx = int(self.indices_of([timestamp])[0])
+        return idx if idx >= 0 else None
+
+    def has(self, timestamp, flag):
+        idx = self.index_of(timestamp)
+        return idx is not None and bool(self.flags[idx] & flag)
+
+    def set(self, timestamp, flag, value=True):
+        idx = self.index_of(timestamp)
+        if idx is None:
+            raise Exception("Timestamp {} is not in the navigation index".format(timestamp))
+        members = self.members[flag]
+        pos = bisect.bisect_left(members, idx)
+        present = pos < len(members) and members[pos] == idx
+        if value and not present:
+            members.insert(pos, idx)
+            self.flags[idx] |= flag
+        elif not value and present:
+            del members[pos]
+            self.flags[idx] &= ~np.uint8(flag)
+
+    def clear(self, timestamp, flag):
+        self.set(timestamp, flag, False)
+
+    def count(self, flag):
+        return len(self.members[flag])
+
+    @staticmethod
+    def _matching(status, require, exclude):
+        return ((status & require) == require) & ((status & exclude) == 0)
+
+    def find(self, start, require=0, exclude=0, reverse=False):
+        """
+        Index of the first frame after start (before it, if reverse) that has
+        every flag in require and none in exclude, or None.
+        start is an index; use -1 (or self.length with reverse) to search from the ends.
+        """
+        if require:
+            # Test the shortest list of frames that have a required flag, a chunk at a time
+            members = min((self.members[flag] for flag in FLAGS if require & flag), key=len)
+            if reverse:
+                stop = bisect.bisect_left(members, start)
+                while stop > 0:
+                    first = max(0, stop - SCAN_CHUNK)
+                    chunk = np.array(members[first:stop], dtype=np.int64)
+                    (matches,) = np.nonzero(self._matching(self.flags[chunk], require, exclude))
+                    if matches.size > 0:
+                        return int(chunk[matches[-1]])
+                    stop = first
+            else:
+                first = bisect.bisect_right(members, start)
+                while first < len(members):
+                    stop = min(first + SCAN_CHUNK, len(members))
+                    chunk = np.array(members[first:stop], dtype=np.int64)
+                    (matches,) = np.nonzero(self._matching(self.flags[chunk], require, exclude))
+                    if matches.size > 0:
+                        return int(chunk[matches[0]])
+                    first = stop
+            return None
+
+        # No required flag, so scan the bitmask a chunk at a time
+        if reverse:
+            stop = min(start, self.length)
+            while stop > 0:
+                first = max(0, stop - SCAN_CHUNK)
+                (matches,) = np.nonzero(self._matching(self.flags[first:stop], 0, exclude))
+                if matches.size > 0:
+                    return first + int(matches[-1])
+                stop = first
+        else:
+            first = max(start + 1, 0)
+            while first < self.length:
+                stop = min(first + SCAN_CHUNK, self.length)
+                (matches,) = np.nonzero(self._matching(self.flags[first:stop], 0, exclude))
+                if matches.size > 0:
+                    return first + int(matches[0])
+                first = stop
+        return None
@@ -0,0 +1,153 @@
+# Batched rigid transforms.
+#
+# A pose is stored either as a row [rx, ry, rz, tx, ty, tz] of an (N, 6) array,
+# with r the Rodrigues rotation vector as used by OpenCV, or as an (N, 4, 4)
+# homogeneous matrix. A pose maps points from its source frame into its target
+# frame: X_target = R @ X_source + t, the same convention as the rvec/tvec
+# pairs used throughout the gui (camera->board, camera->sonar, ...).
+# Every function also accepts a single pose ((6,), or (4, 4)), which is
+# treated as N = 1, so results always have a leading N axis.
+import numpy as np
+
+# Below this rotation angle (rad) the series forms of exp/log are used
+SMALL_ANGLE = 1e-8
+
+def skew(vectors):
+    """
+    (N, 3, 3) cross product matrices of (N, 3) vectors.
+    """
+    vectors = np.reshape(np.asarray(vectors, dtype=np.float64), (-1, 3))
+    x, y, z = vectors.T
+    zero = np.zeros_like(x)
+    return np.stack([zero, -z, y, z, zero, -x, -y, x, zero], axis=1).reshape(-1, 3, 3)
+
+def exp_so3(rvecs):
+    """
+    Rotation matrices (N, 3, 3) for N rotation vectors (Rodrigues formula).
+    """
+    rvecs = np.reshape(np.asarray(rvecs, dtype=np.float64), (-1, 3))
+    theta = np.linalg.norm(rvecs, axis=1)
+    small = theta < SMALL_ANGLE
+    safe = np.where(small, 1.0, theta)
+    # sin(theta)/theta and (1 - cos(theta))/theta^2, with their limits at 0
+    a = np.where(small, 1.0, np.sin(theta) / safe)[:, None, None]
+    b = np.where(small, 0.5, (1 - np.cos(theta)) / safe**2)[:, None, None]
+    K = skew(rvecs)
+    return np.eye(3) + a * K + b * (K @ K)
+
+def log_so3(rots):
+    """
+    Rotation vectors (N, 3) for N rotation matrices, with angles in [0, pi].
+    """
+    rots = np.reshape(np.asarray(rots, dtype=np.float64), (-1, 3, 3))
+    # 2 sin(theta) * axis
+    vee = np.stack([rots[:, 2, 1] - rots[:, 1, 2],
+                    rots[:, 0, 2] - rots[:, 2, 0],
+                    rots[:, 1, 0] - rots[:, 0, 1]], axis=1)
+    # atan2 rather than arccos of the trace, which loses precision near 0 and pi
+    sin = np.linalg.norm(vee, axis=1) / 2
+    cos = (np.trace(rots, axis1=1, axis2=2) - 1) / 2
+    theta = np.arctan2(sin, cos)
+    small = theta < SMALL_ANGLE
+    scale = np.where(small, 0.5, theta / (2 * np.where(small, 1.0, sin)))
+    rvecs = vee * scale[:, None]
+
+    # Near pi sin(theta) vanishes, so take the axis from the symmetric part
+    # instead: (R + R.T) / 2 = cos I + (1 - cos) axis @ axis.T
+    near_pi = theta > np.pi - 1e-3
+    if np.any(near_pi):
+        rr = rots[near_pi]
+        c = cos[near_pi][:, None, None]
+        outer = ((rr + np.transpose(rr, (0, 2, 1))) / 2 - c * np.eye(3)) / (1 - c)
+        rows = np.arange(len(rr))
+        diag = np.diagonal(outer, axis1=1, axis2=2)
+        col = np.argmax(diag, axis=1)
+        axis = outer[rows, :, col] / np.sqrt(diag[rows, col])[:, None]
+        # Pick the sign that agrees with the (small) antisymmetric part
+        sign = np.where(np.sum(axis * vee[near_pi], axis=1) < 0, -1.0, 1.0)
+        rvecs[near_pi] = axis * (sign * theta[near_pi])[:, None]
+    return rvecs
+
+def as_poses(rvecs, tvecs):
+    """
+    (N, 6) poses from N rotation vectors and N translations.
+    """
+    rvecs = np.reshape(np.asarray(rvecs, dtype=np.float64), (-1, 3))
+    tvecs = np.reshape(np.asarray(tvecs, dtype=np.float64), (-1, 3))
+    return np.concatenate([rvecs, tvecs], axis=1)
+
+def as_columns(pose):
+    """
+    (rvec, tvec) as (3, 1) columns, as cv2 returns them, for a single pose.
+    """
+    pose = to_vectors(pose)
+    if len(pose) != 1:
+        raise Exception("Expected a single pose, got {}".format(len(pose)))
+    return pose[0, :3].reshape(3, 1), pose[0, 3:].reshape(3, 1)
+
+def to_matrix(poses):
+    """
+    (N, 4, 4) homogeneous matrices for (N, 6) poses. Matrices pass through.
+    """
+    poses = np.asarray(poses, dtype=np.float64)
+    if poses.shape[-2:] == (4, 4):
+        return poses.reshape(-1, 4, 4)
+    poses = poses.reshape(-1, 6)
+    mats = np.zeros((len(poses), 4, 4))
+    mats[:, :3, :3] = exp_so3(poses[:, :3])
+    mats[:, :3, 3] = poses[:, 3:]
+    mats[:, 3, 3] = 1.0
+    return mats
+
+def to_vectors(poses):
+    """
+    (N, 6) poses for (N, 4, 4) homogeneous matrices. Vectors pass through.
+    """
+    poses = np.asarray(poses, dtype=np.float64)
+    if poses.shape[-2:] == (4, 4):
+        mats = poses.reshape(-1, 4, 4)
+        return np.concatenate([log_so3(mats[:, :3, :3]), mats[:, :3, 3]], axis=1)
+    return poses.reshape(-1, 6)
+
+def _like(result, poses):
+    """
+    result (N, 4, 4) in the same representation as poses.
+    """
+    if np.shape(poses)[-2:] == (4, 4):
+        return result
+    return to_vectors(result)
+
+def compose(first, second):
+    """
+    Chain poses: X_c = compose(b_to_c, a_to_b) @ X_a, i.e. first @ second.
+    N or 1 poses on either side (a single pose is applied to every pose on
+    the other side). The result has the representation of first.
+    """
+    return _like(to_matrix(first) @ to_matrix(second), first)
+
+def invert(poses):
+    """
+    Inverse of every pose, in the same representation.
+    """
+    mats = to_matrix(poses)
+    rots = np.transpose(mats[:, :3, :3], (0, 2, 1))
+    inverse = np.zeros_like(mats)
+    inverse[:, :3, :3] = rots
+    inverse[:, :3, 3] = -(rots @ mats[:, :3, 3:])[:, :, 0]
+    inverse[:, 3, 3] = 1.0
+    return _like(inverse, poses)
+
+def relative(a_to_b, a_to_c):
+    """
+    b->c poses from a->b and a->c poses: compose(a_to_c, invert(a_to_b)).
+    """
+    return compose(a_to_c, invert(a_to_b))
+
+def apply(poses, points):
+    """
+    Transform (3, M) points (or (N, 3, M), one set per pose) by N poses.
+    Returns an (N, 3, M) array.
+    """
+    mats = to_matrix(poses)
+    points = np.asarray(points, dtype=np.float64)
+    return mats[:, :3, :3] @ points + mats[:, :3, 3:]
@@ -0,0 +1,230 @@
+import numpy as np
+import matplotlib
+from PyQt5 import QtGui, QtWidgets, QtCore
+
+# Zoom factor per mouse wheel step
+WHEEL_ZOOM = 1.25
+# Dragging further than this (pixels) pans the view rather than clicking
+DRAG_PIXELS = 2
+
+def make_lut(cmap):
+    """
+    256-entry Qt color table for a matplotlib colormap name.
+    """
+    if cmap == "gray":
+        return [QtGui.qRgb(ii, ii, ii) for ii in range(256)]
+    colors = (matplotlib.colormaps[cmap](np.arange(256))[:, :3] * 255).astype(np.uint8)
+    return [QtGui.qRgb(int(r), int(g), int(b)) for r, g, b in colors]
+
+_LUTS = {}
+
+def get_lut(cmap):
+    if cmap not in _LUTS:
+        _LUTS[cmap] = make_lut(cmap)
+    return _LUTS[cmap]
+
+class RasterMouseEvent():
+    """
+    Mouse event with the same fields the matplotlib handlers used:
+    x, y in widget pixels and xdata, ydata in image coordinates
+    (None outside the image).
+    """
+    def __init__(self, x, y, xdata, ydata, button):
+        self.x = x
+        self.y = y
+        self.xdata = xdata
+        self.ydata = ydata
+        self.button = button
+
+class RasterView(QtWidgets.QWidget):
+    """
+    Lightweight image view that draws a NumPy array through a QImage wrapping
+    the array's memory, so showing a new frame doesn't copy or resample it.
+
+    * uint8 single channel images are colored with a gray or matplotlib LUT;
+      uint8 3-channel images are shown as BGR
+    * Scroll to zoom around the cursor, drag to pan; reset_view() restores the fit
+    * Markers, lines and text are drawn as vector overlays in image coordinates
+
+    Image coordinates match matplotlib's imshow: pixel centers are at integer
+    coordinates, and with origin="lower" row 0 is at the bottom.
+    """
+    pressed = QtCore.pyqtSignal(object)
+    released = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(RasterView, self).__init__(parent)
+        self.setMouseTracking(False)
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
+        self.array = None
+        self.qimage = None
+        self.origin = "upper"
+        self.aspect = "equal"
+        self.overlays = []
+        # Widget pixel = offset + scale * image pixel (image pixel edges at integers)
+        self.scale = (1.0, 1.0)
+        self.offset = (0.0, 0.0)
+        self.user_view = False
+        self.drag_start = None
+
+    def sizeHint(self):
+        return QtCore.QSize(500, 300)
+
+    def set_image(self, array, cmap="gray", origin="upper", aspect="equal", keep_view=False):
+        """
+        Show array, which must stay unmodified while it is displayed.
+        If keep_view and the shape is unchanged, the current pan/zoom is kept.
+        """
+        if array.dtype != np.uint8:
+            raise Exception("RasterView only displays uint8 images, got {}".format(array.dtype))
+        if array.strides[-1] != array.itemsize * (array.shape[2] if array.ndim == 3 else 1):
+            array = np.ascontiguousarray(array)
+        same_shape = self.array is not None and self.array.shape == array.shape
+        height, width = array.shape[:2]
+        if array.ndim == 2:
+            qimage = QtGui.QImage(array.data, width, height, array.strides[0], QtGui.QImage.Format_Indexed8)
+            qimage.setColorTable(get_lut(cmap))
+        elif array.ndim == 3 and array.shape[2] == 3:
+            qimage = QtGui.QImage(array.data, width, height, array.strides[0], QtGui.QImage.Format_BGR888)
+        else:
+            raise Exception("RasterView can't display an image of shape {}".format(array.shape))
+        # The QImage points into array's memory, so keep the array alive with it
+        self.array = array
+        self.qimage = qimage
+        self.origin = origin
+        self.aspect = aspect
+        if not (keep_view and same_shape and self.user_view):
+            self.reset_view()
+        self.update()
+
+    def reset_view(self):
+        self.user_view = False
+        if self.array is None:
+            return
+        height, width = self.array.shape[:2]
+        sx = self.width() / width
+        sy = self.height() / height
+        if self.aspect == "equal":
+            sx = sy = min(sx, sy)
+        self.scale = (sx, sy)
+        self.offset = (0.5 * (self.width() - sx * width), 0.5 * (self.height() - sy * height))
+        self.update()
+
+    def clear_overlays(self):
+        self.overlays = []
+
+    def add_markers(self, xdata, ydata, color, marker="o", size=8, labels=None):
+        """
+        marker is "o" (open circle), "x" or "." (filled dot); size is in screen pixels.
+        """
+        self.overlays.append(("markers", np.ravel(xdata), np.ravel(ydata), QtGui.QColor(color),
+                              marker, size, labels))
+
+    def add_line(self, xdata, ydata, color, width=1):
+        self.overlays.append(("line", np.ravel(xdata), np.ravel(ydata), QtGui.QColor(color), width))
+
+    def data_to_widget(self, xdata, ydata):
+        height = self.array.shape[0]
+        u = np.asarray(xdata, dtype=np.float64) + 0.5
+        if self.origin == "lower":
+            v = height - 0.5 - np.asarray(ydata, dtype=np.float64)
+        else:
+            v = np.asarray(ydata, dtype=np.float64) + 0.5
+        return self.offset[0] + self.scale[0] * u, self.offset[1] + self.scale[1] * v
+
+    def widget_to_data(self, x, y):
+        height, width = self.array.shape[:2]
+        u = (x - self.offset[0]) / self.scale[0]
+        v = (y - self.offset[1]) / self.scale[1]
+        if not (0 <= u < width and 0 <= v < height):
+            return None, None
+        xdata = u - 0.5
+        ydata = height - v - 0.5 if self.origin == "lower" else v - 0.5
+        return xdata, ydata
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.black)
+        if self.qimage is None:
+            painter.end()
+            return
+        height, width = self.array.shape[:2]
+        (sx, sy), (ox, oy) = self.scale, self.offset
+        # Only the visible part of the image is handed to Qt
+        u0, u1 = max(0.0, -ox / sx), min(float(width), (self.width() - ox) / sx)
+        v0, v1 = max(0.0, -oy / sy), min(float(height), (self.height() - oy) / sy)
+        if u1 > u0 and v1 > v0:
+            target = QtCore.QRectF(ox + u0 * sx, oy + v0 * sy, (u1 - u0) * sx, (v1 - v0) * sy)
+            painter.drawImage(target, self.qimage, QtCore.QRectF(u0, v0, u1 - u0, v1 - v0))
+
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        for overlay in self.overlays:
+            if overlay[0] == "line":
+                _, xdata, ydata, color, line_width = overlay
+                xs, ys = self.data_to_widget(xdata, ydata)
+                painter.setPen(QtGui.QPen(color, line_width))
+                painter.drawPolyline(QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in zip(xs, ys)]))
+            else:
+                _, xdata, ydata, color, marker, size, labels = overlay
+                xs, ys = self.data_to_widget(xdata, ydata)
+                painter.setPen(QtGui.QPen(color, 1.5))
+                painter.setBrush(QtGui.QBrush(color) if marker == "." else QtCore.Qt.NoBrush)
+                half = 0.5 * size
+                for ii, (x, y) in enumerate(zip(xs, ys)):
+                    if marker == "x":
+                        painter.drawLine(QtCore.QPointF(x - half, y - half), QtCore.QPointF(x + half, y + half))
+                        painter.drawLine(QtCore.QPointF(x - half, y + half), QtCore.QPointF(x + half, y - half))
+                    else:
+                        painter.drawEllipse(QtCore.QPointF(x, y), half, half)
+                    if labels is not None:
+                        painter.drawText(QtCore.QPointF(x + size, y - size), str(labels[ii]))
+        painter.end()
+
+    def resizeEvent(self, event):
+        if self.user_view and event.oldSize().width() > 0 and event.oldSize().height() > 0:
+            # Keep the same part of the image in view
+            fx = event.size().width() / event.oldSize().width()
+            fy = event.size().height() / event.oldSize().height()
+            if self.aspect == "equal":
+                fx = fy = min(fx, fy)
+            self.scale = (self.scale[0] * fx, self.scale[1] * fy)
+            self.offset = (self.offset[0] * fx, self.offset[1] * fy)
+        else:
+            self.reset_view()
+        super(RasterView, self).resizeEvent(event)
+
+    def wheelEvent(self, event):
+        if self.array is None:
+            return
+        factor = WHEEL_ZOOM ** (event.angleDelta().y() / 120.0)
+        x, y = event.pos().x(), event.pos().y()
+        (sx, sy), (ox, oy) = self.scale, self.offset
+        self.scale = (sx * factor, sy * factor)
+        self.offset = (x - (x - ox) * factor, y - (y - oy) * factor)
+        self.user_view = True
+        self.update()
+
+    def _event(self, event):
+        x, y = event.pos().x(), event.pos().y()
+        if self.array is None:
+            return RasterMouseEvent(x, y, None, None, event.button())
+        xdata, ydata = self.widget_to_data(x, y)
+        return RasterMouseEvent(x, y, xdata, ydata, event.button())
+
+    def mousePressEvent(self, event):
+        self.drag_start = (event.pos().x(), event.pos().y(), self.offset)
+        self.pressed.emit(self._event(event))
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is None or self.array is None:
+            return
+        x0, y0, (ox, oy) = self.drag_start
+        dx, dy = event.pos().x() - x0, event.pos().y() - y0
+        if abs(dx) > DRAG_PIXELS or abs(dy) > DRAG_PIXELS:
+            self.offset = (ox + dx, oy + dy)
+            self.user_view = True
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+        self.released.emit(self._event(event))
@@ -0,0 +1,144 @@
+import sys
+import numpy as np
+
+import image_sonar_utils as isc
+import pose_utils
+
+# Python version of relative_pose_calculator.m: the camera/sonar transform
+# predicted from the mount's measurements. Every function takes scalars or
+# equal-length arrays, so a whole sweep of mount settings is one call.
+
+# Mount dimensions (mm) used by both directions of the calculation
+SEGMENT_X = 45 + 55
+SEGMENT_Y = 20 + 35
+SEGMENT_Z = 20 + 63 + 8  # TODO: add camera focal point offset
+OFFSET_O1 = 42.8  # offset from the x-axis to O1
+CAMERA_OFFSET = 52.8
+SONAR_Y = 29 + 18
+SONAR_Z = -91.39 + 60 + 58.8
+# Resolution of the hand-labeled points in the reprojection check (deg, m)
+CHECK_ANGLE_RES = 0.4
+CHECK_RANGE_RES = 0.0025
+
+def rotations_x(degrees):
+    angle = np.radians(np.ravel(degrees))
+    cos, sin = np.cos(angle), np.sin(angle)
+    one, zero = np.ones_like(angle), np.zeros_like(angle)
+    return np.stack([one, zero, zero, zero, cos, -sin, zero, sin, cos], axis=1).reshape(-1, 3, 3)
+
+def rotations_y(degrees):
+    angle = np.radians(np.ravel(degrees))
+    cos, sin = np.cos(angle), np.sin(angle)
+    one, zero = np.ones_like(angle), np.zeros_like(angle)
+    return np.stack([cos, zero, sin, zero, one, zero, -sin, zero, cos], axis=1).reshape(-1, 3, 3)
+
+def rotations_z(degrees):
+    angle = np.radians(np.ravel(degrees))
+    cos, sin = np.cos(angle), np.sin(angle)
+    one, zero = np.ones_like(angle), np.zeros_like(angle)
+    return np.stack([cos, -sin, zero, sin, cos, zero, zero, zero, one], axis=1).reshape(-1, 3, 3)
+
+def _column(x, y, z):
+    """
+    (N, 3, 1) vectors from broadcast x, y, z.
+    """
+    return np.stack(np.broadcast_arrays(*(np.ravel(v).astype(np.float64) for v in (x, y, z))),
+                    axis=1)[:, :, None]
+
+def _homogeneous(rots, tvecs):
+    """
+    (N, 4, 4) matrices from (N, 3, 3) rotations and (N, 3, 1) translations.
+    """
+    mats = np.zeros((len(rots), 4, 4))
+    mats[:, :3, :3] = rots
+    mats[:, :3, 3] = tvecs[:, :, 0]
+    mats[:, 3, 3] = 1.0
+    return mats
+
+def sonar_camera_pose(x, y, z, pitch1, pitch2, roll, yaw):
+    """
+    (N, 4, 4) sonar->camera transforms (calculateSCPose), with translations
+    in meters. x, y, z are the mount's slide positions (mm) and the angles
+    are in degrees.
+    """
+    x, y, z, pitch1, pitch2, roll, yaw = np.broadcast_arrays(
+        *(np.ravel(v).astype(np.float64) for v in (x, y, z, pitch1, pitch2, roll, yaw)))
+    rot_x = rotations_x(pitch1 + pitch2)
+    rot_xy = rot_x @ rotations_y(yaw)
+    rot = rot_xy @ rotations_z(roll)
+
+    ytotal = -(SEGMENT_Y + y)
+    ztotal = SEGMENT_Z + z
+    zero = np.zeros_like(x)
+    tvec = (_column(SEGMENT_X + x, SONAR_Y + zero, -SONAR_Z + zero)
+            + rot_x @ _column(zero, ytotal, -OFFSET_O1 + zero)
+            + rot_xy @ _column(-OFFSET_O1 + zero, -CAMERA_OFFSET + zero, ztotal))
+    return _homogeneous(rot, tvec * 0.001)
+
+def camera_sonar_pose(x, y, z, pitch1, pitch2, roll, yaw):
+    """
+    (N, 4, 4) camera->sonar transforms (calculateCSPose), with translations
+    in meters, in the camera's x right, y down, z forward convention.
+    Pitch up is positive.
+    """
+    x, y, z, pitch1, pitch2, roll, yaw = np.broadcast_arrays(
+        *(np.ravel(v).astype(np.float64) for v in (x, y, z, pitch1, pitch2, roll, yaw)))
+    rot_z = rotations_z(roll)
+    rot_zy = rot_z @ rotations_y(yaw)
+    rot = rot_zy @ rotations_x(pitch1 + pitch2)
+
+    zero = np.zeros_like(x)
+    tvec = (rot_z @ _column(OFFSET_O1 + CAMERA_OFFSET + zero, zero, -SEGMENT_Z - z)
+            + rot_zy @ _column(zero, SEGMENT_Y + y, OFFSET_O1 + zero)
+            + rot @ _column(-(SEGMENT_X + x), -SONAR_Y + zero, SONAR_Z + zero))
+    return _homogeneous(rot, tvec * 0.001)
+
+def reprojection_errors(poses, camera_points, sonar_points, angle_res=CHECK_ANGLE_RES,
+                        range_res=CHECK_RANGE_RES):
+    """
+    Summed reprojection error, in resolution cells, of camera_points (3, M)
+    against the labeled sonar_points (2, M; degrees and meters) for each of
+    N camera->sonar poses, as in isc.calc_projection_error. Returns (N,).
+    """
+    sonar_frame = pose_utils.apply(poses, camera_points)
+    nposes, _, npoints = sonar_frame.shape
+    flat = np.transpose(sonar_frame, (1, 0, 2)).reshape(3, -1)
+    polar = isc.polar_from_3d(flat).reshape(2, nposes, npoints)
+    d_angle = (sonar_points[0] - polar[0]) / angle_res
+    d_range = (sonar_points[1] - polar[1]) / range_res
+    return np.sum(np.sqrt(d_angle * d_angle + d_range * d_range), axis=1)
+
+if __name__ == "__main__":
+    # usage: python relative_pose_calculator.py [x y z pitch1 pitch2 roll yaw]
+    mount = (200, 100, 100, 0, 0, 0, -15)
+    if len(sys.argv) > 1:
+        mount = [float(arg) for arg in sys.argv[1:8]]
+    pose = pose_utils.to_vectors(sonar_camera_pose(*mount))[0]
+    print("Sonar -> camera\nrvec = {}\ntvec = {}".format(pose[:3], pose[3:]))
+
+    # Where a point seen by the camera lands in the sonar's polar image
+    cs_rot = np.array([[.604, .788, .118],
+                       [-.788, .613, -.052],
+                       [-.114, -.062, .992]])
+    cs_tvec = np.array([[.354], [1.625], [-1.42]])
+    cam_point = np.array([[-.023], [-.341], [1.390]])
+    res = pose_utils.apply(_homogeneous(cs_rot[None], cs_tvec[None]), cam_point)[0]
+    angle, rr = isc.polar_from_3d(res)[:, 0]
+    print("Sonar frame point {}\nrange = {:.3f} m, angle = {:.2f} deg".format(res.ravel(), rr, angle))
+
+    # Reprojection check of a hand-labeled frame
+    sonar_pt = np.array([
+        [7.48461077, 3.56225735, 12.44758855, 11.64710826, 5.96369822, 4.92307384, 13.88845307,
+         6.36393836, 11.96730038, 5.00312187, 11.64710826, 10.60648389, 5.64350610],
+        [1.37769737, 1.40698799, 1.4765532, 1.52048913, 1.4541438, 1.37202361, 1.50391362,
+         1.3745121, 1.55119494, 1.40686248, 1.48898267, 1.54372947, 1.35460417]])
+    cam_pt = np.array([
+        [-0.31181931, -0.4512467, -0.33766299, -0.46533855, -0.4888422, -0.35255207, -0.34627754,
+         -0.33218569, -0.49431949, -0.43088032, -0.3870103, -0.51468587, -0.30320476],
+        [0.03730469, -0.04969186, 0.17623849, 0.16548973, 0.01299416, -0.02256834, 0.22254976,
+         0.00736817, 0.18186448, -0.01975534, 0.16267673, 0.15192797, -0.00900658],
+        [1.2066785, 1.21230033, 1.27275046, 1.30680063, 1.24994394, 1.19386979, 1.29477444,
+         1.20027415, 1.32242026, 1.21870469, 1.28196573, 1.3160159, 1.18465452]])
+    check_pose = pose_utils.as_poses(pose_utils.log_so3(rotations_z(-90)), [0.1544, -0.244, 0.1242])
+    err = reprojection_errors(check_pose, cam_pt, sonar_pt)[0]
+    print("Reprojection error: {:.2f} ({:.2f} per point)".format(err, err / sonar_pt.shape[1]))
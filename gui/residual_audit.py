@@ -0,0 +1,182 @@
+import os
+import sys
+import numpy as np
+
+import image_sonar_utils as isc
+import data_analysis_tools as dtools
+import pose_utils
+
+# A label is an outlier when its error is more than OUTLIER_MADS median
+# absolute deviations above the median error, and at least MIN_OUTLIER_ERROR
+# resolution cells
+OUTLIER_MADS = 3.5
+MIN_OUTLIER_ERROR = 2.0
+# Rows of the ranked list printed by print_report
+REPORT_ROWS = 20
+
+def correspondences(sonar_labels, camera_poses, sonar):
+    """
+    Every labeled point of every frame that has a board pose, flattened.
+
+    Returns (timestamps (N,), frame_idx (K,), bolt_idx (K,), sonar_points (2, K)),
+    where frame_idx indexes timestamps, bolt_idx indexes the target table and
+    sonar_points are the labels' (angle, range).
+    """
+    table = isc.get_target_table()
+    timestamps = sorted(ts for ts, points in sonar_labels.items() if points and ts in camera_poses)
+    frame_idx, bolt_idx, pixels = [], [], []
+    for ii, timestamp in enumerate(timestamps):
+        points = sonar_labels[timestamp]
+        frame_idx.append(np.full(len(points), ii))
+        bolt_idx.append(table.indices(list(points.keys())))
+        pixels.append(np.array(list(points.values()), dtype=np.float64).reshape(-1, 2))
+    if not timestamps:
+        return [], np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros((2, 0))
+    pixels = np.concatenate(pixels).T
+    return (timestamps, np.concatenate(frame_idx), np.concatenate(bolt_idx),
+            np.array(isc.pixel_to_polar(pixels, sonar)))
+
+def residual_matrix(sonar_labels, camera_poses, cs_rvec, cs_tvec, sonar):
+    """
+    Residuals of every label against the camera->sonar transform cs_rvec, cs_tvec.
+
+    Returns (timestamps (N,), residuals (N, T, 2)) with T the number of bolts on
+    the target. residuals[..., 0] is the angle error and residuals[..., 1] the
+    range error, labeled minus predicted, in resolution cells as in
+    isc.calc_projection_error. Bolts that weren't labeled in a frame are NaN.
+    """
+    table = isc.get_target_table()
+    timestamps, frame_idx, bolt_idx, sonar_points = correspondences(sonar_labels, camera_poses, sonar)
+    residuals = np.full((len(timestamps), len(table), 2), np.nan)
+    if not timestamps:
+        return timestamps, residuals
+
+    # Every bolt of every frame in the sonar frame in one call: (N, 3, T)
+    board_poses = pose_utils.as_poses([camera_poses[ts][0] for ts in timestamps],
+                                      [camera_poses[ts][1] for ts in timestamps])
+    sonar_poses = pose_utils.compose(pose_utils.as_poses(cs_rvec, cs_tvec), board_poses)
+    predicted = pose_utils.apply(sonar_poses, table.points.T)[frame_idx, :, bolt_idx].T
+    polar = isc.polar_from_3d(predicted)
+
+    residuals[frame_idx, bolt_idx, 0] = (sonar_points[0] - polar[0]) / sonar.th_res
+    residuals[frame_idx, bolt_idx, 1] = (sonar_points[1] - polar[1]) / sonar.r_res
+    return timestamps, residuals
+
+def residual_errors(residuals):
+    """
+    (N, T) error magnitude of each label, NaN where not labeled.
+    """
+    return np.sqrt(np.sum(residuals * residuals, axis=-1))
+
+def outlier_threshold(errors):
+    """
+    Error above which a label counts as an outlier (see OUTLIER_MADS).
+    """
+    errors = errors[np.isfinite(errors)]
+    if len(errors) == 0:
+        return np.inf
+    median = np.median(errors)
+    mad = 1.4826 * np.median(np.abs(errors - median))
+    return max(median + OUTLIER_MADS * mad, MIN_OUTLIER_ERROR)
+
+def rank_outliers(timestamps, residuals):
+    """
+    Every label from worst to best error, as a list of
+    (timestamp, label, d_angle, d_range, error, is_outlier).
+    """
+    labels = isc.get_target_table().labels
+    errors = residual_errors(residuals)
+    threshold = outlier_threshold(errors)
+    frame_idx, bolt_idx = np.nonzero(np.isfinite(errors))
+    order = np.argsort(-errors[frame_idx, bolt_idx], kind="stable")
+    ranked = []
+    for ii, jj in zip(frame_idx[order], bolt_idx[order]):
+        d_angle, d_range = residuals[ii, jj]
+        ranked.append((timestamps[ii], labels[jj], d_angle, d_range, errors[ii, jj],
+                       errors[ii, jj] > threshold))
+    return ranked
+
+def bolt_bias(residuals):
+    """
+    Per-bolt summary over all frames, as (T, 5) rows of
+    [count, mean d_angle, mean d_range, rms error, max error].
+    A mean far from zero for one bolt points at a mislabeled bolt or a
+    target_spec.json position that doesn't match the board.
+    """
+    labeled = np.isfinite(residuals[:, :, 0])
+    counts = np.count_nonzero(labeled, axis=0)
+    safe = np.maximum(counts, 1)
+    filled = np.where(labeled[:, :, None], residuals, 0.0)
+    means = filled.sum(axis=0) / safe[:, None]
+    errors = np.where(labeled, residual_errors(residuals), 0.0)
+    rms = np.sqrt(np.sum(errors * errors, axis=0) / safe)
+    summary = np.column_stack([counts, means, rms, errors.max(axis=0, initial=0.0)])
+    summary[counts == 0, 1:] = np.nan
+    return summary
+
+def save_report(outdir, timestamps, residuals, ranked, bias):
+    """
+    Save the residual matrix (residuals.npz), the ranked labels (outliers.csv)
+    and the per-bolt summary (bolt_bias.csv) to outdir.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    labels = isc.get_target_table().labels
+    np.savez(f"{outdir}/residuals.npz", timestamps=np.array(timestamps, dtype="datetime64[s]"),
+             labels=np.array(labels), residuals=residuals)
+    with open(f"{outdir}/outliers.csv", "w") as fp:
+        fp.write("timestamp,label,d_angle,d_range,error,outlier\n")
+        for timestamp, label, d_angle, d_range, error, outlier in ranked:
+            fp.write("{},{},{:.4f},{:.4f},{:.4f},{}\n".format(
+                timestamp, label, d_angle, d_range, error, int(outlier)))
+    with open(f"{outdir}/bolt_bias.csv", "w") as fp:
+        fp.write("label,count,mean_d_angle,mean_d_range,rms_error,max_error\n")
+        for label, (count, d_angle, d_range, rms, worst) in zip(labels, bias):
+            fp.write("{},{},{:.4f},{:.4f},{:.4f},{:.4f}\n".format(label, int(count), d_angle, d_range, rms, worst))
+
+def print_report(ranked, bias, rows=REPORT_ROWS):
+    labels = isc.get_target_table().labels
+    outliers = sum(1 for row in ranked if row[5])
+    print("{} labels, {} outliers".format(len(ranked), outliers))
+    print("timestamp            label  d_angle  d_range  error")
+    for timestamp, label, d_angle, d_range, error, outlier in ranked[:rows]:
+        print("{}  {:5s}  {:7.2f}  {:7.2f}  {:5.2f}{}".format(
+            timestamp, label, d_angle, d_range, error, "  *" if outlier else ""))
+    print("label  count  mean d_angle  mean d_range  rms")
+    for label, (count, d_angle, d_range, rms, _) in zip(labels, bias):
+        if count > 0:
+            print("{:5s}  {:5d}  {:12.2f}  {:12.2f}  {:5.2f}".format(label, int(count), d_angle, d_range, rms))
+
+def audit(sonar_labels, camera_poses, cs_rvec, cs_tvec, sonar, outdir=None):
+    """
+    Residual matrix, ranked labels and per-bolt bias for a whole session.
+    The report is printed, and saved to outdir if given.
+    Returns (timestamps, residuals, ranked, bias).
+    """
+    timestamps, residuals = residual_matrix(sonar_labels, camera_poses, cs_rvec, cs_tvec, sonar)
+    ranked = rank_outliers(timestamps, residuals)
+    bias = bolt_bias(residuals)
+    print_report(ranked, bias)
+    if outdir is not None:
+        save_report(outdir, timestamps, residuals, ranked, bias)
+        print("Saved residuals to {}".format(outdir))
+    return timestamps, residuals, ranked, bias
+
+if __name__ == "__main__":
+    # usage: python residual_audit.py [rootdir] [--reference]
+    # Audits against the aggregate calibration of every labeled frame, or
+    # against ext_r / ext_t from inputparams.json with --reference.
+    rootdir = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/07-23-2025"
+    args = [arg for arg in sys.argv[1:] if arg != "--reference"]
+    if args:
+        rootdir = args[0]
+    session = dtools.Session(rootdir)
+    if "--reference" in sys.argv:
+        cs_rvec, cs_tvec = session.ext_rvec, session.ext_tvec
+    else:
+        _, cs_rvec, cs_tvec = isc.multi_calibrate(session.calibration_results,
+                                                  sorted(session.calibration_results), session.sonar,
+                                                  session.ext_rvec, session.ext_tvec)
+    print("Camera -> sonar rvec {} tvec {}".format(np.ravel(cs_rvec), np.ravel(cs_tvec)))
+    audit(session.sonar_labels, session.camera_poses, cs_rvec, cs_tvec, session.sonar,
+          f"{rootdir}/output/residuals")
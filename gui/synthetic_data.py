@@ -0,0 +1,285 @@
+import os
+import json
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import charuco_utils
+import image_sonar_utils as isc
+import pose_utils
+
+# Pixels per charuco square in the rendered board texture
+SQUARE_PIXELS = 80
+# Sonar returns are attenuated with elevation using a gaussian beam pattern
+# whose standard deviation is BEAM_ELEVATION_DEG
+BEAM_ELEVATION_DEG = 8.0
+# Number of pairs rendered by a worker process per task
+GENERATOR_CHUNK = 32
+
+# Per-process state used by the dataset generator workers
+_worker = {}
+
+def make_cropping_params(radius=600, aperture=40, margin=40):
+    """
+    Return sonar cropping parameters for a synthetic Oculus display, in the
+    format written by the sonar cropping tool.
+    """
+    half_angle = np.radians(aperture / 2)
+    half_width = int(np.ceil(radius * np.sin(half_angle)))
+    center_x = margin + half_width
+    center_y = margin + radius
+    return {"crop_left": center_x - half_width,
+            "crop_right": center_x + half_width,
+            "crop_top": center_y - radius,
+            "crop_bottom": center_y,
+            "angle_start": -aperture / 2,
+            "angle_end": aperture / 2,
+            "center": [center_x, center_y],
+            "radius": radius}
+
+def random_board_poses(nposes, rng, distance=(0.8, 1.6), tilt_deg=30.0, offset=0.15):
+    """
+    Generate camera->board poses with the board in front of the camera.
+    Returns (N, 3) rvecs and (N, 3) tvecs.
+    """
+    _, board = charuco_utils.make_charuco_board()
+    cx, cy = charuco_utils.get_board_center(board)
+    rvecs = rng.uniform(-1, 1, (nposes, 3)) * np.radians(tilt_deg) * np.array([1.0, 1.0, 0.3])
+    center = np.column_stack([
+        rng.uniform(-offset, offset, nposes),
+        rng.uniform(-offset, offset, nposes),
+        rng.uniform(distance[0], distance[1], nposes),
+    ])
+    # Place the middle of the board (not its corner) at the sampled location
+    tvecs = center - pose_utils.exp_so3(rvecs) @ np.array([cx, cy, 0.0])
+    return rvecs, tvecs
+
+def render_charuco_image(board, mtx, rvec, tvec, image_size, background=200):
+    """
+    Render a (pinhole, undistorted) grayscale camera image of the charuco board.
+    image_size is (width, height).
+    """
+    ncols, nrows = board.getChessboardSize()
+    texture = board.generateImage((ncols * SQUARE_PIXELS, nrows * SQUARE_PIXELS), None, 0, 1)
+    width_m = ncols * board.getSquareLength()
+    height_m = nrows * board.getSquareLength()
+    board_corners = np.array([[0, 0, 0], [width_m, 0, 0],
+                              [width_m, height_m, 0], [0, height_m, 0]], dtype=np.float64)
+    image_corners, _ = cv2.projectPoints(board_corners, np.asarray(rvec, dtype=np.float64),
+                                         np.asarray(tvec, dtype=np.float64), np.asarray(mtx), None)
+    texture_corners = np.array([[0, 0], [texture.shape[1], 0],
+                                [texture.shape[1], texture.shape[0]], [0, texture.shape[0]]],
+                               dtype=np.float32)
+    homography = cv2.getPerspectiveTransform(texture_corners, image_corners.reshape(4, 2).astype(np.float32))
+    return cv2.warpPerspective(texture, homography, image_size, flags=cv2.INTER_AREA,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=background)
+
+def render_sonar_image(sonar, angles_deg, ranges_m, rng, intensities=None, noise=25.0, spot_pixels=4):
+    """
+    Render a raw cartesian sonar display like the images saved by the Oculus
+    software, with a bright return at each (angle, range).
+    """
+    params = sonar.crop_params
+    center = tuple(params["center"])
+    radius = params["radius"]
+    height = params["crop_bottom"] + params["crop_top"]
+    width = params["crop_right"] + params["crop_left"]
+
+    mask = np.zeros((height, width), dtype="uint8")
+    cv2.ellipse(mask, center, (radius, radius), 0.0,
+                params["angle_start"] + 270, params["angle_end"] + 270, (255), -1)
+
+    returns = np.zeros((height, width), dtype=np.float32)
+    if intensities is None:
+        intensities = np.full(len(angles_deg), 255.0)
+    r_pix = np.asarray(ranges_m) * sonar.range_bins / sonar.range
+    th_rad = np.radians(angles_deg)
+    xs = center[0] + r_pix * np.sin(th_rad)
+    ys = center[1] - r_pix * np.cos(th_rad)
+    for xx, yy, value in zip(xs, ys, intensities):
+        cv2.circle(returns, (int(round(xx)), int(round(yy))), spot_pixels, float(value), -1)
+    returns = cv2.GaussianBlur(returns, (0, 0), spot_pixels / 2)
+
+    speckle = rng.rayleigh(noise, (height, width)).astype(np.float32)
+    image = np.clip(speckle + returns, 0, 255).astype(np.uint8)
+    return cv2.bitwise_and(image, image, mask=mask)
+
+def synthetic_correspondences(sonar, cs_rvec, cs_tvec, nframes, rng, noise_px=1.0, labels_per_frame=10):
+    """
+    Build calibration_results in the gui's format for nframes random board poses,
+    with sonar points generated from the given camera->sonar transform.
+    """
+    all_targets = isc.get_target_table().points.T
+    cs_pose = pose_utils.as_poses(cs_rvec, cs_tvec)
+    rvecs, tvecs = random_board_poses(nframes, rng)
+    board_poses = pose_utils.as_poses(rvecs, tvecs)
+
+    results = {}
+    start = np.datetime64("2025-01-01T00:00:00")
+    for ii in range(nframes):
+        chosen = rng.choice(all_targets.shape[1], size=labels_per_frame, replace=False)
+        camera_points = pose_utils.apply(board_poses[ii], all_targets[:, chosen])[0]
+        sonar_points = isc.polar_from_3d(pose_utils.apply(cs_pose, camera_points)[0])
+        sonar_points[0, :] += rng.normal(0, noise_px * sonar.th_res, labels_per_frame)
+        sonar_points[1, :] += rng.normal(0, noise_px * sonar.r_res, labels_per_frame)
+        results[start + np.timedelta64(ii, "s")] = (None, sonar_points, camera_points)
+    return results
+
+def sonar_visible_board_poses(nposes, cs_rvec, cs_tvec, aperture, range_m, rng, max_tries=100):
+    """
+    Sample camera->board poses (as random_board_poses) whose board center lies
+    inside the sonar's aperture (degrees) and range (meters), given the
+    camera->sonar transform.
+    """
+    _, board = charuco_utils.make_charuco_board()
+    center = np.array([*charuco_utils.get_board_center(board), 0.0])
+    cs_pose = pose_utils.as_poses(cs_rvec, cs_tvec)
+
+    rvecs, tvecs = [], []
+    for _ in range(max_tries):
+        candidate_r, candidate_t = random_board_poses(nposes, rng)
+        # Board centers of every candidate in the sonar frame, as (N, 3)
+        sonar_poses = pose_utils.compose(cs_pose, pose_utils.as_poses(candidate_r, candidate_t))
+        sonar_centers = pose_utils.apply(sonar_poses, center.reshape(3, 1))[:, :, 0]
+        angles, ranges = isc.polar_from_3d(sonar_centers.T)
+        visible = (np.abs(angles) < 0.4 * aperture) & (0.1 * range_m < ranges) & (ranges < 0.9 * range_m)
+        rvecs.extend(candidate_r[visible])
+        tvecs.extend(candidate_t[visible])
+        if len(rvecs) >= nposes:
+            return np.array(rvecs[:nposes]), np.array(tvecs[:nposes])
+    raise Exception("Could not find {} board poses inside the sonar's field of view".format(nposes))
+
+def distortion_maps(mtx, dst, image_size):
+    """
+    Remap tables that take an ideal pinhole image to one with the lens
+    distortion dst. For every pixel of the distorted image they hold the
+    location of the same ray in the pinhole image.
+    """
+    width, height = image_size
+    xs, ys = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+    pixels = np.stack([xs.ravel(), ys.ravel()], axis=1).reshape(-1, 1, 2)
+    ideal = cv2.undistortPoints(pixels, np.asarray(mtx), np.asarray(dst), P=np.asarray(mtx))
+    ideal = ideal.reshape(height, width, 2)
+    return ideal[:, :, 0].copy(), ideal[:, :, 1].copy()
+
+def target_polar_coords(cs_rvec, cs_tvec, board_rvec, board_tvec, target_points):
+    """
+    Polar (angle, range) and elevation (degrees) of the targets as seen by the sonar.
+    target_points is a (3, T) array in the board frame.
+    """
+    sonar_pose = pose_utils.compose(pose_utils.as_poses(cs_rvec, cs_tvec),
+                                    pose_utils.as_poses(board_rvec, board_tvec))
+    sonar_points = pose_utils.apply(sonar_pose, target_points)[0]
+    polar = isc.polar_from_3d(sonar_points)
+    # The sonar frame has y down, so elevation is measured upwards from -y
+    elevation = np.degrees(np.arcsin(-sonar_points[1, :] / polar[1, :]))
+    return polar, elevation
+
+def _init_generator_worker(rootdir, camera_json, sonar_range, wide, image_size, cs_rvec, cs_tvec, seed):
+    with open(camera_json, 'r') as file:
+        camera_params = json.load(file)
+    mtx = np.array(camera_params['mtx'])
+    dst = np.array(camera_params['dist'])
+    _, board, _ = isc.init_charuco_sonar()
+    _worker.update({
+        "rootdir": rootdir,
+        "mtx": mtx,
+        "maps": distortion_maps(mtx, dst, image_size),
+        "image_size": image_size,
+        "board": board,
+        "targets": isc.get_target_table().points.T,
+        "sonar": isc.SonarInfo(sonar_range, wide, f"{rootdir}/sonar_cropping_params.json"),
+        "cs_rvec": cs_rvec,
+        "cs_tvec": cs_tvec,
+        "seed": seed,
+    })
+
+def _generate_pairs(jobs):
+    """
+    Render and save the (index, time string, board rvec, board tvec) jobs.
+    """
+    state = _worker
+    for index, time_str, rvec, tvec in jobs:
+        rng = np.random.default_rng((state["seed"], index))
+
+        pinhole = render_charuco_image(state["board"], state["mtx"], rvec, tvec, state["image_size"])
+        camera_im = cv2.remap(pinhole, *state["maps"], cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=200)
+        camera_im = np.clip(camera_im + rng.normal(0, 3, camera_im.shape), 0, 255).astype(np.uint8)
+
+        polar, elevation = target_polar_coords(state["cs_rvec"], state["cs_tvec"], rvec, tvec, state["targets"])
+        intensities = 255.0 * np.exp(-0.5 * (elevation / BEAM_ELEVATION_DEG) ** 2)
+        sonar_im = render_sonar_image(state["sonar"], polar[0, :], polar[1, :], rng, intensities)
+
+        cv2.imwrite(f"{state['rootdir']}/camera/{time_str}.png", camera_im)
+        cv2.imwrite(f"{state['rootdir']}/sonar/Oculus_{time_str}.jpg", sonar_im)
+    return len(jobs)
+
+def generate_dataset(rootdir, camera_json, cs_rvec, cs_tvec, board_rvecs, board_tvecs,
+                     sonar_range=3.0, wide=False, crop_params=None, image_size=None,
+                     start="2025-01-01T00:00:00", seed=0, workers=None):
+    """
+    Write a camera/sonar dataset with a known camera->sonar transform to rootdir.
+
+    One image pair is rendered per board pose. Camera images use the intrinsics
+    and distortion in camera_json; sonar images place a return at the polar
+    location of every bolt. Files are named with one-second timestamps starting
+    at `start`, following the convention SensorData expects, and the
+    sonar_cropping_params.json and inputparams.json needed by the gui are written
+    alongside a ground_truth.json containing the transforms used.
+    """
+    for folder in ("camera", "sonar", "output"):
+        os.makedirs(f"{rootdir}/{folder}", exist_ok=True)
+
+    with open(camera_json, 'r') as file:
+        mtx = np.array(json.load(file)['mtx'])
+    if image_size is None:
+        # Assume the principal point is near the image center
+        image_size = (int(round(2 * mtx[0, 2])), int(round(2 * mtx[1, 2])))
+    if crop_params is None:
+        crop_params = make_cropping_params(aperture=130 if wide else 40)
+
+    cs_rvec = [float(v) for v in np.ravel(cs_rvec)]
+    cs_tvec = [float(v) for v in np.ravel(cs_tvec)]
+    board_rvecs = np.reshape(board_rvecs, (-1, 3))
+    board_tvecs = np.reshape(board_tvecs, (-1, 3))
+
+    start = np.datetime64(start, "s")
+    time_strs = [(start + np.timedelta64(ii, "s")).item().strftime("%Y%m%d_%H%M%S")
+                 for ii in range(len(board_rvecs))]
+
+    with open(f"{rootdir}/sonar_cropping_params.json", 'w') as file:
+        json.dump(crop_params, file, indent=4)
+    with open(f"{rootdir}/inputparams.json", 'w') as file:
+        json.dump({"sonar_range": sonar_range, "sonar_wide": wide,
+                   "ext_t": cs_tvec, "ext_r": cs_rvec}, file, indent=4)
+    with open(f"{rootdir}/ground_truth.json", 'w') as file:
+        json.dump({"cs_rvec": cs_rvec, "cs_tvec": cs_tvec,
+                   "camera_poses": {time_str: {"rvec": rvec.tolist(), "tvec": tvec.tolist()}
+                                    for time_str, rvec, tvec in zip(time_strs, board_rvecs, board_tvecs)}},
+                  file, indent=4)
+
+    jobs = list(zip(range(len(time_strs)), time_strs, board_rvecs, board_tvecs))
+    chunks = [jobs[ii:ii + GENERATOR_CHUNK] for ii in range(0, len(jobs), GENERATOR_CHUNK)]
+    init_args = (rootdir, camera_json, sonar_range, wide, image_size, cs_rvec, cs_tvec, seed)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_generator_worker,
+                             initargs=init_args) as executor:
+        for count in executor.map(_generate_pairs, chunks):
+            done += count
+            print("Generated {} of {} image pairs".format(done, len(jobs)), end="\r")
+    print()
+    return time_strs
+
+if __name__ == "__main__":
+    # Folder that the dataset will be written to, in the layout used by calibration_gui
+    rootdir = "C:/Users/corri/OneDrive/Documents/SonarExperimentData/synthetic"
+    camera_json = "../underwater_cam.json"
+    npairs = 1000
+    # Camera -> sonar transform used to render the data
+    cs_rvec = (0.0, -0.2618, 0.0)
+    cs_tvec = (0.2092, -0.1608, 0.1032)
+
+    rng = np.random.default_rng(0)
+    board_rvecs, board_tvecs = sonar_visible_board_poses(npairs, cs_rvec, cs_tvec, 40, 3.0, rng)
+    generate_dataset(rootdir, camera_json, cs_rvec, cs_tvec, board_rvecs, board_tvecs, sonar_range=3.0)
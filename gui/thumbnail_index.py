@@ -0,0 +1,167 @@
+import os
+import json
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import image_sonar_utils as isc
+
+# (width, height) of the thumbnails. Camera images are scaled to fit and padded
+# with black; the polar sonar image is stretched to fill, as the gui shows it.
+CAMERA_THUMB_SIZE = (160, 120)
+SONAR_THUMB_SIZE = (160, 100)
+# Bump this when the thumbnail contents change, so old caches are rebuilt
+INDEX_VERSION = 1
+# Pairs handed to each worker at a time
+CHUNKSIZE = 8
+
+def fit_thumbnail(image, size):
+    """
+    Scale image to fit within size (width, height), centered on a black background.
+    """
+    width, height = size
+    scale = min(width / image.shape[1], height / image.shape[0])
+    new_w = max(1, int(round(image.shape[1] * scale)))
+    new_h = max(1, int(round(image.shape[0] * scale)))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    thumb = np.zeros((height, width) + image.shape[2:], dtype=np.uint8)
+    top = (height - new_h) // 2
+    left = (width - new_w) // 2
+    thumb[top:top + new_h, left:left + new_w] = resized
+    return thumb
+
+# Set once in each worker process by _init_worker
+_worker_data = None
+
+def _init_worker(sonar_folder, camera_folder, sonar_params, polar_transform):
+    global _worker_data
+    _worker_data = (sonar_folder, camera_folder, sonar_params, polar_transform)
+
+def make_thumbnails(job):
+    """
+    Camera (BGR) and polar sonar (gray, range increasing upwards as in the gui)
+    thumbnails for one pair. Runs in a worker process.
+    Returns (index, camera_thumb, sonar_thumb); a thumb is None if its file couldn't be read.
+    """
+    idx, sonarfile, camerafile = job
+    sonar_folder, camera_folder, sonar_params, polar_transform = _worker_data
+
+    camera_thumb = None
+    image = cv2.imread(f"{camera_folder}/{camerafile}", cv2.IMREAD_REDUCED_COLOR_4)
+    if image is not None:
+        camera_thumb = fit_thumbnail(image, CAMERA_THUMB_SIZE)
+
+    sonar_thumb = None
+    sonar = cv2.imread(f"{sonar_folder}/{sonarfile}", cv2.IMREAD_GRAYSCALE)
+    if sonar is not None:
+        polar = isc.polar_sonar_image(isc.crop_sonar_arc(sonar, sonar_params), polar_transform)
+        # Shown as in the gui: origin="lower", stretched to fill (aspect="auto")
+        sonar_thumb = cv2.resize(polar[::-1], SONAR_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    return idx, camera_thumb, sonar_thumb
+
+class ThumbnailIndex():
+    """
+    Small camera and polar sonar previews for every pair in a SensorData,
+    cached in <outdir>/thumbnails so they only have to be generated once.
+
+    The thumbnails are stored as memory-mapped .npy arrays (one row per pair),
+    so any of them can be read without loading the rest. index.json records the
+    pairs and settings the cache was made for; if they no longer match, the
+    cache is recreated. ready[idx] is set once a pair's thumbnails are written,
+    so an interrupted build picks up where it stopped.
+    """
+    def __init__(self, paired_data, polar_transform, outdir):
+        self.paired_data = paired_data
+        self.polar_transform = polar_transform
+        self.folder = f"{outdir}/thumbnails"
+        self.index_file = f"{self.folder}/index.json"
+        self.length = paired_data.length
+        self.open()
+
+    def describe(self):
+        """
+        What the cache depends on: the settings and every pair's files.
+        """
+        sonar = self.paired_data.sonar_params
+        return {
+            "version": INDEX_VERSION,
+            "camera_size": list(CAMERA_THUMB_SIZE),
+            "sonar_size": list(SONAR_THUMB_SIZE),
+            "aper": sonar.aper,
+            "crop_params": sonar.crop_params,
+            "pairs": self.paired_data.file_list(),
+        }
+
+    def open(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        description = self.describe()
+        cached = None
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, "r") as fp:
+                    cached = json.load(fp)
+            except Exception as ex:
+                print("Could not read thumbnail index {}: {}".format(self.index_file, ex))
+
+        camera_shape = (self.length, CAMERA_THUMB_SIZE[1], CAMERA_THUMB_SIZE[0], 3)
+        sonar_shape = (self.length, SONAR_THUMB_SIZE[1], SONAR_THUMB_SIZE[0])
+        files = [f"{self.folder}/{name}.npy" for name in ("camera", "sonar", "ready")]
+        if cached == description and all(os.path.exists(fname) for fname in files):
+            try:
+                self.camera = np.load(files[0], mmap_mode="r+")
+                self.sonar = np.load(files[1], mmap_mode="r+")
+                self.ready = np.load(files[2], mmap_mode="r+")
+                if self.camera.shape == camera_shape and self.sonar.shape == sonar_shape:
+                    print("Loaded thumbnail index: {} of {} pairs ready".format(
+                        int(np.count_nonzero(self.ready)), self.length))
+                    return
+            except Exception as ex:
+                print("Could not open thumbnail cache: {}".format(ex))
+
+        print("Creating thumbnail index in {}".format(self.folder))
+        open_memmap = np.lib.format.open_memmap
+        self.camera = open_memmap(files[0], mode="w+", dtype=np.uint8, shape=camera_shape)
+        self.sonar = open_memmap(files[1], mode="w+", dtype=np.uint8, shape=sonar_shape)
+        self.ready = open_memmap(files[2], mode="w+", dtype=np.uint8, shape=(self.length,))
+        with open(self.index_file, "w") as fp:
+            json.dump(description, fp)
+
+    def missing(self):
+        return np.flatnonzero(self.ready == 0)
+
+    def is_ready(self, idx):
+        return bool(self.ready[idx])
+
+    def build(self, workers=None, progress=None, stop=None):
+        """
+        Generate the thumbnails that aren't cached yet, in a pool of worker processes.
+        progress(done, total) is called as results come in; if stop (a threading.Event)
+        is set, the remaining work is abandoned. Returns the number of thumbnails written.
+        """
+        missing = self.missing()
+        total = len(missing)
+        if total == 0:
+            return 0
+        sonar_params = self.paired_data.sonar_params
+        jobs = [(int(idx),) + self.paired_data.get_filenames(idx) for idx in missing]
+        initargs = (self.paired_data.sonar_folder, self.paired_data.camera_folder,
+                    sonar_params, self.polar_transform)
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            for idx, camera_thumb, sonar_thumb in executor.map(make_thumbnails, jobs, chunksize=CHUNKSIZE):
+                if stop is not None and stop.is_set():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                if camera_thumb is not None:
+                    self.camera[idx] = camera_thumb
+                if sonar_thumb is not None:
+                    self.sonar[idx] = sonar_thumb
+                self.ready[idx] = 1
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+        self.camera.flush()
+        self.sonar.flush()
+        self.ready.flush()
+        return done
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from collections import deque
+
+# Set this environment variable to 1 (or pass --timing to the gui) to record timings
+ENV_VAR = "SONAR_CALIB_TIMING"
+# Number of recent durations kept per stage for the summary statistics
+HISTORY = 1000
+# Number of recent spans kept for the trace export
+MAX_EVENTS = 100000
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span():
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.name, self.start, time.perf_counter())
+        return False
+
+class StageTimer():
+    """
+    Records how long named stages take.
+
+    Use `with timer.span("name"):` around a block or `@timer.timed("name")` on a
+    function. When disabled, spans cost a single attribute check. Each stage keeps
+    a rolling window of its most recent durations, and every span is also kept as
+    a trace event that can be exported for chrome://tracing or Perfetto.
+    """
+    def __init__(self, enabled=False, history=HISTORY):
+        self.enabled = enabled
+        self.history = history
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}
+            self.counts = {}
+            self.events = deque(maxlen=MAX_EVENTS)
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name=None):
+        def decorator(fn):
+            stage = name or fn.__name__
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            return wrapper
+        return decorator
+
+    def record(self, name, start, end):
+        with self.lock:
+            if name not in self.durations:
+                self.durations[name] = deque(maxlen=self.history)
+                self.counts[name] = 0
+            self.durations[name].append(end - start)
+            self.counts[name] += 1
+            self.events.append((name, start, end, threading.get_ident()))
+
+    def summary(self):
+        """
+        Per-stage statistics in milliseconds over the rolling window.
+        """
+        with self.lock:
+            durations = {name: np.array(values) * 1000 for name, values in self.durations.items()}
+            counts = dict(self.counts)
+        stats = {}
+        for name, values in durations.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            stats[name] = {"count": counts[name], "mean_ms": float(values.mean()),
+                           "p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99),
+                           "max_ms": float(values.max())}
+        return stats
+
+    def print_summary(self):
+        stats = self.summary()
+        print("{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}".format("stage", "count", "mean", "p50", "p90", "max"))
+        for name, st in sorted(stats.items(), key=lambda item: -item[1]["mean_ms"] * item[1]["count"]):
+            print("{:<28}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+                name, st["count"], st["mean_ms"], st["p50_ms"], st["p90_ms"], st["max_ms"]))
+
+    def export_chrome_trace(self, filename):
+        """
+        Write the recorded spans in the Chrome trace event format.
+        """
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                  "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+                 for name, start, end, tid in events]
+        with open(filename, "w") as fp:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, fp)
+
+    def export(self, outdir):
+        """
+        Save the trace and summary statistics to outdir.
+        """
+        trace_filename = "{}/timing_trace.json".format(outdir)
+        summary_filename = "{}/timing_summary.json".format(outdir)
+        self.export_chrome_trace(trace_filename)
+        with open(summary_filename, "w") as fp:
+            json.dump(self.summary(), fp, indent=4)
+        print("Timing data saved to {} and {}".format(trace_filename, summary_filename))
+
+timer = StageTimer(enabled=os.environ.get(ENV_VAR, "0") not in ("", "0"))
+span = timer.span
+timed = timer.timed
+
+def enable():
+    timer.enabled = True